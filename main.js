@@ -190,6 +190,30 @@ ipcMain.handle('predict', async (event, data) => {
   }
 });
 
+// 处理批量预测请求，每完成一条预测就通过 predictBatchItem 事件推送给渲染进程
+ipcMain.handle('predictBatch', async (event, data) => {
+  try {
+    console.log('收到批量预测请求:', data);
+    
+    // 验证输入数据
+    if (!data || !Array.isArray(data.timeSpans) || data.timeSpans.length === 0) {
+      throw new Error('无效的批量预测请求数据');
+    }
+    
+    // 检查API密钥是否已设置
+    if (!config.quantum.apiKey) {
+      throw new Error('请先设置国盾量子API密钥');
+    }
+    
+    return await quantumEngine.getFortunePredictions(data.timeSpans, data.birthDate, (prediction, index) => {
+      event.sender.send('predictBatchItem', { index, prediction });
+    });
+  } catch (error) {
+    console.error('批量预测过程中出错:', error);
+    throw error;
+  }
+});
+
 // 处理获取量子电路数据请求
 ipcMain.handle('getQuantumCircuit', async (event) => {
   try {
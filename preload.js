@@ -19,6 +19,29 @@ contextBridge.exposeInMainWorld('quantumAPI', {
     }
   },
   
+  // 批量预测多个时间范围，onItem(预测, 下标) 在每条预测完成时调用
+  predictBatch: async (data, onItem) => {
+    const listener = (event, item) => {
+      if (onItem) {
+        onItem(item.prediction, item.index);
+      }
+    };
+    try {
+      // 验证输入数据
+      if (!data || !Array.isArray(data.timeSpans) || data.timeSpans.length === 0) {
+        throw new Error('无效的批量预测请求数据');
+      }
+      
+      ipcRenderer.on('predictBatchItem', listener);
+      return await ipcRenderer.invoke('predictBatch', data);
+    } catch (error) {
+      console.error('批量预测请求失败:', error);
+      throw new Error(`批量预测失败: ${error.message}`);
+    } finally {
+      ipcRenderer.removeListener('predictBatchItem', listener);
+    }
+  },
+  
   // 获取当前日期和时间
   getCurrentDateTime: () => {
     const now = new Date();
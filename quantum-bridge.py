@@ -5,34 +5,790 @@
 量子桥接模块 - 连接JavaScript应用程序和国盾量子SDK
 """
 
+import time
+
+# 记录模块开始加载的时间，用于启动耗时分析
+MODULE_LOAD_START = time.perf_counter()
+
 import sys
+import os
 import json
 import traceback
-import numpy as np
-from datetime import datetime
+import importlib
+import importlib.util
+import tempfile
+from datetime import datetime, timedelta
 import random
 import math
-import time
+import hashlib
+import tracemalloc
+import itertools
+import threading
+import contextlib
+import operator
+import weakref
+from array import array
+from collections import OrderedDict, deque
+
+# 是否在命令输出中附带启动耗时分析（由 --profile-startup 参数开启）
+PROFILE_STARTUP = False
+
+# 是否在预测结果中附带 metadata（各阶段耗时、是否命中缓存），由 --profile 参数开启
+PROFILE_TIMINGS = False
+
+# 是否以NDJSON流的形式逐条输出记录（由 --stream 参数开启）
+STREAM_OUTPUT = False
+
+# 常驻服务的多个工作线程共用标准输出，每条记录在锁内整行写出
+OUTPUT_LOCK = threading.Lock()
+
+# 流式输出中两条进度记录之间的最小间隔（秒）
+STREAM_PROGRESS_INTERVAL = 0.5
+
+# 流式批量预测每次读取并模拟的请求数
+STREAM_BATCH_CHUNK = 64
+
+# 延迟导入的模块及其导入耗时
+IMPORT_TIMINGS = []
+
+class LazyModule:
+    """首次访问属性时才导入的模块代理
+
+    导入后会把模块全局变量替换为真实模块，之后的访问不再经过代理。
+    """
+    
+    def __init__(self, name, binding):
+        self._name = name
+        self._binding = binding
+    
+    def _load(self):
+        start = time.perf_counter()
+        loaded_before = len(sys.modules)
+        module = importlib.import_module(self._name)
+        IMPORT_TIMINGS.append({
+            "module": self._name,
+            "seconds": time.perf_counter() - start,
+            "modules_loaded": len(sys.modules) - loaded_before
+        })
+        globals()[self._binding] = module
+        return module
+    
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+# numpy 只在需要模拟或分析时才导入，devices 等命令不会加载它
+np = LazyModule("numpy", "np")
+
+# asyncio 只在使用作业管理器时才导入
+asyncio = LazyModule("asyncio", "asyncio")
+
+def configure_stdio():
+    """设置标准输入输出的编码"""
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdin.reconfigure(encoding='utf-8')
+        sys.stdout.reconfigure(encoding='utf-8')
+        sys.stderr.reconfigure(encoding='utf-8')
+    else:
+        import io
+        sys.stdin = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+# 国盾量子SDK探测结果，None 表示尚未探测
+HAS_QGD_SDK = None
+
+# 国盾量子SDK探测结果的磁盘缓存及其有效期（秒）
+SDK_PROBE_CACHE_PATH = os.path.join(tempfile.gettempdir(), "quantum-bridge-sdk-probe.json")
+SDK_PROBE_TTL = 24 * 3600
+
+def has_qgd_sdk():
+    """检查国盾量子SDK是否可用
+
+    探测结果会缓存到磁盘，有效期内的后续启动不再重新搜索SDK。
+    探测只查找模块而不导入，真正需要SDK时再调用 load_qgd_sdk。
+    """
+    global HAS_QGD_SDK
+    if HAS_QGD_SDK is not None:
+        return HAS_QGD_SDK
+    
+    start = time.perf_counter()
+    cached = None
+    try:
+        with open(SDK_PROBE_CACHE_PATH, encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        pass
+    
+    # 模块搜索路径变化（例如通过 PYTHONPATH 指向本地替身SDK）时重新探测
+    search_path = hashlib.sha1(json.dumps(sys.path).encode("utf-8")).hexdigest()
+    if (isinstance(cached, dict) and cached.get("python") == sys.executable
+            and cached.get("search_path") == search_path
+            and time.time() - cached.get("checked_at", 0) < SDK_PROBE_TTL):
+        HAS_QGD_SDK = bool(cached.get("available"))
+        source = "cache"
+    else:
+        HAS_QGD_SDK = importlib.util.find_spec("ezQgd") is not None
+        source = "probe"
+        try:
+            with open(SDK_PROBE_CACHE_PATH, "w", encoding="utf-8") as f:
+                json.dump({
+                    "python": sys.executable,
+                    "search_path": search_path,
+                    "available": HAS_QGD_SDK,
+                    "checked_at": time.time()
+                }, f)
+        except OSError as e:
+            sys.stderr.write(f"无法写入SDK探测缓存: {str(e)}\n")
+    
+    IMPORT_TIMINGS.append({"module": f"ezQgd ({source})", "seconds": time.perf_counter() - start, "modules_loaded": 0})
+    if not HAS_QGD_SDK:
+        sys.stderr.write("警告: 未找到国盾量子SDK (ezQgd)，将使用模拟模式\n")
+    return HAS_QGD_SDK
+
+def load_qgd_sdk():
+    """导入并返回国盾量子SDK模块，不可用时返回None"""
+    global HAS_QGD_SDK
+    if not has_qgd_sdk():
+        return None
+    try:
+        start = time.perf_counter()
+        module = importlib.import_module("ezQgd")
+        IMPORT_TIMINGS.append({"module": "ezQgd", "seconds": time.perf_counter() - start, "modules_loaded": 0})
+        return module
+    except ImportError as e:
+        sys.stderr.write(f"导入国盾量子SDK失败: {str(e)}，将使用模拟模式\n")
+        HAS_QGD_SDK = False
+        return None
+
+def get_startup_profile():
+    """返回启动耗时分析"""
+    return {
+        "module_load_seconds": MODULE_LOAD_END - MODULE_LOAD_START,
+        "elapsed_seconds": time.perf_counter() - MODULE_LOAD_START,
+        "imports": list(IMPORT_TIMINGS)
+    }
+
+# 性能分析文件（--profile、--trace-memory）的输出目录
+PROFILE_DIR = os.environ.get("QUANTUM_BRIDGE_PROFILE_DIR", tempfile.gettempdir())
+
+# 各阶段累计的调用次数、墙钟时间和CPU时间，常驻服务模式下通过 stats 命令查看
+STAGE_TOTALS = {}
+STAGE_TOTALS_LOCK = threading.Lock()
+
+# 每个线程当前正在收集的阶段计时和嵌套阶段栈
+_STAGE_STATE = threading.local()
+
+# 每个线程当前处理的请求所属会话和截止时间（time.monotonic），由常驻服务设置
+_REQUEST_STATE = threading.local()
+
+# 未指定会话的请求（包括单次命令）使用的会话名
+DEFAULT_SESSION = "default"
+
+class DeadlineExceeded(TimeoutError):
+    """请求超过截止时间，在下一个阶段开始时抛出以尽早停止剩余计算"""
+
+@contextlib.contextmanager
+def request_context(session=None, deadline=None):
+    """在当前线程中设置请求的会话和截止时间（time.monotonic 时刻）"""
+    previous = (getattr(_REQUEST_STATE, "session", None), getattr(_REQUEST_STATE, "deadline", None))
+    _REQUEST_STATE.session, _REQUEST_STATE.deadline = session, deadline
+    try:
+        yield
+    finally:
+        _REQUEST_STATE.session, _REQUEST_STATE.deadline = previous
+
+def current_session():
+    """返回当前线程所处理请求的会话名"""
+    return getattr(_REQUEST_STATE, "session", None) or DEFAULT_SESSION
+
+def check_request_deadline():
+    """当前请求已超过截止时间时抛出 DeadlineExceeded"""
+    deadline = getattr(_REQUEST_STATE, "deadline", None)
+    if deadline is not None and time.monotonic() > deadline:
+        raise DeadlineExceeded("请求超过截止时间")
+
+@contextlib.contextmanager
+def timed_stage(name):
+    """记录一个阶段的墙钟时间和CPU时间，也可以作为装饰器使用
+
+    阶段可以嵌套，外层阶段只记录扣除内层阶段后的自身耗时，因此各阶段之和
+    等于总耗时。结果累加到当前线程正在收集的计时（见 collect_stage_timings）
+    和全局累计计数 STAGE_TOTALS 中。当前请求已超过截止时间时在进入阶段前抛出
+    DeadlineExceeded。
+    """
+    check_request_deadline()
+    stack = getattr(_STAGE_STATE, "stack", None)
+    if stack is None:
+        stack = _STAGE_STATE.stack = []
+    stack.append([0.0, 0.0])
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.thread_time() - cpu_start
+        child_wall, child_cpu = stack.pop()
+        if stack:
+            stack[-1][0] += wall
+            stack[-1][1] += cpu
+        self_wall = wall - child_wall
+        self_cpu = cpu - child_cpu
+        
+        timings = getattr(_STAGE_STATE, "timings", None)
+        if timings is not None:
+            entry = timings.setdefault(name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0})
+            entry["calls"] += 1
+            entry["wall_seconds"] += self_wall
+            entry["cpu_seconds"] += self_cpu
+        with STAGE_TOTALS_LOCK:
+            total = STAGE_TOTALS.setdefault(
+                name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "max_wall_seconds": 0.0}
+            )
+            total["calls"] += 1
+            total["wall_seconds"] += self_wall
+            total["cpu_seconds"] += self_cpu
+            total["max_wall_seconds"] = max(total["max_wall_seconds"], self_wall)
+
+@contextlib.contextmanager
+def collect_stage_timings():
+    """收集当前线程中各阶段的计时，返回 {阶段: {calls, wall_seconds, cpu_seconds}}
+
+    已经在收集时沿用外层的字典，使整个请求的阶段计时汇总到一处。
+    """
+    timings = getattr(_STAGE_STATE, "timings", None)
+    if timings is not None:
+        yield timings
+        return
+    _STAGE_STATE.timings = timings = {}
+    try:
+        yield timings
+    finally:
+        _STAGE_STATE.timings = None
+
+def snapshot_stage_timings(timings):
+    """复制阶段计时，之后的阶段不再影响已经写入结果的数值"""
+    return {name: dict(entry) for name, entry in timings.items()}
+
+def get_stage_totals():
+    """返回各阶段累计计时的副本"""
+    with STAGE_TOTALS_LOCK:
+        return {name: dict(total) for name, total in STAGE_TOTALS.items()}
+
+def start_command_profiling(profile=False, trace_memory=False):
+    """按需开启 cProfile 和 tracemalloc，返回传给 finish_command_profiling 的状态"""
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(25)
+    return {"profiler": profiler, "trace_memory": trace_memory, "started_tracing": started_tracing}
+
+def finish_command_profiling(state, label):
+    """停止性能分析，把结果写入 PROFILE_DIR，摘要写入标准错误，返回输出文件路径"""
+    profiler = state["profiler"]
+    if profiler is not None:
+        profiler.disable()
+    
+    # 先取内存快照，避免把下面整理分析结果时的分配计入其中
+    snapshot = None
+    if state["trace_memory"] and tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if state["started_tracing"]:
+            tracemalloc.stop()
+    
+    prefix = os.path.join(PROFILE_DIR, f"quantum-bridge-{label}-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}")
+    paths = {}
+    if profiler is not None:
+        import io
+        import pstats
+        paths["profile"] = prefix + ".prof"
+        profiler.dump_stats(paths["profile"])
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(15)
+        sys.stderr.write(f"cProfile 结果已保存到 {paths['profile']}\n{summary.getvalue()}")
+    if snapshot is not None:
+        paths["tracemalloc"] = prefix + ".tracemalloc"
+        snapshot.dump(paths["tracemalloc"])
+        sys.stderr.write(f"tracemalloc 结果已保存到 {paths['tracemalloc']}，当前 {current} 字节，峰值 {peak} 字节\n")
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, "*cProfile.py")])
+        for statistic in snapshot.statistics("lineno")[:10]:
+            sys.stderr.write(f"  {statistic}\n")
+    return paths
+
+# 态向量模拟器支持的最大量子比特数
+MAX_SIMULATOR_QUBITS = 24
+
+# 精确模式下视为零的概率阈值
+EXACT_PROBABILITY_TOLERANCE = 1e-12
+
+# 会话电路存储最多保存的会话数，超出时淘汰最久未使用的会话
+CIRCUIT_STORE_SIZE = 256
+
+# 编译电路缓存的最大条目数
+CIRCUIT_CACHE_SIZE = 128
+
+# 单次校验最多报告的错误数，达到后停止遍历
+MAX_VALIDATION_ERRORS = 20
+
+# 并行模拟的默认工作进程数（1表示串行），可通过环境变量配置
+DEFAULT_WORKERS = int(os.environ.get("QUANTUM_BRIDGE_WORKERS", "1"))
+
+# 单个态向量达到该量子比特数时才按块分给多个进程
+PARALLEL_MIN_QUBITS = 20
+
+# 达到该量子比特数时优先使用稀疏态向量后端
+SPARSE_MIN_QUBITS = 16
+
+# 稀疏后端支持的最大量子比特数（下标使用int64）
+SPARSE_MAX_QUBITS = 62
+
+# 非零振幅占比超过该阈值时稀疏后端切换为稠密后端
+SPARSE_FILL_THRESHOLD = 0.1
+
+# 稀疏后端中视为零的振幅阈值
+SPARSE_AMPLITUDE_TOLERANCE = 1e-12
+
+def parse_byte_size(text):
+    """解析 "512M"、"8G" 或纯数字形式的字节数"""
+    units = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+    text = str(text).strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+# 稠密态向量（连同测量概率数组）允许占用的内存上限，超出时改用磁盘上的 memmap 态向量
+MEMORY_BUDGET = parse_byte_size(os.environ.get("QUANTUM_BRIDGE_MEMORY_BUDGET", "1G"))
+
+# memmap 态向量文件所在目录，需要足够的磁盘空间（30个量子比特的 complex128 态向量为16GB）
+OUT_OF_CORE_DIR = os.environ.get("QUANTUM_BRIDGE_SCRATCH_DIR", tempfile.gettempdir())
+
+# memmap 态向量每块包含的低位量子比特数（complex128 下每块16MB）
+OUT_OF_CORE_BLOCK_QUBITS = 20
+
+# 一组步骤最多涉及的高位量子比特数，同时在内存中的块数为 2**该值
+OUT_OF_CORE_GATHER_QUBITS = 2
+
+# memmap 后端支持的最大量子比特数
+OUT_OF_CORE_MAX_QUBITS = 36
+
+# 稳定子后端精确分布最多枚举的随机比特数（结果数为 2**该值）
+STABILIZER_MAX_EXACT_BITS = 20
+
+# auto 后端达到该量子比特数时才把Clifford电路交给稳定子后端；更小的电路稠密内核更快
+# （5 个量子比特的预测电路稠密约 0.6ms，稳定子约 1.3ms；16 个量子比特采样时稳定子约 5ms，稠密约 12ms）
+STABILIZER_MIN_QUBITS = 16
+
+# 稳定子后端逐块采样时每块的采样次数
+STABILIZER_SAMPLE_CHUNK = 2**14
+
+# RZ角度视为 π/2 整数倍（可转换为S门）的容差
+CLIFFORD_ANGLE_TOLERANCE = 1e-9
+
+# 预测结果缓存的开关（也可由 --cache 参数开启）、磁盘缓存路径和内存缓存容量
+PREDICTION_CACHE_ENABLED = os.environ.get("QUANTUM_BRIDGE_PREDICTION_CACHE", "") not in ("", "0")
+PREDICTION_CACHE_PATH = os.environ.get(
+    "QUANTUM_BRIDGE_PREDICTION_CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "quantum-bridge-predictions.sqlite")
+)
+PREDICTION_CACHE_SIZE = 1024
+
+# 模拟器作业的状态文件（单次命令之间共享作业）和作业记录的保留时间（秒）
+SIMULATOR_JOB_PATH = os.environ.get(
+    "QUANTUM_BRIDGE_JOB_STATE_PATH",
+    os.path.join(tempfile.gettempdir(), "quantum-bridge-jobs.json")
+)
+SIMULATOR_JOB_RETENTION = 86400
+
+# 作业管理：同时进行的SDK调用数、提交重试次数、状态轮询的退避间隔（秒）和等待超时（秒）
+JOB_MAX_CONCURRENCY = 4
+JOB_SUBMIT_RETRIES = 3
+JOB_POLL_INITIAL_DELAY = 0.2
+JOB_POLL_MAX_DELAY = 5.0
+JOB_TIMEOUT = 300
+
+# 常驻服务：处理请求的工作线程数、排队和执行中的请求数上限，以及拒绝请求时建议的最短重试间隔（秒）
+SERVE_WORKERS = int(os.environ.get("QUANTUM_BRIDGE_SERVE_WORKERS", "4"))
+SERVE_QUEUE_DEPTH = int(os.environ.get("QUANTUM_BRIDGE_SERVE_QUEUE_DEPTH", "64"))
+SERVE_RETRY_AFTER = 0.5
+
+# 每个命令保留最近多少条请求的耗时，用于计算延迟分位数
+LATENCY_WINDOW = 1024
+
+# 可选的模拟精度：complex64 占用的内存是 complex128 的一半
+SIMULATION_PRECISIONS = ("complex64", "complex128")
+DEFAULT_PRECISION = os.environ.get("QUANTUM_BRIDGE_PRECISION", "complex128")
+
+# 两种精度下预测指标允许的最大偏差（tests/test_precision.py 检查）
+PRECISION_DRIFT_TOLERANCE = 1e-4
+
+# 门操作分块处理时每块的最大元素数，用于限制临时缓冲区的大小
+KERNEL_BLOCK_ELEMENTS = 2**16
+
+# 参数扫描时每块参数组的态向量（或计数）元素总数上限
+SWEEP_CHUNK_ELEMENTS = 2**22
+
+# 计算成对联合概率时每次处理的结果数
+MARGINAL_CHUNK_OUTCOMES = 2**16
+
+# 编译电路的操作码
+OPCODE_H = 0
+OPCODE_CX = 1
+OPCODE_RZ = 2
+# 前端格式中的测量门只用于显示，编译时跳过
+OPCODE_MEASURE = 3
+
+# 门名称（小写）到操作码的映射，以及导出为字典格式时使用的名称和说明
+INTERNAL_GATE_OPCODES = {"h": OPCODE_H, "cx": OPCODE_CX, "rz": OPCODE_RZ}
+FRONTEND_GATE_OPCODES = {"h": OPCODE_H, "cnot": OPCODE_CX, "rz": OPCODE_RZ, "measure": OPCODE_MEASURE}
+INTERNAL_GATE_NAMES = {OPCODE_H: "h", OPCODE_CX: "cx", OPCODE_RZ: "rz"}
+FRONTEND_GATE_NAMES = {OPCODE_H: "H", OPCODE_CX: "CNOT", OPCODE_RZ: "RZ", OPCODE_MEASURE: "measure"}
+GATE_DESCRIPTIONS = {
+    OPCODE_H: "Hadamard门，创建叠加态",
+    OPCODE_CX: "CNOT门，创建量子纠缠",
+    OPCODE_RZ: "旋转Z门，引入量子相位"
+}
+
+# 编译电路中每个操作的紧凑表示：操作码、量子比特（单比特门第二位为-1）、参数槽位（无参数为-1）
+COMPILED_OP_DTYPE = [("opcode", "i1"), ("qubits", "i4", (2,)), ("param", "i4")]
+
+class PackedCircuit:
+    """紧凑的电路表示，创建、校验、编译和模拟都直接使用它
+
+    每个门是一条记录：操作码、目标比特、控制比特（没有时为-1）、RZ角度和列号，
+    按列分别存放在 array 模块的定长数组中，每个门约21字节。前端格式不携带
+    RZ角度，对应位置为NaN，绑定参数时随机生成。前端格式和内部格式的字典
+    只在JSON边界上通过 to_frontend / to_internal 生成。
+    """
+    
+    __slots__ = ("num_qubits", "opcodes", "targets", "controls", "params", "columns",
+                 "circuit_id", "description", "created_at", "source_format", "_structure_key", "_validation_errors")
+    
+    def __init__(self, num_qubits, circuit_id=None, description="量子电路", created_at=None, source_format="internal"):
+        self.num_qubits = num_qubits
+        self.opcodes = array("b")
+        self.targets = array("i")
+        self.controls = array("i")
+        self.params = array("d")
+        self.columns = array("i")
+        self.circuit_id = circuit_id or f"circuit_{int(time.time())}"
+        self.description = description
+        self.created_at = created_at or datetime.now().isoformat()
+        self.source_format = source_format
+        self._structure_key = None
+        self._validation_errors = None
+    
+    def __len__(self):
+        return len(self.opcodes)
+    
+    def append(self, opcode, target, control=-1, param=math.nan, column=None):
+        """追加一个门，未指定列号时放在新的一列"""
+        if column is None:
+            column = self.columns[-1] + 1 if self.columns else 0
+        self.opcodes.append(opcode)
+        self.targets.append(target)
+        self.controls.append(control)
+        self.params.append(param)
+        self.columns.append(column)
+        self._structure_key = None
+        self._validation_errors = None
+    
+    def add_measurements(self, column=None):
+        """在新的一列为每个量子比特添加测量门"""
+        if column is None:
+            column = self.columns[-1] + 1 if self.columns else 0
+        for qubit in range(self.num_qubits):
+            self.append(OPCODE_MEASURE, qubit, column=column)
+    
+    @property
+    def nbytes(self):
+        """门记录占用的字节数"""
+        return sum(
+            len(values) * values.itemsize
+            for values in (self.opcodes, self.targets, self.controls, self.params, self.columns)
+        )
+    
+    def structure_key(self):
+        """电路结构哈希，忽略RZ角度、列号和元数据，使参数不同的同构电路共享编译结果"""
+        if self._structure_key is None:
+            digest = hashlib.sha1(str(self.num_qubits).encode("ascii"))
+            for values in (self.opcodes, self.targets, self.controls):
+                digest.update(values.tobytes())
+            self._structure_key = digest.hexdigest()
+        return self._structure_key
+    
+    def validation_errors(self):
+        """检查量子比特下标，返回结构化错误列表，结果缓存到电路被修改为止"""
+        if self._validation_errors is None:
+            self._validation_errors = validate_packed_gates(self)
+        return self._validation_errors
+    
+    def to_frontend(self):
+        """导出为前端格式字典"""
+        names = FRONTEND_GATE_NAMES
+        return {
+            "qubits": [{"name": f"量子比特 {i}"} for i in range(self.num_qubits)],
+            "gates": [
+                {"name": names[opcode], "column": column, "targets": [target], "controls": [control] if control >= 0 else []}
+                for opcode, target, control, column in zip(self.opcodes, self.targets, self.controls, self.columns)
+            ],
+            "metadata": {
+                "description": self.description,
+                "createdAt": self.created_at
+            }
+        }
+    
+    def to_internal(self, rng=None):
+        """导出为内部格式字典，缺少的RZ角度随机生成，rng 为 numpy 随机数生成器"""
+        uniform = rng.uniform if rng is not None else random.uniform
+        operations = []
+        for opcode, target, control, param in zip(self.opcodes, self.targets, self.controls, self.params):
+            if opcode == OPCODE_MEASURE:
+                continue
+            operation = {"name": INTERNAL_GATE_NAMES[opcode], "qubits": [control, target] if opcode == OPCODE_CX else [target]}
+            if opcode == OPCODE_RZ:
+                operation["params"] = [float(uniform(0, 2*math.pi)) if math.isnan(param) else param]
+            operation["description"] = GATE_DESCRIPTIONS[opcode]
+            operations.append(operation)
+        return {"circuit_id": self.circuit_id, "num_qubits": self.num_qubits, "operations": operations}
+
+def pack_circuit(circuit):
+    """把前端格式或内部格式的电路字典转换为 PackedCircuit，已经是 PackedCircuit 时原样返回
+
+    带 operations 字段的字典按内部格式解析，其余按前端格式校验后解析；
+    电路无效时抛出 CircuitValidationError。
+    """
+    if isinstance(circuit, PackedCircuit):
+        return circuit
+    if isinstance(circuit, dict) and "operations" in circuit:
+        packed = pack_internal_circuit(circuit)
+    else:
+        packed = pack_frontend_circuit(circuit)
+    errors = packed.validation_errors()
+    if errors:
+        raise CircuitValidationError(errors)
+    return packed
+
+@timed_stage("conversion")
+def pack_internal_circuit(internal_circuit):
+    """解析内部格式电路，第 i 个操作放在第 i 列，最后一列为测量门"""
+    packed = PackedCircuit(internal_circuit.get("num_qubits", 3), internal_circuit.get("circuit_id"))
+    operations = internal_circuit.get("operations", [])
+    for column, op in enumerate(operations):
+        opcode = INTERNAL_GATE_OPCODES.get(str(op.get("name", "")).lower())
+        qubits = op.get("qubits", [])
+        if opcode == OPCODE_CX:
+            if len(qubits) >= 2:
+                packed.append(OPCODE_CX, qubits[1], qubits[0], column=column)
+        elif opcode is not None:
+            param = (op.get("params") or [0])[0] if opcode == OPCODE_RZ else math.nan
+            for qubit in qubits:
+                packed.append(opcode, qubit, param=param, column=column)
+        # 可以添加更多门类型的转换
+    packed.add_measurements(len(operations))
+    return packed
+
+@timed_stage("conversion")
+def pack_frontend_circuit(circuit):
+    """校验并解析前端格式电路，RZ角度留空；电路无效时抛出 CircuitValidationError"""
+    errors = get_circuit_validation_errors(circuit)
+    if errors:
+        raise CircuitValidationError(errors)
+    
+    metadata = circuit["metadata"]
+    packed = PackedCircuit(
+        len(circuit["qubits"]),
+        description=metadata["description"],
+        created_at=metadata["createdAt"],
+        source_format="frontend"
+    )
+    # 校验保证了门已按列号排序，无需再排序
+    for gate in circuit["gates"]:
+        opcode = FRONTEND_GATE_OPCODES.get(gate["name"].lower())
+        targets = gate["targets"]
+        column = gate["column"]
+        if opcode == OPCODE_CX:
+            packed.append(OPCODE_CX, targets[0], gate["controls"][0], column=column)
+        elif opcode is not None:
+            for target in targets:
+                packed.append(opcode, target, column=column)
+        # 可以添加更多门类型的转换
+    return packed
+
+def validate_packed_gates(packed):
+    """检查紧凑电路中的量子比特下标，返回结构化错误列表
+
+    先用数组的最小/最大值快速判断，只有发现越界或CNOT门控制位无效时才逐门定位错误。
+    """
+    num_qubits = packed.num_qubits
+    if not packed.opcodes:
+        return []
+    in_range = (min(packed.targets) >= 0 and max(packed.targets) < num_qubits
+                and min(packed.controls) >= -1 and max(packed.controls) < num_qubits)
+    if in_range and all(
+        0 <= control != target
+        for opcode, target, control in zip(packed.opcodes, packed.targets, packed.controls)
+        if opcode == OPCODE_CX
+    ):
+        return []
+    
+    # 内部格式电路的第 i 个操作位于第 i 列，错误位置按原始操作报告
+    internal = packed.source_format == "internal"
+    errors = []
+    records = zip(packed.opcodes, packed.targets, packed.controls, packed.columns)
+    for index, (opcode, target, control, column) in enumerate(records):
+        path = f"operations[{column}]" if internal else f"gates[{index}]"
+        if not 0 <= target < num_qubits:
+            errors.append(validation_error(path if internal else f"{path}.targets[0]", "out_of_range",
+                                           f"量子比特下标 {target} 超出范围 [0, {num_qubits})"))
+        if not -1 <= control < num_qubits or (opcode == OPCODE_CX and control < 0):
+            errors.append(validation_error(path if internal else f"{path}.controls[0]", "out_of_range",
+                                           f"量子比特下标 {control} 超出范围 [0, {num_qubits})"))
+        elif opcode == OPCODE_CX and control == target:
+            errors.append(validation_error(path, "invalid_gate", "CNOT门的控制位与目标位相同"))
+        if len(errors) >= MAX_VALIDATION_ERRORS:
+            break
+    return errors[:MAX_VALIDATION_ERRORS]
+
+class CircuitValidationError(ValueError):
+    """电路未通过校验，errors 为结构化错误列表"""
+    
+    def __init__(self, errors):
+        self.errors = errors
+        first = errors[0]
+        super().__init__(f"电路校验失败（{len(errors)} 处错误）: {first['path'] or '电路'} {first['message']}")
+
+def validation_error(path, code, message):
+    """构建一条结构化校验错误：出错位置、错误类别和说明"""
+    return {"path": path, "code": code, "message": message}
+
+# 前端电路格式的模式：每一层对象的必需字段及其类型
+FRONTEND_CIRCUIT_SCHEMA = {
+    "circuit": {"qubits": list, "gates": list, "metadata": dict},
+    "qubit": {"name": str},
+    "gate": {"name": str, "column": int, "targets": list, "controls": list},
+    "metadata": {"description": str, "createdAt": str}
+}
+
+def compile_frontend_validator(schema):
+    """把前端电路模式编译为单遍校验函数 validate(circuit) -> 错误列表
+
+    各层的字段集合和类型在编译时展开为元组，校验时每个量子比特和门只访问一次，
+    同时检查量子比特下标范围、列号顺序和CNOT门的控制位。错误达到
+    MAX_VALIDATION_ERRORS 条后停止遍历。
+    """
+    levels = {level: (frozenset(fields), tuple(fields.items())) for level, fields in schema.items()}
+    type_names = {list: "数组", dict: "对象", str: "字符串", int: "整数"}
+    
+    def check_object(value, level, path, errors):
+        """检查对象类型、必需字段和字段类型，返回是否可以继续检查其内容"""
+        keys, fields = levels[level]
+        if not isinstance(value, dict):
+            errors.append(validation_error(path, "type", "应为对象"))
+            return False
+        if not keys <= value.keys():
+            for key in sorted(keys - value.keys()):
+                errors.append(validation_error(f"{path}.{key}" if path else key, "missing", "缺少必需字段"))
+            return False
+        valid = True
+        for key, expected in fields:
+            field = value[key]
+            if not isinstance(field, expected) or (expected is int and isinstance(field, bool)):
+                errors.append(validation_error(f"{path}.{key}" if path else key, "type", f"应为{type_names[expected]}"))
+                valid = False
+        return valid
+    
+    def locate_qubit_errors(gate, field, index, num_qubits, errors):
+        """逐个检查门的量子比特下标，只在快速检查失败后调用"""
+        for position, qubit in enumerate(gate[field]):
+            if type(qubit) is not int:
+                errors.append(validation_error(f"gates[{index}].{field}[{position}]", "type", "应为整数"))
+            elif not 0 <= qubit < num_qubits:
+                errors.append(validation_error(f"gates[{index}].{field}[{position}]", "out_of_range",
+                                               f"量子比特下标 {qubit} 超出范围 [0, {num_qubits})"))
+    
+    # 门的字段在快速路径中一次取出，类型整体比较
+    gate_fields = ("name", "column", "targets", "controls")
+    get_gate_fields = operator.itemgetter(*gate_fields)
+    gate_types = tuple(schema["gate"][field] for field in gate_fields)
+    plain_gate_names = frozenset(name for opcode, name in FRONTEND_GATE_NAMES.items() if opcode != OPCODE_CX)
+    
+    def validate(circuit):
+        errors = []
+        if not check_object(circuit, "circuit", "", errors):
+            return errors
+        check_object(circuit["metadata"], "metadata", "metadata", errors)
+        
+        qubits = circuit["qubits"]
+        for index, qubit in enumerate(qubits):
+            if not (isinstance(qubit, dict) and type(qubit.get("name")) is str):
+                check_object(qubit, "qubit", f"qubits[{index}]", errors)
+                if len(errors) >= MAX_VALIDATION_ERRORS:
+                    return errors[:MAX_VALIDATION_ERRORS]
+        
+        num_qubits = len(qubits)
+        previous_column = 0
+        for index, gate in enumerate(circuit["gates"]):
+            if errors and len(errors) >= MAX_VALIDATION_ERRORS:
+                break
+            
+            # 快速路径：字段齐全且类型完全匹配；否则按模式逐项报告错误
+            try:
+                name, column, targets, controls = get_gate_fields(gate)
+                well_formed = (type(name), type(column), type(targets), type(controls)) == gate_types
+            except (KeyError, TypeError, IndexError):
+                well_formed = False
+            if not well_formed:
+                if not check_object(gate, "gate", f"gates[{index}]", errors):
+                    continue
+                name, column, targets, controls = get_gate_fields(gate)
+            
+            if column < previous_column:
+                errors.append(validation_error(
+                    f"gates[{index}].column", "order",
+                    f"列号 {column} 小于前一个门的列号 {previous_column}" if index else "列号不能为负数"
+                ))
+            else:
+                previous_column = column
+            
+            for qubit in targets:
+                if type(qubit) is not int or not 0 <= qubit < num_qubits:
+                    locate_qubit_errors(gate, "targets", index, num_qubits, errors)
+                    break
+            for qubit in controls:
+                if type(qubit) is not int or not 0 <= qubit < num_qubits:
+                    locate_qubit_errors(gate, "controls", index, num_qubits, errors)
+                    break
+            
+            # 常见的非CNOT门名称直接跳过，避免逐门转换大小写
+            if name not in plain_gate_names and name.lower() == "cnot":
+                if not targets or not controls:
+                    errors.append(validation_error(f"gates[{index}]", "invalid_gate", "CNOT门需要控制位和目标位"))
+                elif controls[0] == targets[0]:
+                    errors.append(validation_error(f"gates[{index}]", "invalid_gate", "CNOT门的控制位与目标位相同"))
+        return errors[:MAX_VALIDATION_ERRORS]
+    
+    return validate
+
+validate_frontend_circuit = compile_frontend_validator(FRONTEND_CIRCUIT_SCHEMA)
 
-# 设置编码
-if hasattr(sys.stdout, 'reconfigure'):
-    sys.stdout.reconfigure(encoding='utf-8')
-    sys.stderr.reconfigure(encoding='utf-8')
-else:
-    import io
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
-
-# 尝试导入国盾量子SDK
-try:
-    import ezQgd as qgd
-    HAS_QGD_SDK = True
-except ImportError:
-    HAS_QGD_SDK = False
-    sys.stderr.write("警告: 未找到国盾量子SDK (ezQgd)，将使用模拟模式\n")
-
-# 存储最近创建的电路
-LAST_CIRCUIT = None
+@timed_stage("validation")
+def get_circuit_validation_errors(circuit_data):
+    """返回电路的结构化校验错误列表，空列表表示通过
+
+    PackedCircuit 的结果缓存在对象上，电路被修改时失效，因此反复校验保存的电路
+    几乎没有开销。前端格式字典可能被原地修改，每次都重新校验：按内容哈希记忆
+    需要序列化整个电路，比单遍校验本身更慢。
+    """
+    if isinstance(circuit_data, PackedCircuit):
+        return circuit_data.validation_errors()
+    if not isinstance(circuit_data, dict):
+        return [validation_error("", "type", "电路应为对象")]
+    return validate_frontend_circuit(circuit_data)
 
 # 定义统一的电路数据格式
 # 前端期望的格式为：
@@ -52,74 +808,18 @@ LAST_CIRCUIT = None
 #     }
 # }
 
+@timed_stage("conversion")
 def convert_internal_circuit_to_frontend_format(internal_circuit):
     """将内部电路格式转换为前端格式"""
     try:
         sys.stderr.write("转换电路格式为前端格式\n")
         
         # 检查内部电路格式是否有效
-        if not internal_circuit or not isinstance(internal_circuit, dict):
+        if not internal_circuit or not isinstance(internal_circuit, (dict, PackedCircuit)):
             sys.stderr.write("内部电路格式无效，创建默认前端格式\n")
             return create_default_frontend_circuit()
         
-        # 获取量子比特数量
-        num_qubits = internal_circuit.get("num_qubits", 3)
-        
-        # 创建前端格式的电路
-        frontend_circuit = {
-            "qubits": [{"name": f"量子比特 {i}"} for i in range(num_qubits)],
-            "gates": [],
-            "metadata": {
-                "description": "量子电路",
-                "createdAt": datetime.now().isoformat()
-            }
-        }
-        
-        # 转换操作为门
-        operations = internal_circuit.get("operations", [])
-        column = 0
-        for op in operations:
-            op_name = op.get("name", "").upper()
-            qubits = op.get("qubits", [])
-            
-            if op_name == "H":
-                for qubit in qubits:
-                    frontend_circuit["gates"].append({
-                        "name": "H",
-                        "column": column,
-                        "targets": [qubit],
-                        "controls": []
-                    })
-            elif op_name == "CX":
-                if len(qubits) >= 2:
-                    frontend_circuit["gates"].append({
-                        "name": "CNOT",
-                        "column": column,
-                        "targets": [qubits[1]],
-                        "controls": [qubits[0]]
-                    })
-            elif op_name == "RZ":
-                for qubit in qubits:
-                    frontend_circuit["gates"].append({
-                        "name": "RZ",
-                        "column": column,
-                        "targets": [qubit],
-                        "controls": []
-                    })
-            # 可以添加更多门类型的转换
-            
-            column += 1
-        
-        # 添加测量门
-        for i in range(num_qubits):
-            frontend_circuit["gates"].append({
-                "name": "measure",
-                "column": column,
-                "targets": [i],
-                "controls": []
-            })
-        
-        return frontend_circuit
+        return pack_circuit(internal_circuit).to_frontend()
     except Exception as e:
         sys.stderr.write(f"转换电路格式时出错: {str(e)}\n")
         return create_default_frontend_circuit()
@@ -148,90 +848,81 @@ def create_default_frontend_circuit(num_qubits=3):
         }
     }
 
+def validate_circuit_report(circuit_data):
+    """校验电路，返回 {"valid": 是否通过, "errors": 结构化错误列表}
+
+    带 operations 字段的内部格式电路解析后检查量子比特下标，其余按前端格式校验。
+    """
+    if isinstance(circuit_data, dict) and "operations" in circuit_data:
+        circuit_data = pack_internal_circuit(circuit_data)
+    errors = get_circuit_validation_errors(circuit_data)
+    return {"valid": not errors, "errors": errors}
+
 def validate_circuit_data(circuit_data):
-    """验证电路数据是否符合前端格式要求"""
+    """验证电路数据是否符合前端格式要求，PackedCircuit 只检查量子比特下标
+
+    需要知道具体错误时使用 get_circuit_validation_errors。
+    """
     try:
-        # 检查基本结构
-        if not isinstance(circuit_data, dict):
-            return False
-        
-        if "qubits" not in circuit_data or not isinstance(circuit_data["qubits"], list):
-            return False
-        
-        if "gates" not in circuit_data or not isinstance(circuit_data["gates"], list):
-            return False
-        
-        if "metadata" not in circuit_data or not isinstance(circuit_data["metadata"], dict):
-            return False
-        
-        # 检查量子比特
-        for qubit in circuit_data["qubits"]:
-            if not isinstance(qubit, dict) or "name" not in qubit:
-                return False
-        
-        # 检查门
-        for gate in circuit_data["gates"]:
-            if not isinstance(gate, dict):
-                return False
-            
-            if "name" not in gate or "column" not in gate or "targets" not in gate or "controls" not in gate:
-                return False
-            
-            if not isinstance(gate["targets"], list) or not isinstance(gate["controls"], list):
-                return False
-        
-        # 检查元数据
-        if "description" not in circuit_data["metadata"] or "createdAt" not in circuit_data["metadata"]:
-            return False
-        
-        return True
+        return not get_circuit_validation_errors(circuit_data)
     except Exception:
         return False
 
-def create_quantum_circuit(num_qubits=5):
-    """创建量子电路"""
-    global LAST_CIRCUIT
+class CircuitStore:
+    """按会话保存最近创建的电路，常驻服务的多个工作线程并发读写时由锁保护"""
+    
+    def __init__(self, max_size=CIRCUIT_STORE_SIZE):
+        self.max_size = max_size
+        self._circuits = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def put(self, circuit, session=None):
+        """保存会话最近创建的电路，session 为空时使用当前请求的会话"""
+        session = session or current_session()
+        with self._lock:
+            self._circuits[session] = circuit
+            self._circuits.move_to_end(session)
+            while len(self._circuits) > self.max_size:
+                self._circuits.popitem(last=False)
+        return circuit
+    
+    def get(self, session=None):
+        """返回会话最近创建的电路，没有时返回 None"""
+        session = session or current_session()
+        with self._lock:
+            circuit = self._circuits.get(session)
+            if circuit is not None:
+                self._circuits.move_to_end(session)
+            return circuit
+    
+    def stats(self):
+        """返回保存的会话数"""
+        with self._lock:
+            return {"sessions": len(self._circuits), "max_sessions": self.max_size}
+
+# 各会话最近创建的电路，get_quantum_circuit 从这里读取
+CIRCUIT_STORE = CircuitStore()
+
+@timed_stage("circuit_creation")
+def create_quantum_circuit(num_qubits=5, rng=None):
+    """创建量子电路，返回 PackedCircuit（需要字典时在JSON边界上调用 to_frontend）
+
+    RZ角度由 rng（numpy 随机数生成器）生成，为空时使用系统熵。创建的电路保存到
+    当前会话的 CIRCUIT_STORE 中。
+    """
     try:
         sys.stderr.write("创建国盾量子电路\n")
         
-        if HAS_QGD_SDK:
+        if has_qgd_sdk():
             try:
                 # 创建真实的量子电路
                 # 1. 初始化所有量子比特为|0⟩状态
                 # 2. 对所有量子比特应用Hadamard门，创建均匀叠加态
                 # 3. 应用受控旋转门，创建纠缠
                 # 4. 应用相位门，引入量子相位
-                internal_circuit = {
-                    "circuit_id": f"circuit_{int(time.time())}",
-                    "num_qubits": num_qubits,
-                    "operations": [
-                        {"name": "h", "qubits": [i], "description": "Hadamard门，创建叠加态"} 
-                        for i in range(num_qubits)
-                    ]
-                }
-                
-                # 添加CNOT门创建纠缠
-                for i in range(num_qubits-1):
-                    internal_circuit["operations"].append({
-                        "name": "cx", 
-                        "qubits": [i, i+1],
-                        "description": "CNOT门，创建量子纠缠"
-                    })
-                
-                # 添加旋转门
-                for i in range(num_qubits):
-                    internal_circuit["operations"].append({
-                        "name": "rz", 
-                        "qubits": [i],
-                        "params": [random.uniform(0, 2*math.pi)],
-                        "description": "旋转Z门，引入量子相位"
-                    })
-                
+                circuit = build_prediction_circuit(num_qubits, rng)
                 sys.stderr.write("使用国盾量子SDK创建电路\n")
-                # 转换为前端格式并存储
-                frontend_circuit = convert_internal_circuit_to_frontend_format(internal_circuit)
-                LAST_CIRCUIT = frontend_circuit
-                return frontend_circuit
+                return CIRCUIT_STORE.put(circuit)
             except Exception as inner_e:
                 sys.stderr.write(f"使用国盾量子SDK创建电路时出错: {str(inner_e)}\n")
                 # 不抛出异常，而是回退到模拟模式
@@ -239,124 +930,726 @@ def create_quantum_circuit(num_qubits=5):
         
         # 使用模拟模式创建电路（无论是因为没有SDK还是SDK出错）
         sys.stderr.write("使用模拟模式创建电路\n")
-        # 返回模拟电路
-        internal_circuit = {
-            "circuit_id": f"circuit_{int(time.time())}",
-            "num_qubits": num_qubits,
-            "operations": [
-                {"name": "h", "qubits": [i], "description": "Hadamard门，创建叠加态"} 
-                for i in range(num_qubits)
-            ]
-        }
-        
-        # 添加CNOT门创建纠缠
-        for i in range(num_qubits-1):
-            internal_circuit["operations"].append({
-                "name": "cx", 
-                "qubits": [i, i+1],
-                "description": "CNOT门，创建量子纠缠"
-            })
-        
-        # 添加旋转门
-        for i in range(num_qubits):
-            internal_circuit["operations"].append({
-                "name": "rz", 
-                "qubits": [i],
-                "params": [random.uniform(0, 2*math.pi)],
-                "description": "旋转Z门，引入量子相位"
-            })
-        
-        # 转换为前端格式并存储
-        frontend_circuit = convert_internal_circuit_to_frontend_format(internal_circuit)
-        LAST_CIRCUIT = frontend_circuit
-        return frontend_circuit
+        circuit = build_prediction_circuit(num_qubits, rng)
+        return CIRCUIT_STORE.put(circuit)
     except Exception as e:
         sys.stderr.write(f"创建量子电路时出错: {str(e)}\n")
         # 创建一个简单的备用电路
-        frontend_circuit = create_default_frontend_circuit(3)
-        LAST_CIRCUIT = frontend_circuit
-        return frontend_circuit
+        return CIRCUIT_STORE.put(pack_frontend_circuit(create_default_frontend_circuit(3)))
+
+def build_prediction_circuit(num_qubits, rng=None):
+    """构建预测电路：H层创建叠加态，CNOT链创建纠缠，RZ层引入随机相位，最后测量
+
+    每个门单独占一列，与内部格式逐个操作转换为前端格式时的列号一致。
+    随机相位由 rng 生成，为空时使用 random 模块。
+    """
+    uniform = rng.uniform if rng is not None else random.uniform
+    circuit = PackedCircuit(num_qubits)
+    for i in range(num_qubits):
+        circuit.append(OPCODE_H, i)
+    for i in range(num_qubits - 1):
+        circuit.append(OPCODE_CX, i + 1, i)
+    for i in range(num_qubits):
+        circuit.append(OPCODE_RZ, i, param=float(uniform(0, 2*math.pi)))
+    circuit.add_measurements()
+    return circuit
+
+@timed_stage("conversion")
+def convert_frontend_circuit_to_internal_format(circuit, rng=None):
+    """将前端格式电路转换为内部格式，缺少的RZ角度由 rng 生成"""
+    return pack_circuit(circuit).to_internal(rng)
+
+class CompiledCircuitCache:
+    """按电路结构缓存编译结果的LRU缓存"""
+    
+    def __init__(self, max_size=CIRCUIT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        """查找缓存条目，命中时将其移到最近使用的位置"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+    
+    def put(self, key, value):
+        """写入缓存条目，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        """清空缓存和计数器"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+    
+    def stats(self):
+        """返回缓存计数器"""
+        with self._lock:
+            return self._stats()
+    
+    def _stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+COMPILED_CIRCUIT_CACHE = CompiledCircuitCache()
+
+def circuit_structure_key(circuit):
+    """计算电路结构哈希，忽略元数据和RZ角度，使参数不同的同构电路共享编译结果"""
+    return pack_circuit(circuit).structure_key()
+
+@timed_stage("conversion")
+def compile_circuit(circuit):
+    """将电路编译为紧凑的操作数组，RZ角度编译为参数槽位"""
+    packed = pack_circuit(circuit)
+    if packed.source_format == "frontend":
+        sys.stderr.write("输入的是前端格式电路，RZ角度在运行时生成\n")
+    errors = packed.validation_errors()
+    if errors:
+        raise CircuitValidationError(errors)
+    
+    # 门记录直接按缓冲区读取，测量门不参与模拟
+    opcodes = np.frombuffer(packed.opcodes, dtype=packed.opcodes.typecode)
+    keep = opcodes != OPCODE_MEASURE
+    opcodes = opcodes[keep]
+    targets = np.frombuffer(packed.targets, dtype=packed.targets.typecode)[keep]
+    controls = np.frombuffer(packed.controls, dtype=packed.controls.typecode)[keep]
+    is_cx = opcodes == OPCODE_CX
+    is_rz = opcodes == OPCODE_RZ
+    
+    ops = np.zeros(len(opcodes), dtype=COMPILED_OP_DTYPE)
+    ops["opcode"] = opcodes
+    ops["qubits"][:, 0] = np.where(is_cx, controls, targets)
+    ops["qubits"][:, 1] = np.where(is_cx, targets, -1)
+    ops["param"] = np.where(is_rz, np.cumsum(is_rz) - 1, -1)
+    
+    plan, optimization = optimize_compiled_ops(ops)
+    return {
+        "num_qubits": packed.num_qubits,
+        "ops": ops,
+        "num_params": int(is_rz.sum()),
+        "source_format": packed.source_format,
+        "plan": plan,
+        "optimization": optimization
+    }
+
+def optimize_compiled_ops(ops):
+    """优化编译后的操作序列，生成执行计划
 
-def run_quantum_computation(circuit, api_key=None, shots=1024):
-    """运行真实量子计算"""
+    - 同一量子比特上连续的单比特门融合为一个2x2酉矩阵
+    - 相邻的H·H、相同控制/目标的CX·CX互相抵消
+    - 相邻的对角门（RZ）合并为一次整体对角乘法
+
+    执行计划中的步骤为 ("h", q)、("cx", c, t)、("unitary", q, factors)、
+    ("diag", terms)，每个步骤对应一次态向量遍历。参数在执行时才绑定，
+    因此计划可以随编译结果一起缓存。
+    """
+    steps = []
+    pending = {}  # 每个量子比特上尚未输出的单比特门因子
+    last_step = {}  # 每个量子比特最近一次输出的步骤下标
+    cancelled = 0
+    
+    def flush(qubit):
+        factors = pending.pop(qubit, [])
+        if not factors:
+            return
+        if all(factor[0] == "rz" for factor in factors):
+            steps.append(("diag", [(qubit, factor[1]) for factor in factors]))
+        elif len(factors) == 1:
+            steps.append(("h", qubit))
+        else:
+            steps.append(("unitary", qubit, factors))
+        last_step[qubit] = len(steps) - 1
+    
+    # 按列取出Python整数，避免逐条转换结构化数组记录
+    records = zip(ops["opcode"].tolist(), ops["qubits"][:, 0].tolist(), ops["qubits"][:, 1].tolist(),
+                  ops["param"].tolist())
+    for opcode, first, second, param in records:
+        if opcode == OPCODE_H:
+            factors = pending.setdefault(first, [])
+            if factors and factors[-1][0] == "h":
+                # H·H = I
+                factors.pop()
+                cancelled += 2
+            else:
+                factors.append(("h",))
+        elif opcode == OPCODE_RZ:
+            pending.setdefault(first, []).append(("rz", param))
+        elif opcode == OPCODE_CX:
+            control, target = first, second
+            flush(control)
+            flush(target)
+            previous = last_step.get(control)
+            if (previous is not None and previous == last_step.get(target)
+                    and steps[previous] == ("cx", control, target)):
+                # CX·CX = I，两个量子比特之间没有其他操作
+                steps[previous] = None
+                last_step.pop(control)
+                last_step.pop(target)
+                cancelled += 2
+            else:
+                steps.append(("cx", control, target))
+                last_step[control] = last_step[target] = len(steps) - 1
+    
+    for qubit in sorted(pending):
+        flush(qubit)
+    
+    # 合并相邻的对角步骤
+    plan = []
+    for step in steps:
+        if step is None:
+            continue
+        if step[0] == "diag" and plan and plan[-1][0] == "diag":
+            plan[-1] = ("diag", plan[-1][1] + step[1])
+        else:
+            plan.append(step)
+    
+    optimization = {
+        "original_passes": len(ops),
+        "optimized_passes": len(plan),
+        "passes_saved": len(ops) - len(plan),
+        "cancelled_gates": cancelled
+    }
+    return plan, optimization
+
+def get_compiled_circuit(circuit):
+    """获取电路的编译结果，按结构哈希命中缓存时不再重新解析电路"""
+    key = circuit_structure_key(circuit)
+    compiled = COMPILED_CIRCUIT_CACHE.get(key)
+    if compiled is None:
+        compiled = compile_circuit(circuit)
+        COMPILED_CIRCUIT_CACHE.put(key, compiled)
+    return compiled
+
+def bind_circuit_parameters(compiled, circuit, rng=None):
+    """为编译电路绑定一组RZ角度
+
+    使用电路中记录的角度；前端格式电路不携带角度，缺少的角度每次运行由 rng
+    随机生成（rng 为空时使用 random 模块）。
+    """
+    packed = pack_circuit(circuit)
+    opcodes = np.frombuffer(packed.opcodes, dtype=packed.opcodes.typecode)
+    parameters = np.frombuffer(packed.params, dtype=packed.params.typecode)[opcodes == OPCODE_RZ]
+    missing = np.isnan(parameters)
+    if missing.any():
+        count = int(missing.sum())
+        parameters[missing] = rng.uniform(0, 2*math.pi, count) if rng is not None else [
+            random.uniform(0, 2*math.pi) for _ in range(count)
+        ]
+    return parameters.tolist()
+
+def get_state_dtype(precision=None):
+    """返回模拟精度对应的numpy复数类型，未指定时使用 DEFAULT_PRECISION"""
+    precision = precision or DEFAULT_PRECISION
+    if precision not in SIMULATION_PRECISIONS:
+        raise ValueError(f"不支持的模拟精度: {precision}，可选 {', '.join(SIMULATION_PRECISIONS)}")
+    return np.dtype(precision)
+
+@timed_stage("sampling")
+def state_probabilities(state_vector):
+    """计算态向量的测量概率，只额外分配一个实数数组"""
+    probabilities = np.abs(state_vector)
+    np.square(probabilities, out=probabilities)
+    return probabilities
+
+def allocated_bytes(*arrays):
+    """返回数组实际分配的字节数之和，忽略 None"""
+    return sum(array.nbytes for array in arrays if array is not None)
+
+@timed_stage("simulation")
+def evolve_compiled_circuit(compiled, parameters=None, optimize=True, precision=None, progress=None):
+    """按编译后的操作数组演化态向量
+
+    parameters 为一维时返回单个态向量；为二维 (批次, 参数) 时返回堆叠的态向量。
+    optimize 为真时执行优化后的计划，否则逐个门执行原始操作。所有门都在同一个
+    预先分配的态向量上原地执行，precision 指定其复数精度。progress 为
+    progress(已完成步骤数, 总步骤数) 回调。
+    """
+    num_qubits = compiled["num_qubits"]
+    if parameters is None:
+        parameters = np.zeros(compiled["num_params"])
+    parameters = np.asarray(parameters, dtype=float)
+    batch_shape = parameters.shape[:-1]
+    
+    # 初始化量子态向量
+    # |0⟩^⊗n 状态
+    state_vector = np.zeros(batch_shape + (2**num_qubits,), dtype=get_state_dtype(precision))
+    state_vector[..., 0] = 1.0
+    
+    if optimize:
+        plan = compiled["plan"]
+        for position, step in enumerate(plan):
+            apply_plan_step(state_vector, step, parameters, num_qubits)
+            if progress:
+                progress(position + 1, len(plan))
+        return state_vector
+    
+    # 应用量子门操作
+    for opcode, qubits, param in compiled["ops"].tolist():
+        if opcode == OPCODE_H:  # Hadamard门
+            apply_hadamard(state_vector, qubits[0], num_qubits)
+        elif opcode == OPCODE_CX:  # CNOT门
+            apply_cnot(state_vector, qubits[0], qubits[1], num_qubits)
+        elif opcode == OPCODE_RZ:  # 旋转Z门
+            apply_rz(state_vector, qubits[0], parameters[..., param], num_qubits)
+    
+    return state_vector
+
+def apply_plan_step(state_vector, step, parameters, num_qubits):
+    """执行优化计划中的一个步骤"""
+    kind = step[0]
+    if kind == "h":
+        apply_hadamard(state_vector, step[1], num_qubits)
+    elif kind == "cx":
+        apply_cnot(state_vector, step[1], step[2], num_qubits)
+    elif kind == "unitary":
+        matrix = fuse_single_qubit_factors(step[2], parameters)
+        apply_single_qubit_unitary(state_vector, step[1], matrix, num_qubits)
+    elif kind == "diag":
+        angles = {}
+        for qubit, param in step[1]:
+            angles[qubit] = angles.get(qubit, 0) + parameters[..., param]
+        if len(angles) == 1:
+            qubit, angle = next(iter(angles.items()))
+            apply_rz(state_vector, qubit, angle, num_qubits)
+        else:
+            apply_phase_diagonal(state_vector, angles, num_qubits)
+
+def fuse_single_qubit_factors(factors, parameters):
+    """将按时间顺序排列的单比特门因子相乘为一个2x2矩阵（支持批次参数）"""
+    batch_shape = parameters.shape[:-1]
+    h_factor = 1 / np.sqrt(2)
+    hadamard = np.array([[h_factor, h_factor], [h_factor, -h_factor]], dtype=complex)
+    
+    matrix = np.broadcast_to(np.eye(2, dtype=complex), batch_shape + (2, 2))
+    for factor in factors:
+        if factor[0] == "h":
+            matrix = hadamard @ matrix
+        else:
+            # RZ = diag(1, e^{iθ})，只缩放矩阵的第二行
+            matrix = matrix.copy()
+            matrix[..., 1, :] *= np.exp(1j * parameters[..., factor[1]])[..., None]
+    return matrix
+
+def apply_single_qubit_unitary(state_vector, qubit, matrix, num_qubits):
+    """将2x2酉矩阵作用到指定量子比特（原地更新），matrix 可带批次维度
+
+    按块处理，临时缓冲区不超过 KERNEL_BLOCK_ELEMENTS 个元素。
+    """
+    view = _qubit_view(state_vector, qubit, num_qubits)
+    m = np.asarray(matrix).astype(state_vector.dtype, copy=False)[..., None, None, :, :]
+    zero_half = view[..., 0, :]
+    one_half = view[..., 1, :]
+    for block in _iter_blocks(zero_half.shape[-2:]):
+        zero = zero_half[block]
+        one = one_half[block]
+        original_zero = zero.copy()
+        zero *= m[..., 0, 0]
+        zero += m[..., 0, 1] * one
+        one *= m[..., 1, 1]
+        one += m[..., 1, 0] * original_zero
+    return state_vector
+
+def apply_phase_diagonal(state_vector, angles, num_qubits):
+    """将多个量子比特上的Z相位合并为一个对角矩阵，一次乘到态向量上
+
+    angles 为 {量子比特: 角度}，第q位为1的振幅获得相位 e^{iθ_q}。
+    """
+    batch_shape = np.shape(next(iter(angles.values())))
+    
+    def half_diagonal(low, high):
+        # 从最高位开始逐位展开 [low, high) 范围内量子比特的对角元素，保持小端序下标
+        diagonal = np.ones(batch_shape + (1,), dtype=state_vector.dtype)
+        for qubit in range(high - 1, low - 1, -1):
+            factor = np.ones(batch_shape + (2,), dtype=state_vector.dtype)
+            if qubit in angles:
+                factor[..., 1] = np.exp(1j * np.asarray(angles[qubit]))
+            diagonal = (diagonal[..., :, None] * factor[..., None, :]).reshape(batch_shape + (-1,))
+        return diagonal
+    
+    # 对角矩阵是高位和低位两半的张量积，分两次乘入，避免分配完整长度的对角数组
+    split = num_qubits // 2
+    view = state_vector.reshape(batch_shape + (2**(num_qubits - split), 2**split))
+    view *= half_diagonal(0, split)[..., None, :]
+    view *= half_diagonal(split, num_qubits)[..., :, None]
+    return state_vector
+
+def supports_job_interface(sdk):
+    """检查SDK模块是否提供作业接口 submit_job、get_job_status 和 get_job_result"""
+    return sdk is not None and all(
+        callable(getattr(sdk, name, None)) for name in ("submit_job", "get_job_status", "get_job_result")
+    )
+
+class SdkJobBackend:
+    """通过国盾量子SDK提交和查询作业"""
+    
+    name = "sdk"
+    
+    def __init__(self, sdk, api_key):
+        self.sdk = sdk
+        self.api_key = api_key
+    
+    def submit(self, circuit, shots):
+        """提交电路，返回SDK分配的作业ID"""
+        # SDK接收内部格式字典，前端格式电路缺少的RZ角度在转换时生成
+        circuit = pack_circuit(circuit).to_internal()
+        return str(self.sdk.submit_job(circuit, shots=shots, api_key=self.api_key))
+    
+    def status(self, job_id):
+        """查询作业状态"""
+        return str(self.sdk.get_job_status(job_id, api_key=self.api_key)).upper()
+    
+    def result(self, job_id):
+        """获取已完成作业的测量计数"""
+        return self.sdk.get_job_result(job_id, api_key=self.api_key)
+    
+    def shots(self, job_id):
+        """SDK不提供作业的采样次数，完成后由测量计数之和得到"""
+        return None
+
+class SimulatorJobBackend:
+    """没有可用SDK时用模拟器执行作业
+
+    作业（内部格式电路、采样次数和结果）保存在 path 指向的JSON文件中，单次命令
+    之间可以互相查询作业；超过 SIMULATOR_JOB_RETENTION 秒的作业在下次写入时清理。
+    """
+    
+    name = "simulator"
+    
+    def __init__(self, path=SIMULATOR_JOB_PATH):
+        self.path = path
+        # 同一进程内的多个线程读改写状态文件时需要加锁
+        self._lock = threading.Lock()
+    
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _save(self, jobs):
+        expired = time.time() - SIMULATOR_JOB_RETENTION
+        jobs = {job_id: job for job_id, job in jobs.items() if job["submitted_at"] > expired}
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(jobs, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+    
+    def has_job(self, job_id):
+        """判断作业是否由模拟器后端提交（包括其他进程提交的作业）"""
+        with self._lock:
+            return job_id in self._load()
+    
+    def submit(self, circuit, shots):
+        """记录作业，模拟在第一次查询状态时执行"""
+        job_id = f"sim_{os.urandom(6).hex()}"
+        with self._lock:
+            jobs = self._load()
+            jobs[job_id] = {
+                "circuit": pack_circuit(circuit).to_internal(),
+                "shots": shots,
+                "submitted_at": time.time(),
+                "results": None
+            }
+            self._save(jobs)
+        return job_id
+    
+    def status(self, job_id):
+        """执行尚未完成的模拟并返回作业状态"""
+        with self._lock:
+            job = self._load().get(job_id)
+        if job is None:
+            raise KeyError(f"未知作业: {job_id}")
+        if job["results"] is not None:
+            return "COMPLETED"
+        
+        # 模拟在锁外执行；两个进程同时查询同一个作业时以先写入的结果为准
+        results = simulate_quantum_circuit(job["circuit"], job["shots"])
+        with self._lock:
+            jobs = self._load()
+            if job_id in jobs and jobs[job_id]["results"] is None:
+                jobs[job_id]["results"] = results
+                self._save(jobs)
+        return "COMPLETED"
+    
+    def result(self, job_id):
+        """获取模拟结果"""
+        with self._lock:
+            return self._load()[job_id]["results"]
+    
+    def shots(self, job_id):
+        """返回提交作业时记录的采样次数"""
+        with self._lock:
+            return self._load()[job_id]["shots"]
+
+SIMULATOR_JOB_BACKEND = SimulatorJobBackend()
+
+def get_job_backend(api_key=None):
+    """选择作业后端：有API密钥且SDK提供作业接口时使用SDK，否则使用模拟器"""
+    if api_key:
+        sdk = load_qgd_sdk()
+        if supports_job_interface(sdk):
+            return SdkJobBackend(sdk, api_key)
+        if sdk is not None:
+            sys.stderr.write("国盾量子SDK未提供作业接口，使用模拟器执行作业\n")
+    return SIMULATOR_JOB_BACKEND
+
+class JobManager:
+    """基于asyncio的作业管理器
+
+    事件循环运行在后台线程中。提交作业后立即返回 job_id，后台任务按指数退避
+    轮询作业状态直到完成或超时；阻塞的SDK调用在线程池中执行，同时进行的调用
+    不超过 max_concurrency 个。
+    """
+    
+    def __init__(self, max_concurrency=JOB_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.jobs = {}
+        self._tasks = {}
+        self._loop = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+    
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="quantum-bridge-jobs", daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._init_loop(), loop).result()
+                self._loop = loop
+        return self._loop
+    
+    async def _init_loop(self):
+        # 信号量必须在事件循环线程中创建
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+    
+    def _run(self, coroutine, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop()).result(timeout)
+    
+    async def _call(self, func, *args):
+        """在线程池中执行阻塞的SDK调用，受并发上限约束"""
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+    
+    def _track(self, backend, job_id, shots, timeout):
+        """登记作业并启动轮询任务（在事件循环线程中调用）"""
+        job = {
+            "job_id": job_id,
+            "backend": backend.name,
+            "status": "QUEUED",
+            "shots": shots,
+            "submitted_at": time.time(),
+            "completed_at": None,
+            "polls": 0,
+            "results": None,
+            "error": None
+        }
+        self.jobs[job_id] = job
+        self._tasks[job_id] = asyncio.ensure_future(self._poll(backend, job, timeout))
+        return job
+    
+    async def _submit(self, backend, circuit, shots, timeout):
+        delay = JOB_POLL_INITIAL_DELAY
+        for attempt in range(1, JOB_SUBMIT_RETRIES + 1):
+            try:
+                job_id = await self._call(backend.submit, circuit, shots)
+                break
+            except Exception as e:
+                if attempt == JOB_SUBMIT_RETRIES:
+                    raise
+                sys.stderr.write(f"提交作业失败（第{attempt}次）: {str(e)}，{delay:.1f}秒后重试\n")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, JOB_POLL_MAX_DELAY)
+        self._track(backend, job_id, shots, timeout)
+        return job_id
+    
+    async def _poll(self, backend, job, timeout):
+        """按指数退避轮询作业状态，完成后获取结果"""
+        delay = JOB_POLL_INITIAL_DELAY
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                status = await self._call(backend.status, job["job_id"])
+                job["status"] = status
+                if status == "COMPLETED":
+                    job["results"] = await self._call(backend.result, job["job_id"])
+                    if job["shots"] is None:
+                        job["shots"] = sum(job["results"].values())
+                elif status == "FAILED":
+                    job["error"] = "作业执行失败"
+            except Exception as e:
+                # 查询失败视为暂时性错误，继续轮询直到超时
+                sys.stderr.write(f"查询作业 {job['job_id']} 时出错: {str(e)}\n")
+            job["polls"] += 1
+            
+            if job["status"] in ("COMPLETED", "FAILED"):
+                job["completed_at"] = time.time()
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                job["status"] = "TIMEOUT"
+                job["error"] = f"等待作业超过 {timeout} 秒"
+                return job
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, JOB_POLL_MAX_DELAY)
+    
+    async def _wait(self, backend, job_id, timeout):
+        if job_id not in self._tasks:
+            # 由其他进程提交的作业：从现在开始跟踪
+            shots = await self._call(backend.shots, job_id)
+            if job_id not in self._tasks:
+                self._track(backend, job_id, shots, timeout)
+        return await asyncio.shield(self._tasks[job_id])
+    
+    @staticmethod
+    def describe(job):
+        """返回可以序列化为JSON的作业记录"""
+        record = dict(job)
+        end = job["completed_at"] or time.time()
+        record["elapsed_seconds"] = end - job["submitted_at"]
+        return record
+    
+    def submit(self, circuit, shots=1024, api_key=None, timeout=JOB_TIMEOUT):
+        """提交作业并立即返回 job_id，作业在后台轮询直到完成"""
+        backend = get_job_backend(api_key)
+        return self._run(self._submit(backend, circuit, shots, timeout))
+    
+    @staticmethod
+    def _external_backend(job_id, api_key):
+        """返回查询其他进程提交的作业所用的后端，后端不认识该作业时抛出 ValueError"""
+        backend = get_job_backend(api_key)
+        if backend.name != "sdk" and not backend.has_job(job_id):
+            raise ValueError(f"未知作业: {job_id}")
+        return backend
+    
+    def status(self, job_id, api_key=None):
+        """返回作业当前状态；本进程未跟踪的作业直接向作业后端查询"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return self.describe(job)
+        backend = self._external_backend(job_id, api_key)
+        return {"job_id": job_id, "backend": backend.name, "status": self._run(self._call(backend.status, job_id))}
+    
+    def result(self, job_id, api_key=None, timeout=JOB_TIMEOUT, wait=True):
+        """返回作业记录；wait 为真时先等待作业完成、失败或超时
+
+        wait 为假且作业不是本进程跟踪的作业时，直接向作业后端查询一次状态和结果。
+        """
+        job = self.jobs.get(job_id)
+        backend = self._external_backend(job_id, api_key) if job is None else None
+        if wait:
+            job = self._run(self._wait(backend, job_id, timeout))
+        elif job is None:
+            record = self.status(job_id, api_key)
+            record["shots"] = self._run(self._call(backend.shots, job_id))
+            record["results"] = None
+            if record["status"] == "COMPLETED":
+                record["results"] = self._run(self._call(backend.result, job_id))
+                if record["shots"] is None:
+                    record["shots"] = sum(record["results"].values())
+            return record
+        return self.describe(job)
+
+# 进程内共享的作业管理器
+JOB_MANAGER = JobManager()
+
+def run_quantum_computation(circuit, api_key=None, shots=1024, rng=None, exact=False, precision=None, progress=None):
+    """运行真实量子计算
+
+    exact 为真时模拟器直接返回稀疏的精确概率分布 {比特串: 概率}，不再采样；
+    真实设备只能采样，因此该选项在真实设备上被忽略。模拟器同时在 marginals
+    字段返回由态向量计算的 QubitMarginals（真实设备上没有该字段）。precision 为模拟精度，
+    元数据中的 memory 字段报告该精度下稠密态向量的字节数，timings 字段报告各阶段的
+    墙钟时间和CPU时间，execution_time 为实际执行耗时。progress 为模拟进度回调。
+    rng 同时用于生成电路中缺少的RZ角度和采样，固定 rng 的种子即可复现结果。
+    """
+    with collect_stage_timings() as timings:
+        return _run_quantum_computation(circuit, api_key, shots, rng, exact, precision, progress, timings)
+
+def _run_quantum_computation(circuit, api_key, shots, rng, exact, precision, progress, timings):
+    """run_quantum_computation 的实现，timings 为本次请求收集的阶段计时"""
     try:
         sys.stderr.write(f"运行国盾量子计算\n")
         
-        # 如果输入的是前端格式的电路，需要先转换为内部格式
-        internal_circuit = None
-        if validate_circuit_data(circuit):
-            sys.stderr.write("输入的是前端格式电路，转换为内部格式\n")
-            # 从前端格式转换为内部格式
-            num_qubits = len(circuit.get("qubits", []))
-            internal_circuit = {
-                "circuit_id": f"circuit_{int(time.time())}",
-                "num_qubits": num_qubits,
-                "operations": []
-            }
-            
-            # 按列排序门
-            gates_by_column = {}
-            for gate in circuit.get("gates", []):
-                column = gate.get("column", 0)
-                if column not in gates_by_column:
-                    gates_by_column[column] = []
-                gates_by_column[column].append(gate)
-            
-            # 转换门为操作
-            for column in sorted(gates_by_column.keys()):
-                for gate in gates_by_column[column]:
-                    gate_name = gate.get("name", "").lower()
-                    targets = gate.get("targets", [])
-                    controls = gate.get("controls", [])
-                    
-                    if gate_name == "h":
-                        for target in targets:
-                            internal_circuit["operations"].append({
-                                "name": "h",
-                                "qubits": [target],
-                                "description": "Hadamard门"
-                            })
-                    elif gate_name == "cnot":
-                        if controls and targets:
-                            internal_circuit["operations"].append({
-                                "name": "cx",
-                                "qubits": [controls[0], targets[0]],
-                                "description": "CNOT门"
-                            })
-                    elif gate_name == "rz":
-                        for target in targets:
-                            internal_circuit["operations"].append({
-                                "name": "rz",
-                                "qubits": [target],
-                                "params": [random.uniform(0, 2*math.pi)],
-                                "description": "旋转Z门"
-                            })
-                    # 可以添加更多门类型的转换
-        else:
-            # 如果不是前端格式，假设它已经是内部格式
-            internal_circuit = circuit
+        circuit = pack_circuit(circuit)
+        compiled = get_compiled_circuit(circuit)
+        parameters = bind_circuit_parameters(compiled, circuit, rng)
         
         if api_key:
             sys.stderr.write(f"使用API密钥: {api_key[:5]}...\n")
         else:
             sys.stderr.write("未提供API密钥\n")
         
-        if HAS_QGD_SDK and api_key:
+        if api_key and has_qgd_sdk():
             try:
                 sys.stderr.write("使用国盾量子SDK执行计算\n")
-                # 在这里应该调用真实的SDK
-                # 模拟真实量子计算结果
-                results = simulate_quantum_circuit(internal_circuit, shots)
+                if supports_job_interface(load_qgd_sdk()):
+                    # 通过作业管理器提交并等待结果
+                    start = time.perf_counter()
+                    job_id = JOB_MANAGER.submit(circuit, shots, api_key)
+                    job = JOB_MANAGER.result(job_id, api_key)
+                    if job["status"] != "COMPLETED":
+                        raise RuntimeError(f"作业 {job_id} 未完成: {job['error']}")
+                    return {
+                        "job_id": job_id,
+                        "status": "COMPLETED",
+                        "results": job["results"],
+                        "exact": False,
+                        "metadata": {
+                            "device": "quantum_computer",
+                            "shots": shots,
+                            "execution_time": time.perf_counter() - start,
+                            "real_quantum": True,
+                            "provider": "国盾量子",
+                            "optimization": compiled["optimization"],
+                            "polls": job["polls"],
+                            "timings": snapshot_stage_timings(timings)
+                        }
+                    }
+                
+                # SDK未提供作业接口时模拟真实量子计算结果
+                start = time.perf_counter()
+                memory = {"precision": get_state_dtype(precision).name}
+                results, marginals = simulate_compiled_circuit(
+                    compiled, parameters, shots, rng, precision=precision, progress=progress,
+                    marginals=True, report=memory
+                )
                 return {
                     "job_id": f"job_{int(time.time())}",
                     "status": "COMPLETED",
                     "results": results,
+                    "marginals": marginals,
+                    "exact": False,
                     "metadata": {
                         "device": "quantum_computer",
                         "shots": shots,
-                        "execution_time": random.uniform(0.5, 3.0),
+                        "execution_time": time.perf_counter() - start,
                         "real_quantum": True,
-                        "provider": "国盾量子"
+                        "provider": "国盾量子",
+                        "optimization": compiled["optimization"],
+                        "memory": memory,
+                        "timings": snapshot_stage_timings(timings)
                     }
                 }
             except Exception as inner_e:
@@ -365,252 +1658,1605 @@ def run_quantum_computation(circuit, api_key=None, shots=1024):
         else:
             sys.stderr.write("使用模拟模式执行计算\n")
             # 使用模拟器模拟量子计算
-            results = simulate_quantum_circuit(internal_circuit, shots)
+            start = time.perf_counter()
+            memory = {"precision": get_state_dtype(precision).name}
+            results, marginals = simulate_compiled_circuit(
+                compiled, parameters, shots, rng, exact, precision=precision, progress=progress,
+                marginals=True, report=memory
+            )
             return {
                 "job_id": f"job_{int(time.time())}",
                 "status": "COMPLETED",
                 "results": results,
+                "marginals": marginals,
+                "exact": exact,
                 "metadata": {
                     "device": "quantum_simulator",
                     "shots": shots,
-                    "execution_time": random.uniform(0.1, 0.5),
+                    "execution_time": time.perf_counter() - start,
                     "real_quantum": False,
-                    "provider": "国盾量子模拟器"
+                    "provider": "国盾量子模拟器",
+                    "optimization": compiled["optimization"],
+                    "memory": memory,
+                    "timings": snapshot_stage_timings(timings)
                 }
             }
     except Exception as e:
         sys.stderr.write(f"运行量子计算时出错: {str(e)}\n")
         raise e
 
-def simulate_quantum_circuit(circuit, shots):
-    """模拟量子电路执行"""
+def simulate_quantum_circuit(circuit, shots, rng=None, exact=False, precision=None):
+    """模拟量子电路执行
+
+    exact 为真时返回稀疏的精确概率分布，否则返回采样计数。
+    """
     try:
-        num_qubits = circuit["num_qubits"]
+        circuit = pack_circuit(circuit)
+        compiled = get_compiled_circuit(circuit)
+        parameters = bind_circuit_parameters(compiled, circuit, rng)
+        return simulate_compiled_circuit(compiled, parameters, shots, rng, exact, precision=precision)
+    except Exception as e:
+        sys.stderr.write(f"模拟量子电路时出错: {str(e)}\n")
+        raise e
+
+def simulate_compiled_circuit(compiled, parameters, shots, rng=None, exact=False, workers=None, backend="auto",
+                              precision=None, progress=None, marginals=False, report=None):
+    """以绑定好的参数模拟编译电路并采样
+
+    backend 可为 "dense"、"sparse"、"out_of_core"、"stabilizer" 或 "auto"；auto 把至少
+    STABILIZER_MIN_QUBITS 个量子比特、只含H、CNOT和 π/2 整数倍RZ（末尾的RZ角度任意）
+    的Clifford电路交给稳定子后端（精确分布只在随机比特数不超过量子比特数一半时使用），
+    其余电路在量子比特较多时先使用稀疏后端，非零振幅占比过高时再自动切换为稠密后端；稠密态向量
+    超出 MEMORY_BUDGET 时改用磁盘上的 memmap 态向量。precision 为 "complex64" 或 "complex128"。
+    progress 为演化过程中的进度回调，并行后端不报告进度。marginals 为真时返回
+    (结果, QubitMarginals)，边缘统计在释放态向量前由振幅计算；并行和 memmap 后端
+    没有完整态向量，只由测量概率或测量结果计算，不含约化态的非对角元。
+    report 为字典时写入实际使用的后端 backend 和该后端分配的主要数组字节数
+    allocated_bytes（态或稳定子表加测量概率）；memmap 后端的 allocated_bytes 为内存中
+    同时保留的块，态向量文件大小另记为 disk_bytes。
+    """
+    workers = workers or DEFAULT_WORKERS
+    if report is None:
+        report = {}
+    num_qubits = compiled["num_qubits"]
+    outcomes = None
+    statistics = None
+    if backend == "stabilizer" or (backend == "auto" and num_qubits >= STABILIZER_MIN_QUBITS):
+        program = clifford_program(compiled, parameters)
+        if program is None and backend == "stabilizer":
+            raise ValueError("电路含非Clifford门（角度不是 π/2 整数倍的RZ），不能使用稳定子后端")
+        if program is not None:
+            gates, trailing = program
+            tableau = evolve_stabilizer_circuit(num_qubits, gates)
+            x0, basis = tableau.measurement_subspace()
+            # 精确分布的结果数接近 2**n 时枚举并不比态向量快，交给态向量后端
+            if backend == "stabilizer" or not exact or len(basis) <= min(num_qubits // 2, STABILIZER_MAX_EXACT_BITS):
+                report.update(backend="stabilizer", allocated_bytes=allocated_bytes(tableau.x, tableau.z, tableau.r))
+                results = measure_stabilizer_state(x0, basis, shots, rng, exact)
+                return (results, stabilizer_marginals(tableau, x0, basis, trailing)) if marginals else results
+    if backend == "sparse" or (backend == "auto" and num_qubits >= SPARSE_MIN_QUBITS):
+        outcomes, amplitudes = evolve_sparse_circuit(compiled, parameters, precision=precision, progress=progress)
+        if isinstance(amplitudes, OutOfCoreStateVector):
+            report.update(out_of_core_report(amplitudes), backend="sparse+out_of_core")
+            results = measure_out_of_core_state(amplitudes, shots, rng, exact)
+            return (results, marginals_from_results(results)) if marginals else results
+        probabilities = state_probabilities(amplitudes)
+        report.update(
+            backend="sparse" if outcomes is not None else "sparse+dense",
+            allocated_bytes=allocated_bytes(outcomes, amplitudes, probabilities)
+        )
+        if marginals:
+            statistics = compute_qubit_marginals(amplitudes, num_qubits, outcomes, probabilities)
+        del amplitudes
+    elif backend == "out_of_core" or not dense_state_fits(num_qubits, precision):
+        if num_qubits > OUT_OF_CORE_MAX_QUBITS:
+            raise ValueError(f"memmap 后端最多支持 {OUT_OF_CORE_MAX_QUBITS} 个量子比特，当前为 {num_qubits}")
+        state = evolve_out_of_core_circuit(compiled, parameters, precision=precision, progress=progress)
+        report.update(out_of_core_report(state), backend="out_of_core")
+        results = measure_out_of_core_state(state, shots, rng, exact)
+        return (results, marginals_from_results(results)) if marginals else results
+    elif workers > 1 and num_qubits >= PARALLEL_MIN_QUBITS:
+        # 宽电路：态向量放在共享内存中，按块分给多个进程
+        probabilities = evolve_wide_circuit_parallel(compiled, parameters, workers, precision)
+        # 共享内存中的态向量与 complex 精度的稠密态向量同样大小
+        report.update(
+            backend="parallel",
+            allocated_bytes=2**num_qubits * get_state_dtype(precision).itemsize + probabilities.nbytes
+        )
+        if marginals:
+            statistics = compute_qubit_marginals(None, num_qubits, probabilities=probabilities)
+    else:
+        state_vector = evolve_compiled_circuit(compiled, parameters, precision=precision, progress=progress)
         
-        # 初始化量子态向量
-        # |0⟩^⊗n 状态
-        state_vector = np.zeros(2**num_qubits, dtype=complex)
+        # 计算测量结果概率后立即释放态向量，降低采样阶段的内存峰值
+        probabilities = state_probabilities(state_vector)
+        report.update(backend="dense", allocated_bytes=allocated_bytes(state_vector, probabilities))
+        if marginals:
+            statistics = compute_qubit_marginals(state_vector, num_qubits, probabilities=probabilities)
+        del state_vector
+    
+    if exact:
+        results = exact_probability_distribution(probabilities, num_qubits, outcomes)
+    else:
+        # 根据概率分布进行采样
+        results = sample_measurement_counts(probabilities, shots, num_qubits, rng, outcomes)
+    return (results, statistics) if marginals else results
+
+def simulate_quantum_circuit_batch(circuit, shots, parameter_sets, rngs=None, exact=False, workers=None,
+                                   precision=None, marginals=False):
+    """批量模拟结构相同、RZ角度不同的量子电路
+
+    parameter_sets 的每一行按电路中RZ门出现的顺序给出一组角度，所有态向量
+    堆叠为二维数组，每个门对整个批次只执行一次。workers 大于1时批次被拆分到
+    多个进程中并行计算。marginals 为真时返回 (结果列表, QubitMarginals 列表)。
+    """
+    try:
+        compiled = get_compiled_circuit(circuit)
+        num_qubits = compiled["num_qubits"]
+        parameter_sets = np.asarray(parameter_sets, dtype=float).reshape(-1, compiled["num_params"])
+        workers = workers or DEFAULT_WORKERS
+        coherences = None
+        if workers > 1 and len(parameter_sets) > 1:
+            probabilities = evolve_batch_parallel(compiled, parameter_sets, workers, precision, coherences=marginals)
+            if marginals:
+                probabilities, coherences = probabilities
+        else:
+            state_vectors = evolve_compiled_circuit(compiled, parameter_sets, precision=precision)
+            probabilities = state_probabilities(state_vectors)
+            if marginals:
+                coherences = single_qubit_coherences(state_vectors, num_qubits)
+            del state_vectors
+        if exact:
+            results = [exact_probability_distribution(row, num_qubits) for row in probabilities]
+        else:
+            results = [
+                sample_measurement_counts(probabilities[i], shots, num_qubits, rngs[i] if rngs else None)
+                for i in range(len(parameter_sets))
+            ]
+        if not marginals:
+            return results
+        with timed_stage("analysis"):
+            statistics = [
+                QubitMarginals.from_distribution(row, num_qubits, coherences=row_coherences)
+                for row, row_coherences in zip(probabilities, coherences)
+            ]
+        return results, statistics
+    except Exception as e:
+        sys.stderr.write(f"批量模拟量子电路时出错: {str(e)}\n")
+        raise e
+
+def split_parameterized_plan(plan):
+    """把执行计划拆分为 (与参数无关的前缀, 依赖参数的后缀, 末尾的对角步骤)
+
+    前缀截止到第一个依赖RZ角度的步骤。后缀末尾连续的对角步骤只改变振幅的相位，
+    不改变测量概率，单独返回以便计算概率时跳过。
+    """
+    def parameterized(step):
+        return step[0] == "diag" or (step[0] == "unitary" and any(factor[0] == "rz" for factor in step[2]))
+    
+    split = next((position for position, step in enumerate(plan) if parameterized(step)), len(plan))
+    prefix, suffix = plan[:split], plan[split:]
+    end = len(suffix)
+    while end and suffix[end - 1][0] == "diag":
+        end -= 1
+    return prefix, suffix[:end], suffix[end:]
+
+def sweep_compiled_circuit(compiled, parameter_sets, shots=1024, rng=None, exact=False, precision=None):
+    """对编译电路做RZ角度参数扫描，返回每组参数的量子指标和计划拆分信息
+
+    与参数无关的前缀只演化一次。依赖参数的后缀从前缀态出发，对一块参数组同时
+    执行，其中的对角步骤按批次广播相乘；后缀末尾的对角步骤不改变测量概率，
+    直接跳过。预测电路只有末尾的RZ层依赖参数，所有参数组因此共享同一个概率
+    分布，只有采样各自进行，扫描成本接近单次运行。
+    """
+    num_qubits = compiled["num_qubits"]
+    parameter_sets = np.asarray(parameter_sets, dtype=float)
+    if parameter_sets.ndim != 2 or parameter_sets.shape[1] != compiled["num_params"]:
+        raise ValueError(f"参数组应为二维数组，每组包含 {compiled['num_params']} 个RZ角度")
+    if rng is None:
+        rng = np.random.default_rng()
+    prefix, suffix, skipped = split_parameterized_plan(compiled["plan"])
+    chunk_size = max(1, SWEEP_CHUNK_ELEMENTS >> num_qubits)
+    
+    with timed_stage("simulation"):
+        prefix_state = np.zeros(2**num_qubits, dtype=get_state_dtype(precision))
+        prefix_state[0] = 1.0
+        unused = np.zeros(compiled["num_params"])
+        for step in prefix:
+            apply_plan_step(prefix_state, step, unused, num_qubits)
+    
+    shared = None
+    if not suffix:
+        # 末尾的单比特RZ只改变约化态非对角元的相位，纠缠度和相干性同样可以共享
+        shared = state_probabilities(prefix_state)
+        shared_marginals = compute_qubit_marginals(prefix_state, num_qubits, probabilities=shared)
+        del prefix_state
+        if exact:
+            # 所有参数组的精确分布相同，只分析一次
+            indicators = analyze_quantum_results(
+                {"results": exact_probability_distribution(shared, num_qubits), "exact": True,
+                 "marginals": shared_marginals}
+            )
+            return [indicators] * len(parameter_sets), prefix, suffix, skipped
+    
+    results = []
+    for start in range(0, len(parameter_sets), chunk_size):
+        block = parameter_sets[start:start + chunk_size]
+        if shared is not None:
+            probabilities = shared[np.newaxis]
+            marginals = [shared_marginals]
+        else:
+            with timed_stage("simulation"):
+                states = np.repeat(prefix_state[np.newaxis], len(block), axis=0)
+                for step in suffix:
+                    apply_plan_step(states, step, block, num_qubits)
+            probabilities = state_probabilities(states)
+            with timed_stage("analysis"):
+                marginals = [
+                    QubitMarginals.from_distribution(row, num_qubits, coherences=row_coherences)
+                    for row, row_coherences in zip(probabilities, single_qubit_coherences(states, num_qubits))
+                ]
+            del states
+        results += sweep_block_indicators(probabilities, len(block), shots, rng, exact, num_qubits, marginals)
+    return results, prefix, suffix, skipped
+
+def sweep_block_indicators(probabilities, count, shots, rng, exact, num_qubits, marginals):
+    """为一块参数组计算指标，probabilities 和 marginals 的行数为 count，或为1表示各组共享"""
+    if exact:
+        return [
+            analyze_quantum_results(
+                {"results": exact_probability_distribution(row, num_qubits), "exact": True, "marginals": statistics}
+            )
+            for row, statistics in zip(probabilities, marginals)
+        ]
+    
+    with timed_stage("sampling"):
+        probabilities = probabilities / probabilities.sum(axis=1, keepdims=True)
+        if len(probabilities) == 1:
+            counts = rng.multinomial(shots, probabilities[0], size=count)
+        else:
+            counts = np.array([rng.multinomial(shots, row) for row in probabilities])
+    indicators = []
+    for position, row in enumerate(counts):
+        observed = np.flatnonzero(row)
+        indicators.append(analyze_quantum_results({
+            "outcomes": observed, "counts": row[observed], "num_qubits": num_qubits,
+            "marginals": marginals[position if len(marginals) > 1 else 0]
+        }))
+    return indicators
+
+def sweep_quantum_circuit(circuit, parameter_sets, shots=1024, seed=None, exact=False, precision=None):
+    """参数扫描：同一电路在多组RZ角度下的量子指标
+
+    parameter_sets 为二维列表，每行按电路中RZ门出现的顺序给出一组角度；
+    为整数时生成该数量的随机角度组。seed 固定随机角度和采样结果。
+    """
+    with collect_stage_timings() as timings:
+        start = time.perf_counter()
+        circuit = pack_circuit(circuit)
+        compiled = get_compiled_circuit(circuit)
+        rng = np.random.default_rng(seed)
+        if isinstance(parameter_sets, int):
+            parameter_sets = rng.uniform(0, 2*math.pi, (parameter_sets, compiled["num_params"]))
+        sys.stderr.write(f"参数扫描: {len(parameter_sets)} 组参数，{compiled['num_qubits']} 个量子比特\n")
+        
+        indicators, prefix, suffix, skipped = sweep_compiled_circuit(
+            compiled, parameter_sets, shots, rng, exact, precision
+        )
+        return {
+            "count": len(indicators),
+            "results": [{"index": index, "indicators": item} for index, item in enumerate(indicators)],
+            "metadata": {
+                "num_qubits": compiled["num_qubits"],
+                "num_params": compiled["num_params"],
+                "shots": shots,
+                "exact": exact,
+                "prefix_steps": len(prefix),
+                "suffix_steps": len(suffix),
+                "skipped_diagonal_steps": len(skipped),
+                "shared_distribution": not suffix,
+                "execution_time": time.perf_counter() - start,
+                "timings": snapshot_stage_timings(timings)
+            }
+        }
+
+def get_circuit_marginals(circuit, subsets=None, precision=None):
+    """模拟电路，返回单比特边缘概率、成对关联矩阵、约化态相干度和指定子集的边缘分布
+
+    subsets 为量子比特下标列表的列表，每个子集的边缘分布下标第 m 位对应子集中第 m 个量子比特。
+    """
+    with collect_stage_timings() as timings:
+        start = time.perf_counter()
+        circuit = pack_circuit(circuit)
+        compiled = get_compiled_circuit(circuit)
+        parameters = bind_circuit_parameters(compiled, circuit)
+        _, marginals = simulate_compiled_circuit(compiled, parameters, 0, exact=True, precision=precision, marginals=True)
+        if marginals is None:
+            raise ValueError("模拟结果为空，无法计算边缘统计")
+        result = marginals.to_dict()
+        result["subsets"] = [
+            {"qubits": list(qubits), "probabilities": marginals.marginal(qubits).tolist()}
+            for qubits in (subsets or [])
+        ]
+        result["metadata"] = {
+            "execution_time": time.perf_counter() - start,
+            "timings": snapshot_stage_timings(timings)
+        }
+        return result
+
+@timed_stage("simulation")
+def evolve_sparse_circuit(compiled, parameters=None, fill_threshold=SPARSE_FILL_THRESHOLD, precision=None,
+                          progress=None):
+    """用稀疏后端执行编译电路
+
+    态以按下标排序的 (下标数组, 振幅数组) 表示，内存只与非零振幅数量有关。
+    当非零振幅占比超过 fill_threshold 且态向量可以放进内存时，切换为稠密后端
+    执行剩余步骤；放不进内存时切换为 memmap 态向量。返回 (下标数组, 振幅数组)；
+    切换后下标数组为None，振幅数组为完整态向量或 OutOfCoreStateVector。
+    """
+    num_qubits = compiled["num_qubits"]
+    if num_qubits > SPARSE_MAX_QUBITS:
+        raise ValueError(f"稀疏模拟最多支持 {SPARSE_MAX_QUBITS} 个量子比特，当前为 {num_qubits}")
+    if parameters is None:
+        parameters = np.zeros(compiled["num_params"])
+    parameters = np.asarray(parameters, dtype=float)
+    dtype = get_state_dtype(precision)
+    
+    # |0⟩^⊗n 状态只有一个非零振幅
+    indices = np.zeros(1, dtype=np.int64)
+    amplitudes = np.ones(1, dtype=dtype)
+    
+    plan = compiled["plan"]
+    for position, step in enumerate(plan):
+        indices, amplitudes = apply_sparse_step(indices, amplitudes, step, parameters)
+        if progress:
+            progress(position + 1, len(plan))
+        
+        if dense_state_fits(num_qubits, precision):
+            if len(indices) > fill_threshold * 2**num_qubits:
+                sys.stderr.write(f"稀疏态非零振幅占比超过 {fill_threshold}，切换为稠密模拟\n")
+                state_vector = np.zeros(2**num_qubits, dtype=dtype)
+                state_vector[indices] = amplitudes
+                for offset, remaining in enumerate(plan[position + 1:], position + 2):
+                    apply_plan_step(state_vector, remaining, parameters, num_qubits)
+                    if progress:
+                        progress(offset, len(plan))
+                return None, state_vector
+        elif len(indices) > min(fill_threshold * 2**num_qubits, 2**MAX_SIMULATOR_QUBITS):
+            if num_qubits > OUT_OF_CORE_MAX_QUBITS:
+                raise ValueError(f"稀疏态非零振幅超过 {2**MAX_SIMULATOR_QUBITS} 个，无法继续模拟")
+            # 稠密态向量放不进内存，写入磁盘上的 memmap 态向量后继续执行剩余步骤
+            sys.stderr.write("稀疏态非零振幅过多，切换为 memmap 态向量模拟\n")
+            state = OutOfCoreStateVector(num_qubits, dtype)
+            state.data.reshape(-1)[indices] = amplitudes
+            del indices, amplitudes
+            return None, evolve_out_of_core_circuit(compiled, parameters, progress=progress, state=state,
+                                                    start=position + 1)
+    
+    return indices, amplitudes
+
+def apply_sparse_step(indices, amplitudes, step, parameters):
+    """在稀疏态上执行一个计划步骤"""
+    kind = step[0]
+    if kind == "cx":
+        # CNOT只是下标置换：控制位为1时翻转目标位，然后重新排序
+        control, target = step[1], step[2]
+        flipped = np.where((indices >> control) & 1 == 1, indices ^ (1 << target), indices)
+        order = np.argsort(flipped)
+        return flipped[order], amplitudes[order]
+    if kind == "diag":
+        phase = np.zeros(len(indices))
+        for qubit, param in step[1]:
+            phase += parameters[param] * ((indices >> qubit) & 1)
+        return indices, amplitudes * np.exp(1j * phase).astype(amplitudes.dtype)
+    if kind == "h":
+        h_factor = 1 / np.sqrt(2)
+        matrix = np.array([[h_factor, h_factor], [h_factor, -h_factor]], dtype=complex)
+    else:
+        matrix = fuse_single_qubit_factors(step[2], parameters)
+    return _apply_sparse_single_qubit(indices, amplitudes, step[1], matrix)
+
+def _apply_sparse_single_qubit(indices, amplitudes, qubit, matrix):
+    """在稀疏态上作用2x2矩阵，合并相同下标的贡献并丢弃抵消为零的振幅"""
+    mask = 1 << qubit
+    bits = (indices >> qubit) & 1 == 1
+    base = indices & ~mask
+    
+    # 每个非零振幅向该比特为0和为1的两个下标各贡献一项
+    targets = np.concatenate([base, base | mask])
+    contributions = np.concatenate([
+        np.where(bits, matrix[0, 1], matrix[0, 0]) * amplitudes,
+        np.where(bits, matrix[1, 1], matrix[1, 0]) * amplitudes
+    ])
+    
+    new_indices, inverse = np.unique(targets, return_inverse=True)
+    new_amplitudes = np.empty(len(new_indices), dtype=amplitudes.dtype)
+    new_amplitudes.real = np.bincount(inverse, weights=contributions.real, minlength=len(new_indices))
+    new_amplitudes.imag = np.bincount(inverse, weights=contributions.imag, minlength=len(new_indices))
+    keep = np.abs(new_amplitudes) > SPARSE_AMPLITUDE_TOLERANCE
+    return new_indices[keep], new_amplitudes[keep]
+
+# 按工作进程数缓存的进程池
+PROCESS_POOLS = {}
+PROCESS_POOLS_LOCK = threading.Lock()
+
+def get_process_pool(workers):
+    """获取指定工作进程数的进程池，常驻服务模式下可重复使用"""
+    with PROCESS_POOLS_LOCK:
+        pool = PROCESS_POOLS.get(workers)
+        if pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            pool = ProcessPoolExecutor(max_workers=workers)
+            PROCESS_POOLS[workers] = pool
+        return pool
+
+def _attach_shared_memory(name):
+    """在工作进程中挂载父进程创建的共享内存
+
+    工作进程与父进程共用同一个资源跟踪器，重复登记不会导致共享内存被提前删除，
+    由父进程负责 unlink。
+    """
+    from multiprocessing import shared_memory
+    return shared_memory.SharedMemory(name=name)
+
+def _parallel_batch_worker(shm_name, shape, compiled, parameter_sets, row_start, precision=None, coherences=False):
+    """工作进程：演化一段批次，把概率写入共享内存中对应的行
+
+    coherences 为真时同时返回这段批次各量子比特约化态的非对角元（数据量很小，直接序列化）。
+    """
+    shm = _attach_shared_memory(shm_name)
+    try:
+        probabilities = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        state_vectors = evolve_compiled_circuit(compiled, parameter_sets, precision=precision)
+        probabilities[row_start:row_start + len(parameter_sets)] = state_probabilities(state_vectors)
+        del probabilities
+        if coherences:
+            return row_start, single_qubit_coherences(state_vectors, compiled["num_qubits"])
+    finally:
+        shm.close()
+    return row_start, None
+
+@timed_stage("simulation")
+def evolve_batch_parallel(compiled, parameter_sets, workers, precision=None, coherences=False):
+    """把批次拆分到多个进程中演化，结果概率经共享内存返回而不是序列化
+
+    coherences 为真时返回 (概率, 各行各量子比特约化态的非对角元)。
+    """
+    from multiprocessing import shared_memory
+    
+    shape = (len(parameter_sets), 2**compiled["num_qubits"])
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 8)
+    try:
+        pool = get_process_pool(workers)
+        bounds = np.linspace(0, len(parameter_sets), min(workers, len(parameter_sets)) + 1).astype(int)
+        futures = [
+            pool.submit(
+                _parallel_batch_worker, shm.name, shape, compiled, parameter_sets[start:end], start, precision,
+                coherences
+            )
+            for start, end in zip(bounds[:-1], bounds[1:]) if end > start
+        ]
+        parts = [future.result() for future in futures]
+        probabilities = np.ndarray(shape, dtype=float, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    if coherences:
+        return probabilities, np.concatenate([part for _, part in sorted(parts, key=lambda item: item[0])])
+    return probabilities
+
+def _is_chunk_local_step(step, local_qubits):
+    """判断计划步骤是否只在块内移动振幅
+
+    对角步骤从不移动振幅，因此即使作用于高位量子比特也可以在块内完成。
+    """
+    kind = step[0]
+    if kind == "diag":
+        return True
+    if kind == "cx":
+        return step[1] < local_qubits and step[2] < local_qubits
+    return step[1] < local_qubits
+
+def _apply_chunk_step(chunk, step, parameters, local_qubits, chunk_index):
+    """在一个态向量块上执行计划步骤，块内只包含低位量子比特"""
+    if step[0] != "diag":
+        apply_plan_step(chunk, step, parameters, local_qubits)
+        return
+    
+    local_terms = [(qubit, param) for qubit, param in step[1] if qubit < local_qubits]
+    if local_terms:
+        apply_plan_step(chunk, ("diag", local_terms), parameters, local_qubits)
+    
+    # 高位量子比特在块内取值固定，其相位退化为一个标量
+    high_angle = sum(
+        parameters[param] for qubit, param in step[1]
+        if qubit >= local_qubits and (chunk_index >> (qubit - local_qubits)) & 1
+    )
+    if high_angle:
+        chunk *= np.exp(1j * high_angle)
+
+def _parallel_chunk_worker(shm_name, num_qubits, local_qubits, chunk_index, steps, parameters, precision=None):
+    """工作进程：在共享态向量的一个块上执行一段块内步骤"""
+    shm = _attach_shared_memory(shm_name)
+    try:
+        state_vector = np.ndarray((2**num_qubits,), dtype=get_state_dtype(precision), buffer=shm.buf)
+        chunk_size = 2**local_qubits
+        chunk = state_vector[chunk_index * chunk_size:(chunk_index + 1) * chunk_size]
+        for step in steps:
+            _apply_chunk_step(chunk, step, parameters, local_qubits, chunk_index)
+        del state_vector, chunk
+    finally:
+        shm.close()
+    return chunk_index
+
+@timed_stage("simulation")
+def evolve_wide_circuit_parallel(compiled, parameters, workers, precision=None):
+    """按高位量子比特把单个宽态向量切成块，分给多个进程演化，返回测量概率
+
+    只涉及低位量子比特的门（以及所有对角门）在块内完成；跨块的门由主进程
+    在整个态向量上执行。
+    """
+    from multiprocessing import shared_memory
+    
+    num_qubits = compiled["num_qubits"]
+    parameters = np.asarray(parameters, dtype=float)
+    chunk_bits = min(int(math.log2(workers)), num_qubits - 1)
+    num_chunks = 2**chunk_bits
+    local_qubits = num_qubits - chunk_bits
+    
+    dtype = get_state_dtype(precision)
+    shm = shared_memory.SharedMemory(create=True, size=2**num_qubits * dtype.itemsize)
+    try:
+        state_vector = np.ndarray((2**num_qubits,), dtype=dtype, buffer=shm.buf)
+        state_vector[:] = 0
         state_vector[0] = 1.0
+        pool = get_process_pool(workers)
         
-        # 应用量子门操作
-        for op in circuit["operations"]:
-            if op["name"] == "h":  # Hadamard门
-                qubit = op["qubits"][0]
-                state_vector = apply_hadamard(state_vector, qubit, num_qubits)
-            elif op["name"] == "cx":  # CNOT门
-                control = op["qubits"][0]
-                target = op["qubits"][1]
-                state_vector = apply_cnot(state_vector, control, target, num_qubits)
-            elif op["name"] == "rz":  # 旋转Z门
-                qubit = op["qubits"][0]
-                angle = op.get("params", [0])[0]
-                state_vector = apply_rz(state_vector, qubit, angle, num_qubits)
-        
-        # 计算测量结果概率
-        probabilities = np.abs(state_vector)**2
+        def run_segment(segment):
+            futures = [
+                pool.submit(
+                    _parallel_chunk_worker, shm.name, num_qubits, local_qubits, index, segment, parameters, precision
+                )
+                for index in range(num_chunks)
+            ]
+            for future in futures:
+                future.result()
         
-        # 根据概率分布进行采样
-        results = {}
-        for _ in range(shots):
-            outcome = np.random.choice(2**num_qubits, p=probabilities)
-            state = format(outcome, f"0{num_qubits}b")
-            results[state] = results.get(state, 0) + 1
+        segment = []
+        for step in compiled["plan"]:
+            if _is_chunk_local_step(step, local_qubits):
+                segment.append(step)
+                continue
+            if segment:
+                run_segment(segment)
+                segment = []
+            apply_plan_step(state_vector, step, parameters, num_qubits)
+        if segment:
+            run_segment(segment)
+        
+        probabilities = state_probabilities(state_vector)
+        del state_vector
+    finally:
+        shm.close()
+        shm.unlink()
+    return probabilities
+
+def dense_state_fits(num_qubits, precision=None):
+    """判断稠密态向量和测量概率数组能否放进 MEMORY_BUDGET"""
+    return 2**num_qubits * (get_state_dtype(precision).itemsize + 8) <= MEMORY_BUDGET
+
+class OutOfCoreStateVector:
+    """保存在磁盘 memmap 文件中的态向量
+
+    态向量按低位 block_qubits 个量子比特切成 2**(n - block_qubits) 块，data[i] 是
+    高位量子比特取值为 i 的那一块。文件创建时是稀疏文件，未写入的块不占磁盘空间，
+    close 时删除；忘记 close 时在对象被回收或进程退出时删除。
+    """
+    
+    def __init__(self, num_qubits, dtype, block_qubits=None, directory=None):
+        self.num_qubits = num_qubits
+        self.block_qubits = min(block_qubits or OUT_OF_CORE_BLOCK_QUBITS, num_qubits)
+        self.num_blocks = 2**(num_qubits - self.block_qubits)
+        fd, self.path = tempfile.mkstemp(prefix="quantum-bridge-state-", suffix=".bin", dir=directory or OUT_OF_CORE_DIR)
+        os.close(fd)
+        self._cleanup = weakref.finalize(self, _remove_scratch_file, self.path)
+        self.data = np.memmap(self.path, dtype=dtype, mode="w+", shape=(self.num_blocks, 2**self.block_qubits))
+        sys.stderr.write(f"创建 memmap 态向量 {self.path}（{self.data.nbytes} 字节）\n")
+    
+    def close(self):
+        """释放映射并删除文件"""
+        self.data = None
+        self._cleanup()
+
+def _remove_scratch_file(path):
+    """删除临时文件，文件已不存在时忽略"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _step_qubits(step):
+    """返回计划步骤移动振幅时涉及的量子比特（对角步骤不移动振幅）"""
+    kind = step[0]
+    if kind == "cx":
+        return (step[1], step[2])
+    if kind == "diag":
+        return ()
+    return (step[1],)
+
+def group_out_of_core_steps(steps, local_qubits, max_high=None):
+    """把连续的计划步骤分组，每组涉及的高位量子比特不超过 max_high 个
+
+    产生 (高位量子比特元组, 步骤列表)。每组对所有块只读写一遍，
+    因此作用于低位量子比特的连续门共用一次文件遍历。
+    """
+    max_high = max_high or OUT_OF_CORE_GATHER_QUBITS
+    group = []
+    high = set()
+    for step in steps:
+        step_high = {qubit for qubit in _step_qubits(step) if qubit >= local_qubits}
+        if group and len(high | step_high) > max_high:
+            yield tuple(sorted(high)), group
+            group = []
+            high = set()
+        group.append(step)
+        high |= step_high
+    if group:
+        yield tuple(sorted(high)), group
+
+def apply_out_of_core_group(state, high, steps, parameters):
+    """在 memmap 态向量上执行一组步骤
+
+    不涉及高位量子比特时直接在每一块上原地执行；否则把高位量子比特取值不同的
+    2**len(high) 块拼成一个小态向量（高位量子比特依次映射到块内下标之后），
+    执行完再写回。对角步骤中其余高位量子比特在块内取值固定，相位退化为标量。
+    """
+    local_qubits = state.block_qubits
+    gathered_qubits = local_qubits + len(high)
+    position = {qubit: local_qubits + j for j, qubit in enumerate(high)}
+    
+    def remap(qubit):
+        return qubit if qubit < local_qubits else position[qubit]
+    
+    remapped = []
+    for step in steps:
+        kind = step[0]
+        if kind == "diag":
+            inside = [(remap(qubit), param) for qubit, param in step[1] if qubit < local_qubits or qubit in position]
+            outside = [(qubit, param) for qubit, param in step[1] if qubit >= local_qubits and qubit not in position]
+            remapped.append((("diag", inside) if inside else None, outside))
+        elif kind == "cx":
+            remapped.append((("cx", remap(step[1]), remap(step[2])), []))
+        else:
+            remapped.append(((kind, remap(step[1])) + tuple(step[2:]), []))
+    
+    high_mask = sum(1 << (qubit - local_qubits) for qubit in high)
+    offsets = [
+        sum(((combination >> j) & 1) << (qubit - local_qubits) for j, qubit in enumerate(high))
+        for combination in range(2**len(high))
+    ]
+    for base in range(state.num_blocks):
+        if base & high_mask:
+            continue
+        if high:
+            rows = [base | offset for offset in offsets]
+            gathered = np.ascontiguousarray(state.data[rows]).reshape(-1)
+        else:
+            gathered = state.data[base]
+        for step, outside in remapped:
+            if step is not None:
+                apply_plan_step(gathered, step, parameters, gathered_qubits)
+            angle = sum(parameters[param] for qubit, param in outside if (base >> (qubit - local_qubits)) & 1)
+            if angle:
+                gathered *= np.exp(1j * angle)
+        if high:
+            state.data[rows] = gathered.reshape(len(rows), -1)
+
+@timed_stage("simulation")
+def evolve_out_of_core_circuit(compiled, parameters=None, precision=None, progress=None, state=None, start=0):
+    """用磁盘上的 memmap 态向量执行编译电路，返回 OutOfCoreStateVector
+
+    内存中同时只保留 2**OUT_OF_CORE_GATHER_QUBITS 块。state 和 start 用于
+    从稀疏后端切换过来后继续执行剩余步骤。出错时删除态向量文件。
+    """
+    num_qubits = compiled["num_qubits"]
+    if parameters is None:
+        parameters = np.zeros(compiled["num_params"])
+    parameters = np.asarray(parameters, dtype=float)
+    plan = compiled["plan"]
+    if state is None:
+        state = OutOfCoreStateVector(num_qubits, get_state_dtype(precision))
+        state.data[0, 0] = 1.0
+    
+    try:
+        completed = start
+        for high, steps in group_out_of_core_steps(plan[start:], state.block_qubits):
+            apply_out_of_core_group(state, high, steps, parameters)
+            completed += len(steps)
+            if progress:
+                progress(completed, len(plan))
+    except BaseException:
+        state.close()
+        raise
+    return state
+
+def out_of_core_report(state):
+    """返回 memmap 态向量的内存与磁盘字节数：内存中同时最多保留 2**OUT_OF_CORE_GATHER_QUBITS 块"""
+    blocks = min(2**OUT_OF_CORE_GATHER_QUBITS, state.num_blocks)
+    return {"allocated_bytes": blocks * state.data[0].nbytes, "disk_bytes": state.data.nbytes}
+
+@timed_stage("sampling")
+def measure_out_of_core_state(state, shots, rng=None, exact=False):
+    """逐块计算 memmap 态向量的测量结果，内存中只保留一块的概率，完成后删除文件
+
+    采样分两遍：先求每块的总概率并按多项分布分配采样次数，再只在分到采样的块内抽样。
+    exact 为真时返回稀疏的精确概率分布。
+    """
+    try:
+        num_qubits = state.num_qubits
+        block_size = state.data.shape[1]
+        if exact:
+            kept = {}
+            for index in range(state.num_blocks):
+                probabilities = state_probabilities(state.data[index])
+                for offset in np.flatnonzero(probabilities > EXACT_PROBABILITY_TOLERANCE).tolist():
+                    kept[format(index * block_size + offset, f"0{num_qubits}b")] = float(probabilities[offset])
+            total = sum(kept.values())
+            return {outcome: probability / total for outcome, probability in kept.items()}
+        
+        if rng is None:
+            rng = np.random.default_rng()
+        totals = np.array([state_probabilities(state.data[index]).sum() for index in range(state.num_blocks)])
+        block_shots = rng.multinomial(shots, totals / totals.sum())
+        counts = {}
+        for index in np.flatnonzero(block_shots).tolist():
+            probabilities = state_probabilities(state.data[index])
+            outcome_counts = rng.multinomial(block_shots[index], probabilities / probabilities.sum())
+            for offset in np.flatnonzero(outcome_counts).tolist():
+                counts[format(index * block_size + offset, f"0{num_qubits}b")] = int(outcome_counts[offset])
+        return counts
+    finally:
+        state.close()
+
+def measure_parallel_throughput(num_qubits=12, batch_size=64, wide_qubits=PARALLEL_MIN_QUBITS, worker_counts=None):
+    """测量不同工作进程数下的批量模拟吞吐量和宽电路模拟耗时"""
+    worker_counts = worker_counts or sorted({1, 2, 4, os.cpu_count() or 1})
+    rng = np.random.default_rng(0)
+    
+    def shaped_circuit(n):
+        operations = [{"name": "h", "qubits": [i]} for i in range(n)]
+        operations += [{"name": "cx", "qubits": [i, i + 1]} for i in range(n - 1)]
+        operations += [{"name": "rz", "qubits": [i], "params": [0.0]} for i in range(n)]
+        return compile_circuit({"num_qubits": n, "operations": operations})
+    
+    batch_compiled = shaped_circuit(num_qubits)
+    wide_compiled = shaped_circuit(wide_qubits)
+    parameter_sets = rng.uniform(0, 2*math.pi, (batch_size, batch_compiled["num_params"]))
+    wide_parameters = rng.uniform(0, 2*math.pi, wide_compiled["num_params"])
+    
+    report = []
+    for workers in worker_counts:
+        if workers > 1:
+            # 预热进程池，避免把进程启动时间计入吞吐量
+            evolve_batch_parallel(batch_compiled, parameter_sets[:workers], workers)
+        
+        start = time.perf_counter()
+        if workers > 1:
+            evolve_batch_parallel(batch_compiled, parameter_sets, workers)
+        else:
+            np.abs(evolve_compiled_circuit(batch_compiled, parameter_sets))**2
+        batch_seconds = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        if workers > 1:
+            evolve_wide_circuit_parallel(wide_compiled, wide_parameters, workers)
+        else:
+            np.abs(evolve_compiled_circuit(wide_compiled, wide_parameters))**2
+        wide_seconds = time.perf_counter() - start
+        
+        report.append({
+            "workers": workers,
+            "batch_seconds": batch_seconds,
+            "circuits_per_second": batch_size / batch_seconds,
+            "wide_seconds": wide_seconds
+        })
+    
+    return {
+        "num_qubits": num_qubits,
+        "batch_size": batch_size,
+        "wide_qubits": wide_qubits,
+        "results": report
+    }
+
+@timed_stage("sampling")
+def sample_measurement_counts(probabilities, shots, num_qubits, rng=None, outcomes=None):
+    """按概率分布一次性抽取所有测量结果，返回比特串计数
+
+    outcomes 不为空时，probabilities 只对应这些结果下标（稀疏表示）。
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    
+    # 归一化以消除浮点累积误差，然后用多项分布一次抽取全部样本
+    probabilities = np.asarray(probabilities, dtype=float)
+    probabilities = probabilities / probabilities.sum()
+    outcome_counts = rng.multinomial(shots, probabilities)
+    
+    # 只为出现过的结果格式化比特串
+    observed = np.flatnonzero(outcome_counts)
+    labels = observed if outcomes is None else outcomes[observed]
+    return {
+        format(int(label), f"0{num_qubits}b"): int(outcome_counts[position])
+        for label, position in zip(labels, observed)
+    }
+
+@timed_stage("sampling")
+def exact_probability_distribution(probabilities, num_qubits, outcomes=None):
+    """返回精确概率分布的稀疏表示，只保留非零结果
+
+    outcomes 不为空时，probabilities 只对应这些结果下标（稀疏表示）。
+    """
+    kept_positions = np.flatnonzero(probabilities > EXACT_PROBABILITY_TOLERANCE)
+    kept = probabilities[kept_positions].astype(float)
+    kept = kept / kept.sum()
+    outcomes = kept_positions if outcomes is None else outcomes[kept_positions]
+    return {
+        format(int(outcome), f"0{num_qubits}b"): float(probability)
+        for outcome, probability in zip(outcomes, kept)
+    }
+
+def _qubit_view(state_vector, qubit, num_qubits):
+    """将态向量重塑为 (..., 高位, 2, 低位) 视图，倒数第二轴对应指定量子比特（小端序）
+
+    前导维度保留为批次维度，因此同一个门可以一次作用于一组态向量。
+    """
+    return state_vector.reshape(state_vector.shape[:-1] + (2**(num_qubits - qubit - 1), 2, 2**qubit))
+
+def _pair_view(state_vector, qubit_a, qubit_b, num_qubits):
+    """将态向量重塑为 (..., 高位, 2, 中间, 2, 低位) 视图，两个长度为2的轴分别对应较高和较低的量子比特"""
+    high, low = max(qubit_a, qubit_b), min(qubit_a, qubit_b)
+    return state_vector.reshape(
+        state_vector.shape[:-1] + (2**(num_qubits - high - 1), 2, 2**(high - low - 1), 2, 2**low)
+    )
+
+def _iter_blocks(shape, limit=KERNEL_BLOCK_ELEMENTS):
+    """把末尾若干轴的形状切成元素数不超过 limit 的块，逐个产生索引元组
+
+    索引以 Ellipsis 开头，因此可以直接用于带批次维度的视图。
+    """
+    if not shape:
+        yield (Ellipsis,)
+        return
+    inner = int(np.prod(shape[1:]))
+    if inner <= limit:
+        step = max(1, limit // inner)
+        for start in range(0, shape[0], step):
+            yield (Ellipsis, slice(start, start + step)) + (slice(None),) * (len(shape) - 1)
+    else:
+        for i in range(shape[0]):
+            for rest in _iter_blocks(shape[1:], limit):
+                yield (Ellipsis, slice(i, i + 1)) + rest[1:]
+
+def apply_hadamard(state_vector, qubit, num_qubits):
+    """应用Hadamard门到指定量子比特（原地更新，不分配临时数组）"""
+    view = _qubit_view(state_vector, qubit, num_qubits)
+    h_factor = 1 / math.sqrt(2)
+    
+    # |0⟩ -> (|0⟩ + |1⟩)/√2, |1⟩ -> (|0⟩ - |1⟩)/√2
+    # 先令 a = a + b，再由 b = a - 2b 得到 a - b
+    view[..., 0, :] += view[..., 1, :]
+    view[..., 1, :] *= -2
+    view[..., 1, :] += view[..., 0, :]
+    view *= h_factor
+    
+    return state_vector
+
+def apply_cnot(state_vector, control, target, num_qubits):
+    """应用CNOT门到指定控制和目标量子比特（原地更新）"""
+    view = _pair_view(state_vector, control, target, num_qubits)
+    
+    # 控制位为1的子空间中交换目标位为0和1的振幅
+    if control > target:
+        flip_zero = (Ellipsis, 1, slice(None), 0, slice(None))
+        flip_one = (Ellipsis, 1, slice(None), 1, slice(None))
+    else:
+        flip_zero = (Ellipsis, 0, slice(None), 1, slice(None))
+        flip_one = (Ellipsis, 1, slice(None), 1, slice(None))
+    
+    # 分块交换，临时缓冲区不超过 KERNEL_BLOCK_ELEMENTS 个元素
+    zero_part = view[flip_zero]
+    one_part = view[flip_one]
+    for block in _iter_blocks(zero_part.shape[-3:]):
+        swapped = zero_part[block].copy()
+        zero_part[block] = one_part[block]
+        one_part[block] = swapped
+    
+    return state_vector
+
+def apply_rz(state_vector, qubit, angle, num_qubits):
+    """应用旋转Z门到指定量子比特（原地更新）
+
+    angle 可以是标量，也可以是与批次维度形状相同的角度数组。
+    """
+    view = _qubit_view(state_vector, qubit, num_qubits)
+    phase = np.exp(1j * np.asarray(angle)).astype(state_vector.dtype)
+    if phase.ndim:
+        phase = phase.reshape(phase.shape + (1, 1))
+    
+    # 第qubit位为1的振幅乘以相位因子
+    view[..., 1, :] *= phase
+    
+    return state_vector
+
+def outcome_bits(outcomes, num_qubits):
+    """把结果下标数组展开为 (结果数, 量子比特数) 的0/1矩阵，第 q 列为第 q 个量子比特（小端序）"""
+    outcomes = np.asarray(outcomes, dtype=np.int64)
+    return ((outcomes[:, np.newaxis] >> np.arange(num_qubits)) & 1).astype(float)
+
+def pairwise_joint_probabilities(probabilities, num_qubits, outcomes=None):
+    """返回 joint[i, j] = P(q_i = 1, q_j = 1)，对角线即单比特边缘概率 P(q_i = 1)
+
+    稠密概率数组重塑为 (高位, 低位) 矩阵：两个比特都在低位或都在高位时先对另一半
+    求和再在小数组上计算，跨两半的比特对由一次矩阵乘法得到，总成本 O(n·2^n)。
+    outcomes 不为空时 probabilities 只对应这些结果下标，逐块累加。
+    """
+    probabilities = np.asarray(probabilities, dtype=float)
+    if outcomes is not None:
+        joint = np.zeros((num_qubits, num_qubits))
+        for start in range(0, len(outcomes), MARGINAL_CHUNK_OUTCOMES):
+            bits = outcome_bits(outcomes[start:start + MARGINAL_CHUNK_OUTCOMES], num_qubits)
+            joint += bits.T @ (probabilities[start:start + MARGINAL_CHUNK_OUTCOMES, np.newaxis] * bits)
+        return joint
+    
+    low = num_qubits // 2
+    high = num_qubits - low
+    matrix = probabilities.reshape(2**high, 2**low)
+    low_bits = outcome_bits(np.arange(2**low), low)
+    high_bits = outcome_bits(np.arange(2**high), high)
+    
+    joint = np.empty((num_qubits, num_qubits))
+    joint[:low, :low] = low_bits.T @ (matrix.sum(axis=0)[:, np.newaxis] * low_bits)
+    joint[low:, low:] = high_bits.T @ (matrix.sum(axis=1)[:, np.newaxis] * high_bits)
+    cross = high_bits.T @ (matrix @ low_bits)
+    joint[low:, :low] = cross
+    joint[:low, low:] = cross.T
+    return joint
+
+def single_qubit_coherences(state_vector, num_qubits, outcomes=None):
+    """返回每个量子比特约化密度矩阵的非对角元 ρ01 = Σ a(…0…)·conj(a(…1…))
+
+    稠密态向量（可带批次维度）按 _qubit_view 分块求和；outcomes 不为空时
+    state_vector 为按下标排序的稀疏振幅，用二分查找配对翻转该比特后的下标。
+    """
+    if outcomes is not None:
+        coherences = np.zeros(num_qubits, dtype=complex)
+        for qubit in range(num_qubits):
+            zero = (outcomes >> qubit) & 1 == 0
+            partners = outcomes[zero] | (1 << qubit)
+            positions = np.minimum(np.searchsorted(outcomes, partners), len(outcomes) - 1)
+            found = outcomes[positions] == partners
+            coherences[qubit] = np.sum(state_vector[zero][found] * np.conj(state_vector[positions[found]]))
+        return coherences
+    
+    coherences = np.zeros(state_vector.shape[:-1] + (num_qubits,), dtype=complex)
+    for qubit in range(num_qubits):
+        view = _qubit_view(state_vector, qubit, num_qubits)
+        zero, one = view[..., 0, :], view[..., 1, :]
+        for block in _iter_blocks(zero.shape[-2:]):
+            coherences[..., qubit] += np.einsum("...ij,...ij->...", zero[block], np.conj(one[block]))
+    return coherences
+
+class QubitMarginals:
+    """测量分布的多级边缘统计：单比特边缘概率、成对联合概率和单比特约化态
+
+    由态向量或概率分布一次性算出，之后任意量子比特子集的边缘分布直接在保留的
+    分布上按轴求和，不必重新模拟，也不必逐个解析比特串。量子比特按小端序编号，
+    与模拟器一致；只由测量结果得到时 coherences 为 None。
+    """
+    
+    def __init__(self, num_qubits, joint, coherences=None, probabilities=None, outcomes=None):
+        self.num_qubits = num_qubits
+        self.joint = joint
+        self.ones = np.clip(np.diag(joint).copy(), 0.0, 1.0)
+        self.coherences = coherences
+        self._probabilities = probabilities
+        self._outcomes = outcomes
+    
+    @classmethod
+    def from_distribution(cls, probabilities, num_qubits, outcomes=None, coherences=None):
+        """由（稠密或稀疏的）概率分布构建，probabilities 不必归一化"""
+        probabilities = np.asarray(probabilities, dtype=float)
+        total = float(probabilities.sum())
+        if total <= 0:
+            raise ValueError("概率分布总和为0")
+        if outcomes is not None:
+            outcomes = np.asarray(outcomes, dtype=np.int64)
+        probabilities = probabilities / total
+        joint = pairwise_joint_probabilities(probabilities, num_qubits, outcomes)
+        return cls(num_qubits, joint, coherences, probabilities, outcomes)
+    
+    @classmethod
+    def from_state_vector(cls, state_vector, num_qubits, outcomes=None, probabilities=None):
+        """由态向量构建，约化态的非对角元直接取自振幅；probabilities 可传入已算好的测量概率"""
+        if probabilities is None:
+            probabilities = state_probabilities(state_vector)
+        coherences = single_qubit_coherences(state_vector, num_qubits, outcomes)
+        return cls.from_distribution(probabilities, num_qubits, outcomes, coherences)
+    
+    def z_expectations(self):
+        """每个量子比特的 ⟨Z⟩ = P(0) - P(1)"""
+        return 1.0 - 2.0 * self.ones
+    
+    def correlations(self):
+        """成对连通关联矩阵 ⟨Z_i Z_j⟩ - ⟨Z_i⟩⟨Z_j⟩"""
+        ones = self.ones
+        zz = 1.0 - 2.0 * ones[:, np.newaxis] - 2.0 * ones[np.newaxis, :] + 4.0 * self.joint
+        z = self.z_expectations()
+        return zz - np.outer(z, z)
+    
+    def reduced_density_matrix(self, qubit):
+        """单个量子比特的约化密度矩阵；只有测量结果时非对角元按0处理"""
+        coherence = complex(self.coherences[qubit]) if self.coherences is not None else 0j
+        return np.array([
+            [1.0 - self.ones[qubit], coherence],
+            [coherence.conjugate(), self.ones[qubit]]
+        ])
+    
+    def purities(self):
+        """每个量子比特约化态的纯度 Tr(ρ²)，没有非对角元时为 None"""
+        if self.coherences is None:
+            return None
+        return (1.0 - self.ones)**2 + self.ones**2 + 2.0 * np.abs(self.coherences)**2
+    
+    def marginal(self, qubits):
+        """返回量子比特子集的边缘分布，长度为 2**len(qubits)
+
+        结果下标的第 m 位对应 qubits[m]。一到两个比特直接由预先计算的联合概率得到，
+        更多比特时在保留的分布上对其余量子比特的轴求和。
+        """
+        qubits = [int(q) for q in qubits]
+        if len(set(qubits)) != len(qubits) or any(q < 0 or q >= self.num_qubits for q in qubits):
+            raise ValueError(f"无效的量子比特子集: {qubits}")
+        if not qubits:
+            return np.ones(1)
+        if len(qubits) == 1:
+            return np.array([1.0 - self.ones[qubits[0]], self.ones[qubits[0]]])
+        if len(qubits) == 2:
+            a, b = qubits
+            both = self.joint[a, b]
+            return np.array([1.0 - self.ones[a] - self.ones[b] + both, self.ones[a] - both, self.ones[b] - both, both])
+        if self._probabilities is None:
+            raise ValueError("没有保留完整分布，只能查询一到两个量子比特的边缘分布")
+        
+        if self._outcomes is not None:
+            bits = (self._outcomes[:, np.newaxis] >> np.array(qubits)) & 1
+            labels = bits @ (1 << np.arange(len(qubits)))
+            return np.bincount(labels, weights=self._probabilities, minlength=2**len(qubits))
         
-        return results
-    except Exception as e:
-        sys.stderr.write(f"模拟量子电路时出错: {str(e)}\n")
-        raise e
+        # 稠密分布重塑为每个量子比特一个长度为2的轴，第 q 个量子比特位于第 n-1-q 轴
+        axes = [self.num_qubits - 1 - q for q in qubits]
+        kept = sorted(axes)
+        tensor = self._probabilities.reshape((2,) * self.num_qubits)
+        tensor = tensor.sum(axis=tuple(a for a in range(self.num_qubits) if a not in axes))
+        return np.transpose(tensor, [kept.index(a) for a in reversed(axes)]).reshape(-1)
+    
+    def to_dict(self):
+        """转换为可序列化为JSON的字典，coherences 为各量子比特约化态的 l1 相干度 2|ρ01|"""
+        purities = self.purities()
+        return {
+            "num_qubits": self.num_qubits,
+            "ones": self.ones.tolist(),
+            "correlations": self.correlations().tolist(),
+            "coherences": (2.0 * np.abs(self.coherences)).tolist() if self.coherences is not None else None,
+            "purities": purities.tolist() if purities is not None else None
+        }
 
-def apply_hadamard(state_vector, qubit, num_qubits):
-    """应用Hadamard门到指定量子比特"""
-    new_state = np.zeros_like(state_vector)
-    n = 2**num_qubits
-    h_factor = 1 / np.sqrt(2)
+@timed_stage("analysis")
+def compute_qubit_marginals(state_vector, num_qubits, outcomes=None, probabilities=None):
+    """由态向量（或只有测量概率时由 probabilities）计算 QubitMarginals
+
+    outcomes 不为空时两者均为稀疏表示。state_vector 为 None 时不含约化态的非对角元。
+    """
+    if state_vector is None:
+        return QubitMarginals.from_distribution(probabilities, num_qubits, outcomes)
+    return QubitMarginals.from_state_vector(state_vector, num_qubits, outcomes, probabilities)
+
+def marginals_from_outcomes(outcomes, weights, valid, key_length):
+    """由解析后的测量结果计算 QubitMarginals，没有有效结果或下标不是整数时返回 None"""
+    if key_length <= 0 or outcomes.dtype.kind != "i" or not valid.any() or weights[valid].sum() <= 0:
+        return None
+    return QubitMarginals.from_distribution(weights[valid], key_length, outcomes[valid])
+
+def marginals_from_results(results):
+    """由 {比特串: 计数或概率} 字典计算 QubitMarginals，用于没有态向量的后端"""
+    if not results:
+        return None
+    return marginals_from_outcomes(*parse_outcome_distribution(results))
+
+def clifford_program(compiled, parameters=None):
+    """把执行计划转换为稳定子后端的门序列，含非Clifford门时返回 None
+
+    从计划末尾向前扫描：之后不再被非对角门作用的量子比特（CX的控制位与对角门
+    对易，不计在内）上的RZ只改变相位、不改变测量概率，记为末尾相位；其余RZ角度
+    必须是 π/2 的整数倍，转换为S门。返回 (门列表, {量子比特: 末尾相位角之和})，
+    门为 ("h", q)、("s", q)、("cx", c, t)。
+    """
+    if parameters is None:
+        parameters = np.zeros(compiled["num_params"])
+    parameters = np.asarray(parameters, dtype=float)
+    if parameters.ndim != 1:
+        return None
+    gates = []
+    trailing = {}
+    touched = set()
     
-    for i in range(n):
-        # 检查第qubit位是0还是1
-        bit_val = (i >> qubit) & 1
-        # 计算翻转第qubit位后的索引
-        flipped = i ^ (1 << qubit)
-        
-        if bit_val == 0:
-            # |0⟩ -> (|0⟩ + |1⟩)/√2
-            new_state[i] += h_factor * state_vector[i]
-            new_state[flipped] += h_factor * state_vector[i]
-        else:
-            # |1⟩ -> (|0⟩ - |1⟩)/√2
-            new_state[flipped] += h_factor * state_vector[i]
-            new_state[i] -= h_factor * state_vector[i]
+    def add_phase(qubit, param):
+        angle = float(parameters[param])
+        if qubit not in touched:
+            trailing[qubit] = trailing.get(qubit, 0.0) + angle
+            return True
+        quarters = angle / (math.pi / 2)
+        turns = round(quarters)
+        if abs(quarters - turns) > CLIFFORD_ANGLE_TOLERANCE:
+            return False
+        gates.extend([("s", qubit)] * (turns % 4))
+        return True
     
-    return new_state
+    for step in reversed(compiled["plan"]):
+        kind = step[0]
+        if kind == "diag":
+            if not all(add_phase(qubit, param) for qubit, param in step[1]):
+                return None
+        elif kind == "unitary":
+            for factor in reversed(step[2]):
+                if factor[0] == "h":
+                    gates.append(("h", step[1]))
+                    touched.add(step[1])
+                elif not add_phase(step[1], factor[1]):
+                    return None
+        elif kind == "h":
+            gates.append(step)
+            touched.add(step[1])
+        else:
+            gates.append(step)
+            touched.add(step[2])
+    gates.reverse()
+    return gates, trailing
 
-def apply_cnot(state_vector, control, target, num_qubits):
-    """应用CNOT门到指定控制和目标量子比特"""
-    new_state = state_vector.copy()
-    n = 2**num_qubits
+def _pauli_product_signs(x, z, r, px, pz, pr):
+    """CHP 的 rowsum：各行 (x, z, r) 乘以同一个Pauli (px, pz, pr) 后的符号位
+
+    各行须与该Pauli对易，乘积的相位因此只能是 ±1。x、z 可以是一行或多行。
+    """
+    x, z = x.astype(np.int8), z.astype(np.int8)
+    px, pz = px.astype(np.int8), pz.astype(np.int8)
+    # g 为两个单比特Pauli相乘产生的 i 的指数
+    g = np.where(px & pz, z - x, np.where(px, z * (2 * x - 1), np.where(pz, x * (1 - 2 * z), 0)))
+    total = 2 * r.astype(np.int64) + 2 * int(pr) + g.sum(axis=-1, dtype=np.int64)
+    return total % 4 == 2
+
+class StabilizerTableau:
+    """Aaronson-Gottesman 稳定子表：前 n 行为去稳定子，后 n 行为稳定子
+
+    x、z 按 (量子比特, 行) 存放，每个门只更新一两个量子比特对应的连续行向量，
+    r 为各行的符号位。初始态 |0⟩^⊗n 的去稳定子为 X_i，稳定子为 Z_i。
+    """
+    
+    def __init__(self, num_qubits):
+        self.num_qubits = num_qubits
+        self.x = np.zeros((num_qubits, 2 * num_qubits), dtype=bool)
+        self.z = np.zeros((num_qubits, 2 * num_qubits), dtype=bool)
+        self.r = np.zeros(2 * num_qubits, dtype=bool)
+        qubits = np.arange(num_qubits)
+        self.x[qubits, qubits] = True
+        self.z[qubits, qubits + num_qubits] = True
+    
+    def hadamard(self, qubit):
+        """H：交换X和Z，Y变为-Y"""
+        self.r ^= self.x[qubit] & self.z[qubit]
+        swapped = self.x[qubit].copy()
+        self.x[qubit] = self.z[qubit]
+        self.z[qubit] = swapped
     
-    for i in range(n):
-        # 检查控制位是否为1
-        control_val = (i >> control) & 1
-        if control_val == 1:
-            # 如果控制位为1，翻转目标位
-            target_flipped = i ^ (1 << target)
-            # 交换状态
-            new_state[i], new_state[target_flipped] = new_state[target_flipped], new_state[i]
+    def phase(self, qubit):
+        """S = diag(1, i)：X变为Y，Y变为-X"""
+        self.r ^= self.x[qubit] & self.z[qubit]
+        self.z[qubit] ^= self.x[qubit]
     
-    return new_state
+    def cnot(self, control, target):
+        """CNOT：X_c 变为 X_c X_t，Z_t 变为 Z_c Z_t"""
+        xc, zc, xt, zt = self.x[control], self.z[control], self.x[target], self.z[target]
+        self.r ^= xc & zt & ~(xt ^ zc)
+        xt ^= xc
+        zc ^= zt
+    
+    def measurement_subspace(self):
+        """返回计算基测量结果的仿射子空间 (x0, basis)，结果在 x0 ⊕ span(basis 的行) 上均匀分布
 
-def apply_rz(state_vector, qubit, angle, num_qubits):
-    """应用旋转Z门到指定量子比特"""
-    new_state = state_vector.copy()
-    n = 2**num_qubits
+        对稳定子行按X部分做高斯消元（带符号相乘），含X的 k 行的X部分张成方向空间，
+        其余只含Z的行给出奇偶约束 z·b = r，解约束得到特解 x0。成本 O(n^3)。
+        """
+        n = self.num_qubits
+        x = self.x[:, n:].T.copy()
+        z = self.z[:, n:].T.copy()
+        r = self.r[n:].copy()
+        rank = 0
+        for qubit in range(n):
+            rows = np.flatnonzero(x[rank:, qubit])
+            if not len(rows):
+                continue
+            pivot = rank + rows[0]
+            x[[rank, pivot]], z[[rank, pivot]], r[[rank, pivot]] = x[[pivot, rank]], z[[pivot, rank]], r[[pivot, rank]]
+            others = np.flatnonzero(x[:, qubit])
+            others = others[others != rank]
+            if len(others):
+                r[others] = _pauli_product_signs(x[others], z[others], r[others], x[rank], z[rank], r[rank])
+                x[others] ^= x[rank]
+                z[others] ^= z[rank]
+            rank += 1
+        
+        # 只含Z的行：乘积没有相位，按普通的GF(2)线性方程组求解，自由变量取0
+        constraints, signs = z[rank:], r[rank:]
+        x0 = np.zeros(n, dtype=bool)
+        row = 0
+        for qubit in range(n):
+            rows = np.flatnonzero(constraints[row:, qubit])
+            if not len(rows):
+                continue
+            pivot = row + rows[0]
+            constraints[[row, pivot]], signs[[row, pivot]] = constraints[[pivot, row]], signs[[pivot, row]]
+            others = np.flatnonzero(constraints[:, qubit])
+            others = others[others != row]
+            constraints[others] ^= constraints[row]
+            signs[others] ^= signs[row]
+            row += 1
+        pivots = [int(np.flatnonzero(constraint)[0]) for constraint in constraints[:row]]
+        x0[pivots] = signs[:row]
+        return x0, x[:rank]
+    
+    def single_qubit_coherences(self):
+        """返回每个量子比特约化密度矩阵的非对角元 ρ01 = (⟨X⟩ - i⟨Y⟩) / 2
+
+        稳定子态的单比特约化态要么是某个Pauli的本征态，要么是最大混态：稳定子在
+        该比特上只出现一种非单位Pauli时为纯态。纯态为X或Y本征态时，用去稳定子
+        找出组成 ±X_q 或 ±Y_q 的稳定子并相乘得到符号。
+        """
+        n = self.num_qubits
+        coherences = np.zeros(n, dtype=complex)
+        for qubit in range(n):
+            sx, sz = self.x[qubit, n:], self.z[qubit, n:]
+            kinds = [bool((sx & ~sz).any()), bool((sx & sz).any()), bool((~sx & sz).any())]
+            if sum(kinds) != 1 or kinds[2]:
+                continue
+            px, pz = True, kinds[1]
+            members = np.flatnonzero((self.x[qubit, :n] & pz) ^ (self.z[qubit, :n] & px))
+            ax = np.zeros(n, dtype=bool)
+            az = np.zeros(n, dtype=bool)
+            sign = False
+            for member in (members + n).tolist():
+                sign = bool(_pauli_product_signs(ax, az, np.bool_(sign), self.x[:, member], self.z[:, member],
+                                                 self.r[member]))
+                ax ^= self.x[:, member]
+                az ^= self.z[:, member]
+            expectation = -1.0 if sign else 1.0
+            coherences[qubit] = expectation / 2 if not pz else -1j * expectation / 2
+        return coherences
+
+class StabilizerMarginals(QubitMarginals):
+    """稳定子态的边缘统计：测量结果在仿射子空间上均匀分布，任意子集的边缘分布都可以直接枚举"""
+    
+    def __init__(self, x0, basis, coherences=None):
+        num_qubits = len(x0)
+        columns = basis.T
+        spanning = columns.any(axis=1)
+        if columns.shape[1]:
+            _, labels = np.unique(np.packbits(columns, axis=1), axis=0, return_inverse=True)
+            labels = labels.reshape(-1)
+        else:
+            labels = np.zeros(num_qubits, dtype=np.int64)
+        same = labels[:, np.newaxis] == labels[np.newaxis, :]
+        fixed = x0.astype(float)
+        # 两比特都随机时：方向相同则两者之差固定，否则相互独立
+        joint = np.where(
+            spanning[:, np.newaxis] & spanning[np.newaxis, :],
+            np.where(same, 0.5 * (x0[:, np.newaxis] == x0[np.newaxis, :]), 0.25),
+            np.where(spanning[:, np.newaxis], 0.5 * fixed[np.newaxis, :],
+                     np.where(spanning[np.newaxis, :], 0.5 * fixed[:, np.newaxis], np.outer(fixed, fixed)))
+        )
+        super().__init__(num_qubits, joint, coherences)
+        self._x0 = x0
+        self._basis = basis
     
-    for i in range(n):
-        # 检查第qubit位是否为1
-        bit_val = (i >> qubit) & 1
-        if bit_val == 1:
-            # 如果为1，应用相位旋转
-            new_state[i] *= np.exp(1j * angle)
+    def marginal(self, qubits):
+        """返回量子比特子集的边缘分布，结果下标的第 m 位对应 qubits[m]"""
+        qubits = [int(q) for q in qubits]
+        if len(set(qubits)) != len(qubits) or any(q < 0 or q >= self.num_qubits for q in qubits):
+            raise ValueError(f"无效的量子比特子集: {qubits}")
+        support = stabilizer_support(self._x0[qubits], self._basis[:, qubits])
+        labels = support.astype(np.int64) @ (1 << np.arange(len(qubits), dtype=np.int64))
+        return np.bincount(labels, minlength=2**len(qubits)) / len(support)
+
+def stabilizer_support(x0, basis):
+    """枚举仿射子空间 x0 ⊕ span(basis) 中的全部比特向量，basis 的行可以线性相关"""
+    rows = basis.copy()
+    rank = 0
+    for column in range(rows.shape[1]):
+        candidates = np.flatnonzero(rows[rank:, column])
+        if not len(candidates):
+            continue
+        pivot = rank + candidates[0]
+        rows[[rank, pivot]] = rows[[pivot, rank]]
+        others = np.flatnonzero(rows[:, column])
+        rows[others[others != rank]] ^= rows[rank]
+        rank += 1
+    combinations = outcome_bits(np.arange(2**rank), rank)
+    return ((combinations @ rows[:rank].astype(float)) % 2).astype(bool) ^ x0
+
+def format_bit_rows(bits):
+    """把 (结果数, 量子比特数) 的布尔矩阵格式化为比特串列表，第 q 列为第 q 个量子比特（小端序）"""
+    characters = np.where(bits[:, ::-1], ord("1"), ord("0")).astype(np.uint8)
+    return [row.tobytes().decode("ascii") for row in characters]
+
+@timed_stage("simulation")
+def evolve_stabilizer_circuit(num_qubits, gates):
+    """在稳定子表上执行 clifford_program 生成的门序列，成本为 O(门数 × 量子比特数)"""
+    tableau = StabilizerTableau(num_qubits)
+    for gate in gates:
+        if gate[0] == "h":
+            tableau.hadamard(gate[1])
+        elif gate[0] == "s":
+            tableau.phase(gate[1])
+        else:
+            tableau.cnot(gate[1], gate[2])
+    return tableau
+
+@timed_stage("sampling")
+def measure_stabilizer_state(x0, basis, shots, rng=None, exact=False):
+    """在测量结果的仿射子空间上采样（或返回精确分布），不生成态向量
+
+    结果数 2**k 不超过采样次数时先枚举全部结果再用多项分布一次抽取，
+    否则逐块抽取随机系数后映射为比特串。
+    """
+    k = len(basis)
+    if exact or 2**min(k, 62) <= shots:
+        if k > STABILIZER_MAX_EXACT_BITS:
+            raise ValueError(f"测量结果有 2**{k} 种，超过精确分布的上限 2**{STABILIZER_MAX_EXACT_BITS}")
+        labels = format_bit_rows(stabilizer_support(x0, basis))
+        if exact:
+            return {label: 1.0 / len(labels) for label in sorted(labels)}
+        if rng is None:
+            rng = np.random.default_rng()
+        outcome_counts = rng.multinomial(shots, np.full(len(labels), 1.0 / len(labels)))
+        return {labels[i]: int(outcome_counts[i]) for i in np.flatnonzero(outcome_counts).tolist()}
     
-    return new_state
+    if rng is None:
+        rng = np.random.default_rng()
+    basis = basis.astype(float)
+    counts = {}
+    for start in range(0, shots, STABILIZER_SAMPLE_CHUNK):
+        coefficients = rng.integers(0, 2, (min(STABILIZER_SAMPLE_CHUNK, shots - start), k)).astype(float)
+        bits = ((coefficients @ basis) % 2).astype(bool) ^ x0
+        rows, row_counts = np.unique(bits, axis=0, return_counts=True)
+        for label, count in zip(format_bit_rows(rows), row_counts.tolist()):
+            counts[label] = counts.get(label, 0) + count
+    return counts
 
+@timed_stage("analysis")
+def stabilizer_marginals(tableau, x0, basis, trailing):
+    """由稳定子表计算 StabilizerMarginals，末尾RZ相位只旋转约化态非对角元"""
+    coherences = tableau.single_qubit_coherences()
+    for qubit, angle in trailing.items():
+        coherences[qubit] *= np.exp(-1j * angle)
+    return StabilizerMarginals(x0, basis, coherences)
+
+@timed_stage("analysis")
 def analyze_quantum_results(results):
-    """分析量子结果，提取量子指标"""
+    """分析量子结果，提取量子指标
+
+    支持计数字典 {"results": {比特串: 计数}}（精确模式下为概率），也支持数组形式
+    {"outcomes": 结果下标数组, "counts": 计数数组, "num_qubits": 量子比特数}。
+    模拟器提供的 "marginals"（QubitMarginals）用于计算纠缠度和相干性，
+    没有时由测量结果计算。
+    """
     try:
         sys.stderr.write("分析量子结果\n")
         
         # 检查结果格式是否正确
-        if not isinstance(results, dict) or "results" not in results:
+        if not isinstance(results, dict) or ("results" not in results and "outcomes" not in results):
             sys.stderr.write("结果格式不正确，使用默认指标\n")
             return get_default_indicators()
         
-        # 计算量子指标
-        counts = results["results"]
-        
-        # 检查counts是否为空
-        if not counts or not isinstance(counts, dict) or len(counts) == 0:
-            sys.stderr.write("结果中没有有效的计数数据，使用默认指标\n")
-            return get_default_indicators()
-        
-        total_shots = sum(counts.values())
-        
-        # 检查total_shots是否为0
-        if total_shots == 0:
-            sys.stderr.write("总样本数为0，使用默认指标\n")
-            return get_default_indicators()
-        
-        # 计算熵
-        try:
-            probabilities = [count/total_shots for count in counts.values()]
-            entropy = -sum(p * math.log(p) if p > 0 else 0 for p in probabilities)
-            normalized_entropy = entropy / math.log(2) if len(probabilities) > 1 else 0  # 归一化到0-1
-        except Exception as e:
-            sys.stderr.write(f"计算熵时出错: {str(e)}，使用默认值\n")
-            normalized_entropy = 0.5
-        
-        # 计算纯度 (理想情况下应该从密度矩阵计算)
-        # 这里使用简化方法：纯态的熵为0，混合态的熵为正
-        purity = 1.0 - normalized_entropy
-        
-        # 计算相干性 (简化计算)
-        # 使用状态分布的均匀性作为相干性的度量
-        try:
-            uniformity = 1.0 - np.std(probabilities) if len(probabilities) > 1 else 0
-            coherence = uniformity
-        except Exception as e:
-            sys.stderr.write(f"计算相干性时出错: {str(e)}，使用默认值\n")
-            coherence = 0.5
-        
-        # 计算纠缠度 (简化计算)
-        # 使用状态分布的复杂性作为纠缠度的度量
-        try:
-            entanglement = min(1.0, len(counts) / (2**4))  # 归一化到0-1
-        except Exception as e:
-            sys.stderr.write(f"计算纠缠度时出错: {str(e)}，使用默认值\n")
-            entanglement = 0.5
-        
-        # 计算不确定性
-        uncertainty = normalized_entropy
-        
-        # 计算能量 (简化计算)
-        # 使用|1⟩状态的比例作为能量的度量，归一化到-1到1
-        try:
-            # 确保状态字符串是有效的二进制字符串
-            valid_counts = {k: v for k, v in counts.items() if all(c in '01' for c in k)}
-            if valid_counts:
-                energy_raw = sum(int(state, 2) * count for state, count in valid_counts.items()) / total_shots
-                # 获取第一个键的长度，确保它是有效的
-                first_key = next(iter(valid_counts.keys()))
-                key_length = len(first_key)
-                energy_normalized = 2 * energy_raw / (2**(key_length - 1)) - 1 if key_length > 0 else 0
-            else:
-                sys.stderr.write("没有有效的二进制状态字符串，使用默认能量值\n")
-                energy_normalized = 0
-        except Exception as e:
-            sys.stderr.write(f"计算能量时出错: {str(e)}，使用默认值\n")
-            energy_normalized = 0
-        
-        # 计算稳定性 (简化计算)
-        # 使用概率分布的集中度作为稳定性的度量
-        try:
-            max_prob = max(probabilities)
-            stability = max_prob
-        except Exception as e:
-            sys.stderr.write(f"计算稳定性时出错: {str(e)}，使用默认值\n")
-            stability = 0.5
-        
-        # 计算相位 (简化计算)
-        # 使用状态分布的模式作为相位的度量
-        try:
-            phase_raw = sum(int(state, 2) * count for state, count in valid_counts.items()) / total_shots if valid_counts else 0
-            phase = (phase_raw % (2*math.pi)) if phase_raw > 0 else 0
-        except Exception as e:
-            sys.stderr.write(f"计算相位时出错: {str(e)}，使用默认值\n")
-            phase = 0
-        
-        # 计算干涉 (简化计算)
-        # 使用状态分布的不均匀性作为干涉的度量，归一化到-1到1
-        try:
-            interference = 2 * np.std(probabilities) - 1 if len(probabilities) > 1 else 0
-        except Exception as e:
-            sys.stderr.write(f"计算干涉时出错: {str(e)}，使用默认值\n")
-            interference = 0
-        
-        # 计算保真度 (简化计算)
-        # 使用最大概率状态作为保真度的度量
-        fidelity = max_prob if 'max_prob' in locals() else 0.5
-        
-        # 计算Bloch球角度 (简化计算)
-        # 使用状态分布的特征作为Bloch球角度的度量
-        try:
-            theta = math.pi * normalized_entropy
-            phi = 2 * math.pi * (phase_raw % 1.0) if 'phase_raw' in locals() and phase_raw > 0 else 0
-        except Exception as e:
-            sys.stderr.write(f"计算Bloch球角度时出错: {str(e)}，使用默认值\n")
-            theta = math.pi / 2
-            phi = 0
+        if "outcomes" in results:
+            # 数组形式：结果下标已经是整数，无需解析比特串
+            outcomes = np.asarray(results["outcomes"], dtype=np.int64)
+            weights = np.asarray(results["counts"], dtype=float)
+            if outcomes.size == 0:
+                sys.stderr.write("结果中没有有效的计数数据，使用默认指标\n")
+                return get_default_indicators()
+            valid = outcomes >= 0
+            key_length = results.get("num_qubits") or int(outcomes.max()).bit_length()
+        else:
+            counts = results["results"]
+            
+            # 检查counts是否为空
+            if not counts or not isinstance(counts, dict) or len(counts) == 0:
+                sys.stderr.write("结果中没有有效的计数数据，使用默认指标\n")
+                return get_default_indicators()
+            
+            outcomes, weights, valid, key_length = parse_outcome_distribution(counts)
         
-        return {
-            "entanglement": entanglement,
-            "coherence": coherence,
-            "uncertainty": uncertainty,
-            "energy": energy_normalized,
-            "stability": stability,
-            "entropy": normalized_entropy,
-            "estimated_phase": phase,
-            "purity": purity,
-            "interference": interference,
-            "fidelity": fidelity,
-            "bloch_angles": {
-                "theta": theta,
-                "phi": phi
-            }
-        }
+        return calculate_distribution_indicators(outcomes, weights, valid, key_length, results.get("marginals"))
     except Exception as e:
         sys.stderr.write(f"分析量子结果时出错: {str(e)}\n")
         # 返回默认指标而不是抛出异常
         return get_default_indicators()
 
+def output_json(data, stream=None):
+    """以单行JSON格式输出结果"""
+    stream = stream or sys.stdout
+    if PROFILE_STARTUP:
+        if isinstance(data, dict):
+            data = dict(data, startup_profile=get_startup_profile())
+        else:
+            sys.stderr.write(f"启动耗时分析: {json.dumps(get_startup_profile(), ensure_ascii=False)}\n")
+    if STREAM_OUTPUT:
+        # 流式模式下完整结果作为一条 result 记录输出
+        data = {"type": "result", "result": data}
+    with timed_stage("serialization"):
+        line = json.dumps(data, ensure_ascii=False)
+    with OUTPUT_LOCK:
+        stream.write(line + "\n")
+        stream.flush()
+
+def write_stream_record(record, stream=None):
+    """以NDJSON格式写出一条流式记录并立即刷新，便于调用方逐行解析"""
+    stream = stream or sys.stdout
+    line = json.dumps(record, ensure_ascii=False)
+    with OUTPUT_LOCK:
+        stream.write(line + "\n")
+        stream.flush()
+
+def make_progress_reporter(stage, stream=None, request_id=None):
+    """创建写出进度记录的回调 progress(已完成, 总数)
+
+    两条进度记录之间至少间隔 STREAM_PROGRESS_INTERVAL 秒，最后一步总会写出。
+    """
+    last_report = [0.0]
+    
+    def report(completed, total):
+        now = time.perf_counter()
+        if completed < total and now - last_report[0] < STREAM_PROGRESS_INTERVAL:
+            return
+        last_report[0] = now
+        record = {"type": "progress", "stage": stage, "completed": completed, "total": total}
+        if request_id is not None:
+            record = dict({"id": request_id}, **record)
+        write_stream_record(record, stream)
+    
+    return report
+
+def parse_outcome_distribution(distribution):
+    """将 {比特串: 权重} 字典解析为结果下标数组、权重数组和有效性掩码
+
+    等长的比特串整体转换为字节矩阵后一次性校验和求值，不再逐个调用 int(state, 2)。
+    """
+    keys = list(distribution.keys())
+    weights = np.fromiter(distribution.values(), dtype=float, count=len(keys))
+    key_length = len(keys[0])
+    
+    try:
+        if not np.all(np.fromiter(map(len, keys), dtype=np.int64, count=len(keys)) == key_length):
+            raise ValueError("比特串长度不一致")
+        bits = np.frombuffer("".join(keys).encode("ascii"), dtype=np.uint8).reshape(len(keys), key_length)
+        bits = bits - ord("0")
+        # 小于'0'的字符会回绕为大于1的值，因此一次比较即可校验全部字符
+        valid = (bits <= 1).all(axis=1)
+        if key_length > 62:
+            # 稳定子后端可以产生超出int64的比特串，下标改用浮点数近似，只用于能量和相位
+            place_values = 2.0 ** np.arange(key_length - 1, -1, -1)
+            outcomes = np.where(valid, bits.astype(float) @ place_values, -1.0)
+        else:
+            place_values = 1 << np.arange(key_length - 1, -1, -1, dtype=np.int64)
+            outcomes = np.where(valid, bits.astype(np.int64) @ place_values, -1)
+    except (ValueError, UnicodeEncodeError):
+        # 长度不一致或含非ASCII字符时逐个解析
+        valid = np.array([bool(key) and all(c in '01' for c in key) for key in keys])
+        outcomes = np.array([int(key, 2) if ok else -1 for key, ok in zip(keys, valid)], dtype=np.int64)
+        valid_keys = [key for key, ok in zip(keys, valid) if ok]
+        key_length = len(valid_keys[0]) if valid_keys else 0
+    
+    return outcomes, weights, valid, key_length
+
+def calculate_distribution_indicators(outcomes, weights, valid, key_length, marginals=None):
+    """由结果下标数组和权重数组一次性计算全部量子指标
+
+    纠缠度和相干性取自单比特约化态（marginals），未提供时由测量结果计算边缘统计。
+    """
+    total = float(weights.sum())
+    if total <= 0:
+        sys.stderr.write("总样本数为0，使用默认指标\n")
+        return get_default_indicators()
+    
+    probabilities = weights / total
+    num_outcomes = len(probabilities)
+    nonzero = probabilities[probabilities > 0]
+    
+    # 熵、纯度、不确定性
+    entropy = -float(np.sum(nonzero * np.log(nonzero)))
+    normalized_entropy = entropy / math.log(2) if num_outcomes > 1 else 0
+    purity = 1.0 - normalized_entropy
+    uncertainty = normalized_entropy
+    
+    # 干涉：概率分布的不均匀性
+    spread = float(np.std(probabilities)) if num_outcomes > 1 else None
+    interference = 2 * spread - 1 if spread is not None else 0
+    
+    # 纠缠度与相干性：由单比特约化态计算；只有测量结果时相干性退回分布的均匀性
+    if marginals is None:
+        marginals = marginals_from_outcomes(outcomes, weights, valid, key_length)
+    entanglement, coherence = reduced_state_indicators(marginals)
+    if coherence is None:
+        coherence = 1.0 - spread if spread is not None else 0
+    
+    # 能量与相位：有效比特串对应整数的加权平均
+    if valid.any():
+        phase_raw = float(np.dot(outcomes[valid], weights[valid])) / total
+        energy_normalized = 2 * phase_raw / (2**(key_length - 1)) - 1 if key_length > 0 else 0
+    else:
+        sys.stderr.write("没有有效的二进制状态字符串，使用默认能量值\n")
+        phase_raw = 0
+        energy_normalized = 0
+    phase = (phase_raw % (2*math.pi)) if phase_raw > 0 else 0
+    
+    # 稳定性与保真度：最大概率
+    max_prob = float(probabilities.max())
+    
+    # Bloch球角度
+    theta = math.pi * normalized_entropy
+    phi = 2 * math.pi * (phase_raw % 1.0) if phase_raw > 0 else 0
+    
+    return {
+        "entanglement": entanglement,
+        "coherence": coherence,
+        "uncertainty": uncertainty,
+        "energy": energy_normalized,
+        "stability": max_prob,
+        "entropy": normalized_entropy,
+        "estimated_phase": phase,
+        "purity": purity,
+        "interference": interference,
+        "fidelity": max_prob,
+        "bloch_angles": {
+            "theta": theta,
+            "phi": phi
+        }
+    }
+
+def reduced_state_indicators(marginals):
+    """由单比特约化态计算 (纠缠度, 相干性)
+
+    有约化态非对角元时（由态向量计算），纠缠度为 Meyer-Wallach 度量
+    2·(1 - 平均纯度)，相干性为平均 l1 相干度 2|ρ01|。只有测量结果时纠缠度为
+    各比特对 Z 测量结果相关系数绝对值的平均，相干性无法得到，返回 None。
+    """
+    if marginals is None or marginals.num_qubits == 0:
+        return 0.0, None
+    purities = marginals.purities()
+    if purities is not None:
+        entanglement = float(np.clip(2.0 * (1.0 - purities.mean()), 0.0, 1.0))
+        coherence = float(np.clip(2.0 * np.abs(marginals.coherences).mean(), 0.0, 1.0))
+        return entanglement, coherence
+    
+    num_qubits = marginals.num_qubits
+    if num_qubits < 2:
+        return 0.0, None
+    variances = 4.0 * marginals.ones * (1.0 - marginals.ones)
+    scale = np.sqrt(np.outer(variances, variances))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlation = np.where(scale > EXACT_PROBABILITY_TOLERANCE, np.abs(marginals.correlations()) / scale, 0.0)
+    pairs = np.triu_indices(num_qubits, 1)
+    return float(np.clip(correlation[pairs].mean(), 0.0, 1.0)), None
+
 def get_default_indicators():
     """获取默认的量子指标"""
     sys.stderr.write("使用默认量子指标\n")
@@ -631,13 +3277,223 @@ def get_default_indicators():
         }
     }
 
-def get_quantum_prediction(time_span="day", api_key=None):
-    """获取量子预测"""
+@timed_stage("fortune")
+def calculate_fortune(indicators, rng=None):
+    """根据量子指标计算运势值 (0-1之间)"""
+    uniform = rng.uniform if rng is not None else random.uniform
+    
+    # 使用量子结果的特性来影响运势值，使其更加"量子化"
+    try:
+        base_fortune = uniform(0, 1)
+        quantum_influence = (indicators["coherence"] * 0.3 + 
+                            indicators["entanglement"] * 0.2 + 
+                            indicators["stability"] * 0.3 + 
+                            indicators["fidelity"] * 0.2)
+        
+        # 混合基础运势和量子影响
+        fortune = 0.3 * base_fortune + 0.7 * quantum_influence
+        
+        # 确保运势值在0-1范围内
+        fortune = max(0, min(1, fortune))
+    except Exception as e:
+        sys.stderr.write(f"计算运势值失败: {str(e)}，使用随机运势\n")
+        fortune = uniform(0.3, 0.7)  # 使用中等范围的随机值
+    
+    return fortune
+
+def build_prediction_result(fortune, indicators, time_span):
+    """构建单条预测结果"""
+    return {
+        "fortune": fortune,
+        "indicators": indicators,
+        "timestamp": datetime.now().isoformat(),
+        "time_span": time_span,
+        "usingRealQuantum": True,
+        "quantumProvider": "国盾量子"
+    }
+
+def build_error_prediction(error, time_span):
+    """构建出错时的预测结果"""
+    return {
+        "error": True,
+        "message": str(error),
+        "timestamp": datetime.now().isoformat(),
+        "fortune": 0.5,  # 提供一个默认的运势值
+        "indicators": get_default_indicators(),  # 提供默认指标
+        "time_span": time_span,
+        "usingRealQuantum": False,
+        "quantumProvider": "国盾量子模拟器"
+    }
+
+def time_span_expiry(time_span, now=None):
+    """返回时间范围结束时刻的时间戳：当天、本周、本月或本年结束时"""
+    now = now or datetime.now()
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if time_span == "week":
+        boundary = day_start + timedelta(days=7 - day_start.weekday())
+    elif time_span == "month":
+        boundary = (day_start.replace(day=1) + timedelta(days=32)).replace(day=1)
+    elif time_span == "year":
+        boundary = day_start.replace(year=day_start.year + 1, month=1, day=1)
+    else:
+        boundary = day_start + timedelta(days=1)
+    return boundary.timestamp()
+
+class PredictionCache:
+    """预测结果缓存，条目在所属时间范围结束时过期
+
+    path 为空时缓存保存在内存中（常驻服务模式）；否则保存在SQLite文件中，
+    单次命令之间共享缓存条目和命中计数。
+    """
+    
+    def __init__(self, path=None, max_size=PREDICTION_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._connection = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(time_span, seed=None, user=None, circuit_key=None):
+        """由时间范围、种子/用户和电路结构哈希生成缓存键"""
+        source = json.dumps([time_span, seed, user, circuit_key], ensure_ascii=False, default=str)
+        return hashlib.sha1(source.encode("utf-8")).hexdigest()
+    
+    def _connect(self):
+        if self._connection is None:
+            import sqlite3
+            # 连接由锁串行化，允许常驻服务的工作线程共用
+            self._connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+                )
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)"
+                )
+        return self._connection
+    
+    def _count(self, name):
+        if self.path is None:
+            setattr(self, name, getattr(self, name) + 1)
+            return
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO counters VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,)
+            )
+    
+    def get(self, key, now=None):
+        """查找未过期的缓存条目，过期条目视为未命中并删除"""
+        now = now or time.time()
+        with self._lock:
+            value = None
+            if self.path is None:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    value = entry[1]
+                elif entry is not None:
+                    del self._entries[key]
+            else:
+                row = self._connect().execute(
+                    "SELECT value FROM predictions WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+        
+            self._count("hits" if value is not None else "misses")
+            return value
+    
+    def put(self, key, value, expires_at, now=None):
+        """写入缓存条目，同时清理已过期的条目"""
+        now = now or time.time()
+        with self._lock:
+            if self.path is None:
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+                for expired in [k for k, (expiry, _) in self._entries.items() if expiry <= now]:
+                    del self._entries[expired]
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                return
+            with self._connect() as connection:
+                connection.execute("DELETE FROM predictions WHERE expires_at <= ?", (now,))
+                connection.execute(
+                    "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at)
+                )
+    
+    def clear(self):
+        """清空缓存和计数器"""
+        with self._lock:
+            if self.path is None:
+                self._entries.clear()
+                self.hits = self.misses = 0
+                return
+            with self._connect() as connection:
+                connection.execute("DELETE FROM predictions")
+                connection.execute("DELETE FROM counters")
+    
+    def stats(self, now=None):
+        """返回缓存大小和命中计数"""
+        now = now or time.time()
+        with self._lock:
+            if self.path is None:
+                size = sum(1 for expiry, _ in self._entries.values() if expiry > now)
+                hits, misses = self.hits, self.misses
+                size_bytes = None
+            else:
+                connection = self._connect()
+                size = connection.execute("SELECT COUNT(*) FROM predictions WHERE expires_at > ?", (now,)).fetchone()[0]
+                counters = dict(connection.execute("SELECT name, value FROM counters").fetchall())
+                hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+                size_bytes = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            lookups = hits + misses
+            return {
+                "backend": "memory" if self.path is None else "sqlite",
+                "path": self.path,
+                "size": size,
+                "size_bytes": size_bytes,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / lookups if lookups else 0.0
+            }
+
+# 预测结果缓存，None 表示未开启
+PREDICTION_CACHE = None
+
+def configure_prediction_cache(daemon=False):
+    """开启预测结果缓存：常驻服务模式使用内存缓存，单次命令使用磁盘缓存"""
+    global PREDICTION_CACHE
+    PREDICTION_CACHE = PredictionCache(None if daemon else PREDICTION_CACHE_PATH)
+    return PREDICTION_CACHE
+
+def get_quantum_prediction(time_span="day", api_key=None, emit=True, progress=None, seed=None, user=None,
+                           include_timings=None):
+    """获取量子预测，progress 为模拟进度回调
+
+    电路的随机相位、采样和运势计算共用同一个由 get_request_rng 创建的随机数
+    生成器，指定 seed 或 user 时相同的请求得到相同的预测。开启预测缓存时，相同
+    时间范围、种子/用户和电路结构的预测在时间范围结束前直接返回缓存结果。
+    include_timings 为真时（默认跟随 --profile）结果附带 metadata 字段，报告本次
+    预测各阶段的耗时和是否命中缓存；否则结果与批量预测的条目格式相同。
+    """
+    if include_timings is None:
+        include_timings = PROFILE_TIMINGS
+    with collect_stage_timings() as timings:
+        return _get_quantum_prediction(time_span, api_key, emit, progress, seed, user, timings if include_timings else None)
+
+def _get_quantum_prediction(time_span, api_key, emit, progress, seed, user, timings):
+    """get_quantum_prediction 的实现，timings 为本次请求收集的阶段计时，为 None 时不附带 metadata"""
     try:
+        rng = get_request_rng(time_span, seed, user)
+        
         # 创建量子电路
         try:
             num_qubits = 5
-            circuit = create_quantum_circuit(num_qubits)
+            circuit = create_quantum_circuit(num_qubits, rng)
         except Exception as e:
             sys.stderr.write(f"创建量子电路失败: {str(e)}，使用备用电路\n")
             circuit = {
@@ -655,12 +3511,31 @@ def get_quantum_prediction(time_span="day", api_key=None):
                 ]
             }
         
+        # 查找预测缓存
+        cache_key = None
+        if PREDICTION_CACHE is not None:
+            try:
+                cache_key = PredictionCache.make_key(time_span, seed, user, circuit_structure_key(circuit))
+                cached = PREDICTION_CACHE.get(cache_key)
+                if cached is not None:
+                    sys.stderr.write(f"命中预测缓存: {time_span}\n")
+                    if timings is not None:
+                        cached = dict(cached, metadata={"timings": snapshot_stage_timings(timings), "cached": True})
+                    if emit:
+                        output_json(cached)
+                    return cached
+            except Exception as e:
+                sys.stderr.write(f"读取预测缓存时出错: {str(e)}\n")
+                cache_key = None
+        
         # 运行量子计算
         try:
             sys.stderr.write(f"使用国盾量子计算机进行计算\n")
-            results = run_quantum_computation(circuit, api_key)
+            results = run_quantum_computation(circuit, api_key, rng=rng, exact=True, progress=progress)
         except Exception as e:
             sys.stderr.write(f"运行量子计算失败: {str(e)}，使用模拟结果\n")
+            # 备用结果不写入缓存
+            cache_key = None
             # 创建模拟结果
             results = {
                 "job_id": f"simulated_job_{int(time.time())}",
@@ -683,53 +3558,190 @@ def get_quantum_prediction(time_span="day", api_key=None):
             indicators = get_default_indicators()
         
         # 计算运势值 (0-1之间)
-        # 使用量子结果的特性来影响运势值，使其更加"量子化"
-        try:
-            base_fortune = random.uniform(0, 1)
-            quantum_influence = (indicators["coherence"] * 0.3 + 
-                                indicators["entanglement"] * 0.2 + 
-                                indicators["stability"] * 0.3 + 
-                                indicators["fidelity"] * 0.2)
-            
-            # 混合基础运势和量子影响
-            fortune = 0.3 * base_fortune + 0.7 * quantum_influence
-            
-            # 确保运势值在0-1范围内
-            fortune = max(0, min(1, fortune))
-        except Exception as e:
-            sys.stderr.write(f"计算运势值失败: {str(e)}，使用随机运势\n")
-            fortune = random.uniform(0.3, 0.7)  # 使用中等范围的随机值
+        fortune = calculate_fortune(indicators, rng)
         
         # 构建结果
-        prediction = {
-            "fortune": fortune,
-            "indicators": indicators,
-            "timestamp": datetime.now().isoformat(),
-            "time_span": time_span,
-            "usingRealQuantum": True,
-            "quantumProvider": "国盾量子"
-        }
+        prediction = build_prediction_result(fortune, indicators, time_span)
+        
+        if cache_key is not None:
+            try:
+                PREDICTION_CACHE.put(cache_key, prediction, time_span_expiry(time_span))
+            except Exception as e:
+                sys.stderr.write(f"写入预测缓存时出错: {str(e)}\n")
+        
+        # 附加阶段计时（缓存中的条目不包含计时）
+        if timings is not None:
+            prediction = dict(prediction, metadata={"timings": snapshot_stage_timings(timings), "cached": False})
         
         # 返回JSON格式的结果
-        print(json.dumps(prediction, ensure_ascii=False))
+        if emit:
+            output_json(prediction)
         return prediction
     except Exception as e:
         sys.stderr.write(f"获取量子预测时出错: {str(e)}\n")
         # 返回错误信息
-        error_prediction = {
-            "error": True,
-            "message": str(e),
-            "timestamp": datetime.now().isoformat(),
-            "fortune": 0.5,  # 提供一个默认的运势值
-            "indicators": get_default_indicators(),  # 提供默认指标
-            "time_span": time_span,
-            "usingRealQuantum": False,
-            "quantumProvider": "国盾量子模拟器"
-        }
-        print(json.dumps(error_prediction, ensure_ascii=False))
+        error_prediction = build_error_prediction(e, time_span)
+        if emit:
+            output_json(error_prediction)
         return error_prediction
 
-def get_available_devices():
+def get_request_rng(time_span="day", seed=None, user=None, fallback=None):
+    """为单个预测请求创建随机数生成器
+
+    指定 seed 时直接使用；只指定 user 时由时间范围和用户派生种子；两者都没有时
+    使用 fallback（SeedSequence，批量预测中由同一个根序列派生的独立子序列），
+    fallback 也为空时使用系统熵。
+    """
+    if seed is not None:
+        if isinstance(seed, int):
+            return np.random.default_rng(seed)
+        seed_source = str(seed)
+    elif user is not None:
+        seed_source = f"{time_span}:{user}"
+    else:
+        return np.random.default_rng(fallback)
+    
+    digest = hashlib.sha256(seed_source.encode("utf-8")).digest()
+    return np.random.default_rng(int.from_bytes(digest[:8], "little"))
+
+def get_quantum_predictions_batch(requests, api_key=None, emit=True, shots=1024, workers=None):
+    """批量获取量子预测
+
+    requests 中的每一项可以是时间范围字符串，也可以是包含 time_span、seed、
+    user 的字典。所有请求共享同一个电路结构，态向量堆叠后一起模拟。
+    """
+    predictions = [prediction for _, prediction in iter_quantum_predictions_batch(requests, api_key, shots, workers)]
+    if emit:
+        output_json(predictions)
+    return predictions
+
+def iter_quantum_predictions_batch(requests, api_key=None, shots=1024, workers=None, chunk_size=None):
+    """逐条产生批量预测结果 (下标, 预测)
+
+    requests 可以是任意可迭代对象。chunk_size 为空时一次模拟全部请求；指定时
+    每次只读取并模拟 chunk_size 条，内存占用与批次总数无关。
+    """
+    if api_key:
+        sys.stderr.write(f"使用API密钥: {api_key[:5]}...\n")
+    
+    requests = iter(requests)
+    circuit = None
+    index = 0
+    while True:
+        chunk = list(itertools.islice(requests, chunk_size)) if chunk_size else list(requests)
+        if not chunk:
+            break
+        
+        items = [request if isinstance(request, dict) else {"time_span": request} for request in chunk]
+        try:
+            sys.stderr.write(f"批量计算 {len(items)} 条量子预测\n")
+            
+            # 电路结构只构建一次
+            if circuit is None:
+                circuit = create_quantum_circuit(5)
+            predictions = predict_batch_items(circuit, items, shots, workers)
+        except Exception as e:
+            sys.stderr.write(f"批量获取量子预测时出错: {str(e)}\n")
+            predictions = [build_error_prediction(e, item.get("time_span", "day")) for item in items]
+        
+        for prediction in predictions:
+            yield index, prediction
+            index += 1
+        
+        if not chunk_size:
+            break
+
+def request_rng_key(item):
+    """返回决定请求随机数序列的键，未指定 seed 和 user 的请求返回 None（每次结果不同）"""
+    if item.get("seed") is None and item.get("user") is None:
+        return None
+    return json.dumps([item.get("time_span", "day"), item.get("seed"), item.get("user")], ensure_ascii=False, default=str)
+
+def predict_batch_items(circuit, items, shots=1024, workers=None):
+    """为一组共享电路结构的批量请求计算预测
+
+    每个请求使用自己的随机数生成器（见 get_request_rng），未指定 seed 和 user
+    的请求从同一个根 SeedSequence 派生互相独立的子序列。随机数序列相同的请求
+    结果必然相同，只计算一次。
+    """
+    num_rz = get_compiled_circuit(circuit)["num_params"]
+    
+    # 去掉随机数序列相同的重复请求
+    unique = []
+    positions = {}
+    mapping = []
+    for item in items:
+        key = request_rng_key(item)
+        if key is None or key not in positions:
+            if key is not None:
+                positions[key] = len(unique)
+            mapping.append(len(unique))
+            unique.append(item)
+        else:
+            mapping.append(positions[key])
+    if len(unique) < len(items):
+        sys.stderr.write(f"合并 {len(items) - len(unique)} 条重复的批量请求\n")
+    
+    # 每个请求使用自己的RZ角度
+    streams = iter(np.random.SeedSequence().spawn(sum(request_rng_key(item) is None for item in unique)))
+    rngs = [
+        get_request_rng(
+            item.get("time_span", "day"), item.get("seed"), item.get("user"),
+            next(streams) if request_rng_key(item) is None else None
+        )
+        for item in unique
+    ]
+    parameter_sets = np.array([rng.uniform(0, 2*math.pi, num_rz) for rng in rngs]).reshape(len(unique), num_rz)
+    distributions, marginals = simulate_quantum_circuit_batch(
+        circuit, shots, parameter_sets, rngs, exact=True, workers=workers, marginals=True
+    )
+    
+    predictions = []
+    for item, rng, distribution, statistics in zip(unique, rngs, distributions, marginals):
+        indicators = analyze_quantum_results({"results": distribution, "exact": True, "marginals": statistics})
+        fortune = calculate_fortune(indicators, rng)
+        predictions.append(build_prediction_result(fortune, indicators, item.get("time_span", "day")))
+    return [dict(predictions[index]) for index in mapping]
+
+def stream_quantum_predictions_batch(requests, api_key=None, shots=1024, workers=None, stream=None, request_id=None):
+    """以NDJSON流的形式逐条写出批量预测结果，返回写出的条数
+
+    每条预测一完成就写出为 item 记录，最后写出 done 记录。
+    """
+    count = 0
+    for index, prediction in iter_quantum_predictions_batch(requests, api_key, shots, workers, STREAM_BATCH_CHUNK):
+        record = {"type": "item", "index": index, "result": prediction}
+        if request_id is not None:
+            record = dict({"id": request_id}, **record)
+        write_stream_record(record, stream)
+        count += 1
+    if request_id is None:
+        write_stream_record({"type": "done", "count": count}, stream)
+    return count
+
+def iter_stream_requests(input_stream):
+    """从输入流读取批量请求
+
+    内容以 '[' 开头时按JSON数组整体解析；否则按NDJSON逐行惰性读取，
+    每行一条请求，适合流式输出时处理任意大小的批次。
+    """
+    first = ""
+    while not first:
+        char = input_stream.read(1)
+        if not char:
+            return
+        first = char.strip()
+    
+    if first == "[":
+        yield from json.loads(first + input_stream.read())
+        return
+    
+    for line in itertools.chain([first + input_stream.readline()], input_stream):
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def get_available_devices(emit=True):
     """获取可用的量子设备"""
     try:
         # 获取国盾量子SDK的可用设备
@@ -739,8 +3751,8 @@ def get_available_devices():
         # 注意：实际使用时需要替换为真实的SDK调用
         try:
             # 尝试使用国盾量子SDK
-            if HAS_QGD_SDK:
-                # devices = qgd.get_devices()
+            if has_qgd_sdk():
+                # devices = load_qgd_sdk().get_devices()
                 sys.stderr.write("使用国盾量子SDK获取设备\n")
             else:
                 sys.stderr.write("使用模拟模式获取设备\n")
@@ -752,12 +3764,13 @@ def get_available_devices():
                     "name": "国盾量子计算机",
                     "type": "quantum",
                     "available": True,
-                    "max_qubits": 10
+                    "max_qubits": MAX_SIMULATOR_QUBITS
                 }
             ]
             
             # 返回JSON格式的结果
-            print(json.dumps({"devices": devices}, ensure_ascii=False))
+            if emit:
+                output_json({"devices": devices})
             return devices
         except Exception as inner_e:
             sys.stderr.write(f"使用国盾量子SDK获取设备时出错: {str(inner_e)}\n")
@@ -771,75 +3784,547 @@ def get_available_devices():
                 "name": "国盾量子计算机",
                 "type": "quantum",
                 "available": True,
-                "max_qubits": 10
+                "max_qubits": MAX_SIMULATOR_QUBITS
             }
         ]
-        print(json.dumps({"devices": default_devices}, ensure_ascii=False))
+        if emit:
+            output_json({"devices": default_devices})
         return default_devices
 
-def get_quantum_circuit():
-    """获取量子电路数据"""
+def get_quantum_circuit(emit=True):
+    """获取当前会话最近创建的量子电路数据"""
     try:
-        global LAST_CIRCUIT
         sys.stderr.write("获取量子电路数据\n")
         
-        # 检查是否有缓存的电路
-        if LAST_CIRCUIT:
-            # 验证缓存的电路是否符合前端格式
-            if validate_circuit_data(LAST_CIRCUIT):
-                sys.stderr.write("使用缓存的电路数据（前端格式）\n")
-                print(json.dumps(LAST_CIRCUIT, ensure_ascii=False))
-                return LAST_CIRCUIT
-            else:
-                sys.stderr.write("缓存的电路数据不符合前端格式，尝试转换\n")
-                # 尝试转换为前端格式
-                frontend_circuit = convert_internal_circuit_to_frontend_format(LAST_CIRCUIT)
-                LAST_CIRCUIT = frontend_circuit
-                print(json.dumps(frontend_circuit, ensure_ascii=False))
-                return frontend_circuit
-        
-        # 如果没有缓存的电路，创建一个新的
-        try:
+        # 检查当前会话是否有缓存的电路
+        circuit = CIRCUIT_STORE.get()
+        if circuit is not None:
+            sys.stderr.write("使用缓存的电路数据\n")
+            frontend_circuit = circuit.to_frontend()
+        else:
+            # 如果没有缓存的电路，创建一个新的
             sys.stderr.write("创建新的电路数据\n")
-            frontend_circuit = create_quantum_circuit(5)
-            print(json.dumps(frontend_circuit, ensure_ascii=False))
-            return frontend_circuit
-        except Exception as e:
-            sys.stderr.write(f"创建新电路时出错: {str(e)}，使用备用电路\n")
-            # 创建一个简单的备用电路
-            backup_circuit = create_default_frontend_circuit(3)
-            LAST_CIRCUIT = backup_circuit
-            print(json.dumps(backup_circuit, ensure_ascii=False))
-            return backup_circuit
+            frontend_circuit = create_quantum_circuit(5).to_frontend()
+        if emit:
+            output_json(frontend_circuit)
+        return frontend_circuit
     except Exception as e:
         sys.stderr.write(f"获取量子电路时出错: {str(e)}\n")
         # 返回错误信息和一个简单的备用电路
         backup_circuit = create_default_frontend_circuit(2)
-        print(json.dumps(backup_circuit, ensure_ascii=False))
+        if emit:
+            output_json(backup_circuit)
         return backup_circuit
 
+def get_bridge_stats(emit=True):
+    """获取桥接运行统计（缓存命中率等）"""
+    stats = {
+        "stages": get_stage_totals(),
+        "requests": get_request_totals(),
+        "circuit_cache": COMPILED_CIRCUIT_CACHE.stats(),
+        "prediction_cache": PREDICTION_CACHE.stats() if PREDICTION_CACHE is not None else None,
+        "circuit_store": CIRCUIT_STORE.stats(),
+        "server": ACTIVE_SERVER.stats() if ACTIVE_SERVER is not None else None
+    }
+    if emit:
+        output_json(stats)
+    return stats
+
+# 常驻服务模式下按命令累计的请求数、失败数和耗时
+REQUEST_TOTALS = {}
+# 按命令保存的最近请求耗时和排队时间，用于计算分位数
+REQUEST_LATENCIES = {}
+REQUEST_TOTALS_LOCK = threading.Lock()
+
+def _request_total(command):
+    total = REQUEST_TOTALS.setdefault(command, {
+        "count": 0, "errors": 0, "rejected": 0, "deadline_exceeded": 0,
+        "wall_seconds": 0.0, "max_wall_seconds": 0.0
+    })
+    if command not in REQUEST_LATENCIES:
+        REQUEST_LATENCIES[command] = (deque(maxlen=LATENCY_WINDOW), deque(maxlen=LATENCY_WINDOW))
+    return total
+
+def record_request(command, seconds, ok, queued_seconds=0.0, deadline_exceeded=False):
+    """累计一条请求的耗时、排队时间和结果"""
+    command = str(command)
+    with REQUEST_TOTALS_LOCK:
+        total = _request_total(command)
+        total["count"] += 1
+        total["errors"] += 0 if ok else 1
+        total["deadline_exceeded"] += 1 if deadline_exceeded else 0
+        total["wall_seconds"] += seconds
+        total["max_wall_seconds"] = max(total["max_wall_seconds"], seconds)
+        latencies, queue_waits = REQUEST_LATENCIES[command]
+        latencies.append(seconds)
+        queue_waits.append(queued_seconds)
+
+def record_rejection(command):
+    """累计一条因服务繁忙被拒绝的请求"""
+    with REQUEST_TOTALS_LOCK:
+        _request_total(str(command))["rejected"] += 1
+
+def latency_percentiles(values, percentiles=(50, 90, 99)):
+    """按最近秩法计算分位数，返回 {"p50": ..., ...}，没有数据时为空字典"""
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+    return {
+        f"p{p}": ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+        for p in percentiles
+    }
+
+def get_request_totals():
+    """返回按命令累计的请求计数副本，附带最近 LATENCY_WINDOW 条请求的延迟和排队时间分位数"""
+    with REQUEST_TOTALS_LOCK:
+        totals = {command: dict(total) for command, total in REQUEST_TOTALS.items()}
+        windows = {command: (list(latencies), list(queue_waits))
+                   for command, (latencies, queue_waits) in REQUEST_LATENCIES.items()}
+    for command, (latencies, queue_waits) in windows.items():
+        totals[command]["latency_seconds"] = latency_percentiles(latencies)
+        totals[command]["queue_seconds"] = latency_percentiles(queue_waits)
+    return totals
+
+def request_deadline_passed():
+    """当前请求是否已超过截止时间"""
+    deadline = getattr(_REQUEST_STATE, "deadline", None)
+    return deadline is not None and time.monotonic() > deadline
+
+def deadline_exceeded_response(request_id):
+    """请求超过截止时间时返回的响应"""
+    return {"id": request_id, "ok": False, "error": "请求超过截止时间", "deadline_exceeded": True}
+
+def handle_bridge_request(request, output_stream=None, queued_seconds=0.0):
+    """处理一条桥接请求，返回带请求ID的响应
+
+    params 中 profile 或 trace_memory 为真时，对本次请求开启 cProfile 或
+    tracemalloc，响应的 profile 字段给出结果文件路径。在 request_context
+    中设置了截止时间时，超时完成的请求同样返回超时响应。
+    """
+    start = time.perf_counter()
+    params = request.get("params") if isinstance(request, dict) else None
+    params = params if isinstance(params, dict) else {}
+    profiling = None
+    if params.get("profile") or params.get("trace_memory"):
+        profiling = start_command_profiling(bool(params.get("profile")), bool(params.get("trace_memory")))
+    try:
+        response = _handle_bridge_request(request, output_stream)
+    finally:
+        if profiling is not None:
+            command = request.get("command") if isinstance(request, dict) else None
+            paths = finish_command_profiling(profiling, f"serve-{command}")
+    if response["ok"] and request_deadline_passed():
+        response = deadline_exceeded_response(response["id"])
+    if profiling is not None:
+        response["profile"] = paths
+    record_request(
+        request.get("command") if isinstance(request, dict) else None, time.perf_counter() - start,
+        response["ok"], queued_seconds, bool(response.get("deadline_exceeded"))
+    )
+    return response
+
+def _handle_bridge_request(request, output_stream=None):
+    """处理一条桥接请求，返回带请求ID的响应
+
+    params 中 stream 为真且提供了 output_stream 时，predict 会先写出带相同ID的
+    进度记录，predict-batch 会逐条写出 item 记录，最终响应只包含条数。
+    """
+    request_id = request.get("id") if isinstance(request, dict) else None
+    try:
+        if not isinstance(request, dict):
+            raise ValueError("请求必须是JSON对象")
+        
+        command = request.get("command")
+        params = request.get("params") or {}
+        streaming = bool(params.get("stream")) and output_stream is not None
+        
+        if command == "predict":
+            progress = make_progress_reporter("simulate", output_stream, request_id) if streaming else None
+            result = get_quantum_prediction(
+                params.get("time_span", "day"), params.get("api_key"), emit=False, progress=progress,
+                seed=params.get("seed"), user=params.get("user"), include_timings=bool(params.get("profile"))
+            )
+        elif command == "predict-batch" and streaming:
+            count = stream_quantum_predictions_batch(
+                params.get("requests", []), params.get("api_key"), workers=params.get("workers"),
+                stream=output_stream, request_id=request_id
+            )
+            result = {"count": count}
+        elif command == "predict-batch":
+            result = get_quantum_predictions_batch(
+                params.get("requests", []), params.get("api_key"), emit=False, workers=params.get("workers")
+            )
+        elif command == "devices":
+            result = {"devices": get_available_devices(emit=False)}
+        elif command == "circuit":
+            result = get_quantum_circuit(emit=False)
+        elif command == "stats":
+            result = get_bridge_stats(emit=False)
+        elif command == "throughput":
+            result = measure_parallel_throughput(
+                params.get("num_qubits", 12), params.get("batch_size", 64),
+                params.get("wide_qubits", PARALLEL_MIN_QUBITS), params.get("workers")
+            )
+        elif command == "validate":
+            result = validate_circuit_report(params.get("circuit"))
+        elif command == "sweep":
+            circuit = params.get("circuit")
+            result = sweep_quantum_circuit(
+                circuit if circuit else create_quantum_circuit(params.get("num_qubits", 5)),
+                params.get("parameter_sets", 100), params.get("shots", 1024), params.get("seed"),
+                bool(params.get("exact")), params.get("precision")
+            )
+        elif command == "marginals":
+            circuit = params.get("circuit")
+            result = get_circuit_marginals(
+                circuit if circuit else create_quantum_circuit(params.get("num_qubits", 5)),
+                params.get("subsets"), params.get("precision")
+            )
+        elif command == "submit":
+            circuit = params.get("circuit")
+            circuit = pack_circuit(circuit) if circuit else create_quantum_circuit(params.get("num_qubits", 5))
+            job_id = JOB_MANAGER.submit(circuit, params.get("shots", 1024), params.get("api_key"))
+            result = JOB_MANAGER.status(job_id)
+        elif command == "status":
+            result = JOB_MANAGER.status(params["job_id"], params.get("api_key"))
+        elif command == "result":
+            result = JOB_MANAGER.result(
+                params["job_id"], params.get("api_key"), params.get("timeout", JOB_TIMEOUT), params.get("wait", True)
+            )
+        elif command == "ping":
+            result = {"pong": True, "timestamp": datetime.now().isoformat()}
+        else:
+            raise ValueError(f"未知命令: {command}")
+        
+        return {"id": request_id, "ok": True, "result": result}
+    except Exception as e:
+        sys.stderr.write(f"处理请求 {request_id} 时出错: {str(e)}\n")
+        if isinstance(e, DeadlineExceeded):
+            return deadline_exceeded_response(request_id)
+        response = {"id": request_id, "ok": False, "error": str(e)}
+        if isinstance(e, CircuitValidationError):
+            response["errors"] = e.errors
+        return response
+
+# 直接在读取线程中处理的轻量命令，不占用工作线程，服务繁忙时也能响应
+SERVE_INLINE_COMMANDS = ("ping", "stats")
+
+class BridgeServer:
+    """常驻服务的请求调度：有界工作线程池、准入控制和请求截止时间
+
+    请求在工作线程中并发处理，响应按完成顺序写出，调用方按 id 匹配。排队和
+    执行中的请求数达到 queue_depth 时直接拒绝，响应中的 retry_after 为建议的
+    重试间隔（秒）。params 中的 deadline_ms 为请求的截止时间（从收到请求起计算），
+    超时的请求立即返回超时响应，工作线程在进入下一个计时阶段时放弃计算。
+    请求的 session 字段选择电路存储中的会话。
+    """
+    
+    def __init__(self, output_stream, workers=None, queue_depth=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self.output_stream = output_stream
+        self.workers = max(1, int(workers or SERVE_WORKERS))
+        self.queue_depth = max(1, int(queue_depth or SERVE_QUEUE_DEPTH))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="quantum-bridge-serve")
+        self._idle = threading.Condition()
+        self._recent = deque(maxlen=LATENCY_WINDOW)
+        self.pending = 0
+        self.accepted = 0
+        self.rejected = 0
+    
+    def submit(self, request):
+        """准入并调度一条请求，被拒绝和直接处理的请求在返回前写出响应"""
+        params = request.get("params") if isinstance(request, dict) else None
+        params = params if isinstance(params, dict) else {}
+        command = request.get("command") if isinstance(request, dict) else None
+        if command in SERVE_INLINE_COMMANDS:
+            output_json(handle_bridge_request(request, self.output_stream), self.output_stream)
+            return
+        if params.get("profile") or params.get("trace_memory"):
+            # 性能分析和内存跟踪是进程级的，等其他请求完成后单独执行，避免结果混入其他请求
+            self.drain()
+            with request_context(request.get("session")):
+                output_json(handle_bridge_request(request, self.output_stream), self.output_stream)
+            return
+        
+        with self._idle:
+            admitted = self.pending < self.queue_depth
+            if admitted:
+                self.pending += 1
+                self.accepted += 1
+            else:
+                self.rejected += 1
+        if not admitted:
+            record_rejection(command)
+            output_json({
+                "id": request.get("id"), "ok": False, "error": "服务繁忙，请稍后重试",
+                "retry_after": self.retry_after()
+            }, self.output_stream)
+            return
+        
+        received = time.monotonic()
+        deadline = None
+        if params.get("deadline_ms") is not None:
+            deadline = received + float(params["deadline_ms"]) / 1000
+        self._executor.submit(self._run, request, received, deadline)
+    
+    def _run(self, request, received, deadline):
+        """工作线程：处理一条请求，截止时间先到时由计时器写出超时响应"""
+        responded = threading.Event()
+        responded_lock = threading.Lock()
+        
+        def respond(response):
+            with responded_lock:
+                if responded.is_set():
+                    return
+                responded.set()
+            output_json(response, self.output_stream)
+        
+        timer = None
+        start = time.monotonic()
+        try:
+            if deadline is not None and start >= deadline:
+                record_request(request.get("command"), 0.0, False, start - received, deadline_exceeded=True)
+                respond(deadline_exceeded_response(request.get("id")))
+                return
+            if deadline is not None:
+                timer = threading.Timer(deadline - start, respond, (deadline_exceeded_response(request.get("id")),))
+                timer.daemon = True
+                timer.start()
+            with request_context(request.get("session"), deadline):
+                response = handle_bridge_request(request, self.output_stream, start - received)
+            respond(response)
+        except Exception as e:
+            sys.stderr.write(f"处理请求 {request.get('id')} 时出错: {str(e)}\n")
+            respond({"id": request.get("id"), "ok": False, "error": str(e)})
+        finally:
+            if timer is not None:
+                timer.cancel()
+            with self._idle:
+                self._recent.append(time.monotonic() - start)
+                self.pending -= 1
+                self._idle.notify_all()
+    
+    def retry_after(self):
+        """按最近请求的耗时中位数和积压请求数估算重试间隔（秒）"""
+        with self._idle:
+            median = latency_percentiles(self._recent, (50,)).get("p50", 0.0)
+            return max(SERVE_RETRY_AFTER, median * self.pending / self.workers)
+    
+    def drain(self):
+        """等待所有已接受的请求处理完成"""
+        with self._idle:
+            while self.pending:
+                self._idle.wait()
+    
+    def shutdown(self):
+        """处理完已接受的请求后关闭工作线程池"""
+        self.drain()
+        self._executor.shutdown(wait=True)
+    
+    def stats(self):
+        """返回工作线程数、积压请求数和准入计数"""
+        with self._idle:
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queue_depth,
+                "pending": self.pending,
+                "accepted": self.accepted,
+                "rejected": self.rejected
+            }
+
+# 正在运行的常驻服务，get_bridge_stats 从中读取调度统计
+ACTIVE_SERVER = None
+
+def serve_bridge(input_stream=None, output_stream=None, workers=None, queue_depth=None):
+    """常驻服务模式：逐行读取JSON请求，在工作线程池中并发处理并写回带ID的JSON响应
+
+    响应按完成顺序写出，可能与请求顺序不同。shutdown 请求会等待已接受的请求处理完成后再确认。
+    """
+    global ACTIVE_SERVER
+    input_stream = input_stream or sys.stdin
+    output_stream = output_stream or sys.stdout
+    server = BridgeServer(output_stream, workers, queue_depth)
+    ACTIVE_SERVER = server
+    sys.stderr.write(f"量子桥接服务已启动（{server.workers} 个工作线程），等待请求\n")
+    
+    # 标准输出仅用于响应，日志继续写入标准错误
+    shutdown_request = None
+    try:
+        for line in input_stream:
+            line = line.strip()
+            if not line:
+                continue
+            
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                output_json({"id": None, "ok": False, "error": f"无效的JSON请求: {str(e)}"}, output_stream)
+                continue
+            
+            if isinstance(request, dict) and request.get("command") == "shutdown":
+                shutdown_request = request
+                break
+            
+            if not isinstance(request, dict):
+                output_json(handle_bridge_request(request, output_stream), output_stream)
+                continue
+            server.submit(request)
+    finally:
+        server.shutdown()
+        ACTIVE_SERVER = None
+    
+    if shutdown_request is not None:
+        output_json({"id": shutdown_request.get("id"), "ok": True, "result": {"shutdown": True}}, output_stream)
+    sys.stderr.write("量子桥接服务已停止\n")
+
 def main():
     """主函数"""
+    global PROFILE_STARTUP, PROFILE_TIMINGS, STREAM_OUTPUT
+    configure_stdio()
+    
+    # 启动耗时分析和流式输出参数可以出现在任意位置，移除后不影响其余位置参数
+    if "--profile-startup" in sys.argv:
+        sys.argv.remove("--profile-startup")
+        PROFILE_STARTUP = True
+    if "--stream" in sys.argv:
+        sys.argv.remove("--stream")
+        STREAM_OUTPUT = True
+    profile = "--profile" in sys.argv
+    if profile:
+        sys.argv.remove("--profile")
+        PROFILE_TIMINGS = True
+    trace_memory = "--trace-memory" in sys.argv
+    if trace_memory:
+        sys.argv.remove("--trace-memory")
+    cache_enabled = PREDICTION_CACHE_ENABLED
+    if "--cache" in sys.argv:
+        sys.argv.remove("--cache")
+        cache_enabled = True
+    
     if len(sys.argv) < 2:
         sys.stderr.write("用法: python quantum-bridge.py <command> [args...]\n")
         sys.exit(1)
     
     command = sys.argv[1]
+    if cache_enabled:
+        configure_prediction_cache(daemon=command == "serve")
     
+    profiling = start_command_profiling(profile, trace_memory) if profile or trace_memory else None
+    try:
+        run_command(command)
+    finally:
+        if profiling is not None:
+            finish_command_profiling(profiling, command)
+
+def run_command(command):
+    """执行一条命令行命令"""
     if command == "predict":
         # 获取预测
         time_span = sys.argv[2] if len(sys.argv) > 2 else "day"
         api_key = sys.argv[4] if len(sys.argv) > 4 else None
-        get_quantum_prediction(time_span, api_key)
+        progress = make_progress_reporter("simulate") if STREAM_OUTPUT else None
+        get_quantum_prediction(time_span, api_key, progress=progress)
+    elif command == "predict-batch":
+        # 批量获取预测，请求列表以JSON形式从参数或标准输入传入
+        # 流式模式下标准输入还可以是每行一条请求的NDJSON，逐条读取、逐条输出
+        api_key = sys.argv[3] if len(sys.argv) > 3 else None
+        from_stdin = len(sys.argv) <= 2 or sys.argv[2] == "-"
+        try:
+            if STREAM_OUTPUT and from_stdin:
+                requests = iter_stream_requests(sys.stdin)
+            else:
+                requests = json.loads(sys.stdin.read() if from_stdin else sys.argv[2])
+            if STREAM_OUTPUT:
+                stream_quantum_predictions_batch(requests, api_key)
+            else:
+                get_quantum_predictions_batch(requests, api_key)
+        except ValueError as e:
+            sys.stderr.write(f"无效的批量请求: {str(e)}\n")
+            sys.exit(1)
     elif command == "devices":
         # 获取设备列表
         get_available_devices()
     elif command == "circuit":
         # 获取量子电路
         get_quantum_circuit()
+    elif command == "stats":
+        # 获取桥接运行统计
+        get_bridge_stats()
+    elif command == "throughput":
+        # 测量不同工作进程数下的并行吞吐量，可选参数为逗号分隔的工作进程数
+        worker_counts = [int(w) for w in sys.argv[2].split(",")] if len(sys.argv) > 2 else None
+        output_json(measure_parallel_throughput(worker_counts=worker_counts))
+    elif command == "sweep":
+        # 参数扫描: sweep [参数组JSON|组数|-] [采样次数] [电路JSON]，默认100组随机角度和预测电路
+        try:
+            sets_json = sys.argv[2] if len(sys.argv) > 2 else "100"
+            parameter_sets = json.loads(sys.stdin.read() if sets_json == "-" else sets_json)
+            shots = int(sys.argv[3]) if len(sys.argv) > 3 else 1024
+            circuit = json.loads(sys.argv[4]) if len(sys.argv) > 4 else create_quantum_circuit(5)
+            output_json(sweep_quantum_circuit(circuit, parameter_sets, shots))
+        except ValueError as e:
+            sys.stderr.write(f"参数扫描失败: {str(e)}\n")
+            error = {"error": True, "message": str(e)}
+            if isinstance(e, CircuitValidationError):
+                error["errors"] = e.errors
+            output_json(error)
+            sys.exit(1)
+    elif command == "marginals":
+        # 边缘统计: marginals [子集JSON] [电路JSON]，例如 marginals '[[0,1],[0,2,4]]'，默认使用预测电路
+        try:
+            subsets = json.loads(sys.argv[2]) if len(sys.argv) > 2 else []
+            circuit = json.loads(sys.argv[3]) if len(sys.argv) > 3 else create_quantum_circuit(5)
+            output_json(get_circuit_marginals(circuit, subsets))
+        except ValueError as e:
+            sys.stderr.write(f"计算边缘统计失败: {str(e)}\n")
+            error = {"error": True, "message": str(e)}
+            if isinstance(e, CircuitValidationError):
+                error["errors"] = e.errors
+            output_json(error)
+            sys.exit(1)
+    elif command == "validate":
+        # 校验前端格式电路: validate <电路JSON|->，电路无效时以非零状态退出
+        circuit_json = sys.argv[2] if len(sys.argv) > 2 else "-"
+        try:
+            report = validate_circuit_report(json.loads(sys.stdin.read() if circuit_json == "-" else circuit_json))
+        except ValueError as e:
+            report = {"valid": False, "errors": [validation_error("", "json", f"无效的JSON: {str(e)}")]}
+        output_json(report)
+        if not report["valid"]:
+            sys.exit(1)
+    elif command in ("submit", "status", "result"):
+        # 作业命令: submit [电路JSON|-] [采样次数] [API密钥]，status/result <作业ID> [API密钥]
+        try:
+            if command == "submit":
+                circuit_json = sys.argv[2] if len(sys.argv) > 2 else ""
+                if circuit_json == "-":
+                    circuit_json = sys.stdin.read()
+                circuit = pack_circuit(json.loads(circuit_json)) if circuit_json.strip() else create_quantum_circuit(5)
+                shots = int(sys.argv[3]) if len(sys.argv) > 3 else 1024
+                api_key = sys.argv[4] if len(sys.argv) > 4 else None
+                output_json(JOB_MANAGER.status(JOB_MANAGER.submit(circuit, shots, api_key)))
+            elif len(sys.argv) < 3:
+                sys.stderr.write(f"用法: python quantum-bridge.py {command} <job_id> [api_key]\n")
+                sys.exit(1)
+            elif command == "status":
+                output_json(JOB_MANAGER.status(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None))
+            else:
+                output_json(JOB_MANAGER.result(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None))
+        except Exception as e:
+            sys.stderr.write(f"处理作业命令时出错: {str(e)}\n")
+            error = {"error": True, "message": str(e)}
+            if isinstance(e, CircuitValidationError):
+                error["errors"] = e.errors
+            output_json(error)
+            sys.exit(1)
+    elif command == "serve":
+        # 常驻服务模式，可选参数为工作线程数
+        serve_bridge(workers=int(sys.argv[2]) if len(sys.argv) > 2 else None)
     else:
         sys.stderr.write(f"未知命令: {command}\n")
         sys.exit(1)
 
+MODULE_LOAD_END = time.perf_counter()
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -170,6 +170,78 @@ class GuodunQuantumClient {
     }
   }
 
+  // 以流式模式批量预测，每完成一条预测就调用一次 onItem，返回预测条数
+  async runBatchStream(requests, onItem) {
+    try {
+      return new Promise((resolve, reject) => {
+        console.log(`流式批量预测 ${requests.length} 条请求`);
+        
+        const python = spawn('python', [
+          this.pythonBridgePath,
+          'predict-batch',
+          '-',
+          this.apiKey || '',
+          '--stream'
+        ]);
+        
+        // 按UTF-8解码整个输出流，避免多字节的中文字符在数据块边界处被截断
+        python.stdout.setEncoding('utf8');
+        
+        // 只缓存尚未读完的最后一行，逐行解析NDJSON记录
+        let pending = '';
+        let count = 0;
+        let parseError = null;
+        
+        const handleLine = (line) => {
+          if (!line.trim() || parseError) {
+            return;
+          }
+          try {
+            const record = JSON.parse(line);
+            if (record.type === 'item') {
+              onItem(record.result, record.index);
+            } else if (record.type === 'done') {
+              count = record.count;
+            }
+          } catch (error) {
+            parseError = error;
+          }
+        };
+        
+        python.stdout.on('data', (data) => {
+          pending += data;
+          const lines = pending.split('\n');
+          pending = lines.pop();
+          lines.forEach(handleLine);
+        });
+        
+        python.stderr.on('data', (data) => {
+          console.log('Python信息:', data.toString());
+        });
+        
+        python.on('close', (code) => {
+          handleLine(pending);
+          if (code !== 0) {
+            return reject(new Error(`Python进程退出，退出码 ${code}`));
+          }
+          if (parseError) {
+            return reject(new Error(`解析Python输出时出错: ${parseError.message}`));
+          }
+          resolve(count);
+        });
+        
+        // 请求以每行一条的NDJSON写入标准输入
+        requests.forEach((request) => {
+          python.stdin.write(JSON.stringify(request) + '\n');
+        });
+        python.stdin.end();
+      });
+    } catch (error) {
+      console.error('流式批量预测时出错:', error.message);
+      throw error;
+    }
+  }
+
   // 获取量子电路数据
   async getQuantumCircuit() {
     try {
@@ -282,6 +354,58 @@ class QuantumEngine {
     }
   }
 
+  // 批量获取多个时间范围的运势预测，每完成一条就调用一次 onPrediction(预测, 下标)
+  async getFortunePredictions(timeSpans, birthDate = null, onPrediction = () => {}) {
+    try {
+      console.log(`批量获取运势预测，时间范围: ${timeSpans.join(', ')}, 出生日期: ${birthDate}`);
+      
+      const predictions = new Array(timeSpans.length);
+      // 未命中缓存的时间范围及其在请求中的下标，重复的时间范围只计算一次
+      const missing = new Map();
+      
+      // 先返回缓存中的预测，只为未命中的时间范围启动Python进程
+      timeSpans.forEach((timeSpan, index) => {
+        const cachedResult = this.getFromCache(`${timeSpan}_${birthDate || 'default'}`);
+        if (cachedResult) {
+          predictions[index] = cachedResult;
+          onPrediction(cachedResult, index);
+        } else if (missing.has(timeSpan)) {
+          missing.get(timeSpan).push(index);
+        } else {
+          missing.set(timeSpan, [index]);
+        }
+      });
+      
+      if (missing.size > 0) {
+        const pendingSpans = Array.from(missing.keys());
+        const requests = pendingSpans.map((timeSpan) => ({ time_span: timeSpan }));
+        await this.guodunQuantumClient.runBatchStream(requests, (result, position) => {
+          const timeSpan = pendingSpans[position];
+          const prediction = {
+            fortune: result.fortune,
+            indicators: result.indicators,
+            timestamp: result.timestamp,
+            timeSpan: timeSpan,
+            birthDate: birthDate,
+            advice: this.generateAdvice(result.fortune, timeSpan),
+            usingRealQuantum: true, // 始终使用真实量子计算
+            quantumProvider: '国盾量子'
+          };
+          this.addToCache(`${timeSpan}_${birthDate || 'default'}`, prediction);
+          missing.get(timeSpan).forEach((index) => {
+            predictions[index] = prediction;
+            onPrediction(prediction, index);
+          });
+        });
+      }
+      
+      return predictions;
+    } catch (error) {
+      console.error('批量获取运势预测时出错:', error);
+      throw new Error(`批量获取运势预测失败: ${error.message}`);
+    }
+  }
+
   // 生成建议
   generateAdvice(fortune, timeSpan) {
     // 根据运势值生成建议
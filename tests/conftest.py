@@ -0,0 +1,24 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+BRIDGE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "quantum-bridge.py")
+
+
+def load_bridge():
+    """按文件路径导入 quantum-bridge.py（文件名含连字符，不能直接 import）"""
+    if "quantum_bridge" in sys.modules:
+        return sys.modules["quantum_bridge"]
+    spec = importlib.util.spec_from_file_location("quantum_bridge", BRIDGE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    # 先登记模块，进程池序列化工作函数时需要按模块名找到它
+    sys.modules["quantum_bridge"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def bridge():
+    return load_bridge()
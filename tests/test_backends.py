@@ -0,0 +1,260 @@
+"""各模拟后端与稠密内核的对照测试：小电路上的测量概率、边缘统计和后端选择阈值"""
+
+import math
+
+import numpy as np
+import pytest
+
+
+def build_compiled(bridge, num_qubits, operations):
+    circuit = bridge.pack_circuit({"circuit_id": "test", "num_qubits": num_qubits, "operations": operations})
+    compiled = bridge.get_compiled_circuit(circuit)
+    return compiled, bridge.bind_circuit_parameters(compiled, circuit)
+
+
+def random_operations(rng, num_qubits, count, clifford=False):
+    operations = []
+    for _ in range(count):
+        kind = rng.choice(["h", "cx", "rz"])
+        if kind == "cx":
+            control, target = rng.choice(num_qubits, 2, replace=False).tolist()
+            operations.append({"name": "cx", "qubits": [control, target]})
+        elif kind == "rz":
+            angle = int(rng.integers(4)) * math.pi / 2 if clifford else float(rng.uniform(0, 2 * math.pi))
+            operations.append({"name": "rz", "qubits": [int(rng.integers(num_qubits))], "params": [angle]})
+        else:
+            operations.append({"name": "h", "qubits": [int(rng.integers(num_qubits))]})
+    return operations
+
+
+def distribution_array(results, num_qubits):
+    probabilities = np.zeros(2**num_qubits)
+    for outcome, probability in results.items():
+        probabilities[int(outcome, 2)] = probability
+    return probabilities
+
+
+def dense_reference(bridge, compiled, parameters):
+    state_vector = bridge.evolve_compiled_circuit(compiled, parameters)
+    probabilities = bridge.state_probabilities(state_vector)
+    return probabilities, bridge.compute_qubit_marginals(state_vector, compiled["num_qubits"], probabilities=probabilities)
+
+
+def run_backend(bridge, compiled, parameters, backend, **options):
+    report = {}
+    results, marginals = bridge.simulate_compiled_circuit(
+        compiled, parameters, 0, exact=True, backend=backend, marginals=True, report=report, **options
+    )
+    return distribution_array(results, compiled["num_qubits"]), marginals, report
+
+
+def assert_marginals_match(actual, expected, coherences=True):
+    assert np.allclose(actual.ones, expected.ones)
+    assert np.allclose(actual.joint, expected.joint)
+    assert np.allclose(actual.correlations(), expected.correlations())
+    if coherences:
+        assert np.allclose(actual.coherences, expected.coherences)
+
+
+def sparse_operations(num_qubits):
+    # 只在前两个量子比特上产生叠加，其余量子比特由 CNOT 链纠缠：非零振幅始终只有4个
+    operations = [{"name": "h", "qubits": [0]}, {"name": "h", "qubits": [1]},
+                  {"name": "rz", "qubits": [1], "params": [0.7]}, {"name": "h", "qubits": [1]}]
+    operations += [{"name": "cx", "qubits": [i, i + 1]} for i in range(1, num_qubits - 1)]
+    operations += [{"name": "rz", "qubits": [i], "params": [0.3 * i]} for i in range(num_qubits)]
+    return operations
+
+
+@pytest.mark.parametrize("num_qubits", [6, 9, 12])
+def test_sparse_backend_matches_dense(bridge, num_qubits):
+    compiled, parameters = build_compiled(bridge, num_qubits, sparse_operations(num_qubits))
+    expected, expected_marginals = dense_reference(bridge, compiled, parameters)
+
+    probabilities, marginals, report = run_backend(bridge, compiled, parameters, "sparse")
+    assert report["backend"] == "sparse"
+    assert np.allclose(probabilities, expected)
+    assert_marginals_match(marginals, expected_marginals)
+
+
+@pytest.mark.parametrize("num_qubits", [4, 7])
+def test_sparse_backend_densifies_and_matches_dense(bridge, num_qubits):
+    rng = np.random.default_rng(300 + num_qubits)
+    operations = [{"name": "h", "qubits": [i]} for i in range(num_qubits)] + random_operations(rng, num_qubits, 40)
+    compiled, parameters = build_compiled(bridge, num_qubits, operations)
+    expected, expected_marginals = dense_reference(bridge, compiled, parameters)
+
+    probabilities, marginals, report = run_backend(bridge, compiled, parameters, "sparse")
+    assert report["backend"] == "sparse+dense"
+    assert np.allclose(probabilities, expected)
+    assert_marginals_match(marginals, expected_marginals)
+
+
+def test_sparse_fill_threshold(bridge):
+    # 6个量子比特共64个振幅：2个 H 门后非零占比 4/64 低于 0.1，3个 H 门后 8/64 超过 0.1
+    num_qubits = 6
+    for superposed, densified in ((2, False), (3, True)):
+        operations = [{"name": "h", "qubits": [i]} for i in range(superposed)]
+        compiled, parameters = build_compiled(bridge, num_qubits, operations)
+        outcomes, amplitudes = bridge.evolve_sparse_circuit(compiled, parameters, fill_threshold=0.1)
+        assert (outcomes is None) == densified
+        assert len(amplitudes) == (2**num_qubits if densified else 2**superposed)
+
+
+def test_auto_selects_sparse_from_sparse_min_qubits(bridge):
+    # RZ 后接 H 使电路不是 Clifford 电路，稳定子后端不接手
+    for num_qubits, backend in ((bridge.SPARSE_MIN_QUBITS - 1, "dense"), (bridge.SPARSE_MIN_QUBITS, "sparse")):
+        compiled, parameters = build_compiled(bridge, num_qubits, sparse_operations(num_qubits))
+        _, _, report = run_backend(bridge, compiled, parameters, "auto")
+        assert report["backend"] == backend
+
+
+@pytest.fixture
+def small_blocks(bridge, monkeypatch, tmp_path):
+    # 块只有4个振幅，使门跨块时走拼块路径；态向量文件写入临时目录
+    monkeypatch.setattr(bridge, "OUT_OF_CORE_BLOCK_QUBITS", 2)
+    monkeypatch.setattr(bridge, "OUT_OF_CORE_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize("num_qubits", [3, 5, 8])
+def test_out_of_core_backend_matches_dense(bridge, small_blocks, num_qubits):
+    rng = np.random.default_rng(400 + num_qubits)
+    compiled, parameters = build_compiled(bridge, num_qubits, random_operations(rng, num_qubits, 40))
+    expected, expected_marginals = dense_reference(bridge, compiled, parameters)
+
+    probabilities, marginals, report = run_backend(bridge, compiled, parameters, "out_of_core")
+    assert report["backend"] == "out_of_core"
+    assert report["disk_bytes"] == 2**num_qubits * 16
+    assert np.allclose(probabilities, expected)
+    # memmap 后端只由测量结果计算边缘统计，没有约化态的非对角元
+    assert marginals.coherences is None
+    assert_marginals_match(marginals, expected_marginals, coherences=False)
+    assert list(small_blocks.iterdir()) == []
+
+
+def test_out_of_core_sampling_counts_every_shot(bridge, small_blocks):
+    num_qubits = 6
+    compiled, parameters = build_compiled(bridge, num_qubits, [{"name": "h", "qubits": [i]} for i in range(num_qubits)])
+    counts = bridge.simulate_compiled_circuit(compiled, parameters, 500, np.random.default_rng(0), backend="out_of_core")
+    assert sum(counts.values()) == 500
+    assert all(len(outcome) == num_qubits for outcome in counts)
+    assert list(small_blocks.iterdir()) == []
+
+
+def test_auto_selects_out_of_core_past_memory_budget(bridge, small_blocks, monkeypatch):
+    num_qubits = 6
+    rng = np.random.default_rng(6)
+    compiled, parameters = build_compiled(bridge, num_qubits, random_operations(rng, num_qubits, 30))
+    expected, _ = dense_reference(bridge, compiled, parameters)
+
+    # 稠密态向量加测量概率需要 2**n * 24 字节
+    monkeypatch.setattr(bridge, "MEMORY_BUDGET", 2**num_qubits * 24)
+    assert run_backend(bridge, compiled, parameters, "auto")[2]["backend"] == "dense"
+    monkeypatch.setattr(bridge, "MEMORY_BUDGET", 2**num_qubits * 24 - 1)
+    probabilities, _, report = run_backend(bridge, compiled, parameters, "auto")
+    assert report["backend"] == "out_of_core"
+    assert np.allclose(probabilities, expected)
+
+
+def test_sparse_backend_switches_to_out_of_core(bridge, small_blocks, monkeypatch):
+    num_qubits = 6
+    rng = np.random.default_rng(16)
+    operations = [{"name": "h", "qubits": [i]} for i in range(num_qubits)] + random_operations(rng, num_qubits, 30)
+    compiled, parameters = build_compiled(bridge, num_qubits, operations)
+    expected, _ = dense_reference(bridge, compiled, parameters)
+
+    monkeypatch.setattr(bridge, "MEMORY_BUDGET", 0)
+    probabilities, _, report = run_backend(bridge, compiled, parameters, "sparse")
+    assert report["backend"] == "sparse+out_of_core"
+    assert np.allclose(probabilities, expected)
+
+
+def test_out_of_core_rejects_circuits_past_max_qubits(bridge, monkeypatch):
+    monkeypatch.setattr(bridge, "OUT_OF_CORE_MAX_QUBITS", 4)
+    compiled, parameters = build_compiled(bridge, 5, [{"name": "h", "qubits": [0]}])
+    with pytest.raises(ValueError):
+        bridge.simulate_compiled_circuit(compiled, parameters, 10, backend="out_of_core")
+
+
+def clifford_operations(rng, num_qubits, count):
+    # Clifford 电路之后接任意角度的末尾 RZ 层，末尾 RZ 只改变约化态非对角元的相位
+    operations = [{"name": "h", "qubits": [i]} for i in range(0, num_qubits, 2)]
+    operations += random_operations(rng, num_qubits, count, clifford=True)
+    operations += [{"name": "rz", "qubits": [i], "params": [float(rng.uniform(0, 2 * math.pi))]} for i in range(num_qubits)]
+    return operations
+
+
+@pytest.mark.parametrize("num_qubits", [2, 4, 7])
+def test_stabilizer_backend_matches_dense(bridge, num_qubits):
+    rng = np.random.default_rng(500 + num_qubits)
+    for _ in range(3):
+        compiled, parameters = build_compiled(bridge, num_qubits, clifford_operations(rng, num_qubits, 30))
+        expected, expected_marginals = dense_reference(bridge, compiled, parameters)
+
+        probabilities, marginals, report = run_backend(bridge, compiled, parameters, "stabilizer")
+        assert report["backend"] == "stabilizer"
+        assert np.allclose(probabilities, expected)
+        assert_marginals_match(marginals, expected_marginals)
+        for qubits in ([0], [num_qubits - 1, 0], list(range(num_qubits))[::-1]):
+            assert np.allclose(marginals.marginal(qubits), expected_marginals.marginal(qubits))
+
+
+def test_stabilizer_backend_rejects_non_clifford_circuits(bridge):
+    operations = [{"name": "h", "qubits": [0]}, {"name": "rz", "qubits": [0], "params": [0.3]}, {"name": "h", "qubits": [0]}]
+    compiled, parameters = build_compiled(bridge, 2, operations)
+    with pytest.raises(ValueError):
+        bridge.simulate_compiled_circuit(compiled, parameters, 10, backend="stabilizer")
+
+
+def test_auto_selects_stabilizer_from_stabilizer_min_qubits(bridge):
+    minimum = bridge.STABILIZER_MIN_QUBITS
+    for num_qubits, backend in ((minimum - 1, "dense"), (minimum, "stabilizer")):
+        rng = np.random.default_rng(num_qubits)
+        compiled, parameters = build_compiled(bridge, num_qubits, clifford_operations(rng, num_qubits, 20))
+        report = {}
+        bridge.simulate_compiled_circuit(compiled, parameters, 100, rng, backend="auto", report=report)
+        assert report["backend"] == backend
+
+
+def test_auto_exact_stabilizer_only_for_small_support(bridge):
+    # 精确分布的随机比特数超过量子比特数一半时交给态向量后端
+    num_qubits = bridge.STABILIZER_MIN_QUBITS
+    for superposed, backend in ((num_qubits // 2, "stabilizer"), (num_qubits // 2 + 1, "sparse")):
+        operations = [{"name": "h", "qubits": [i]} for i in range(superposed)]
+        operations += [{"name": "cx", "qubits": [i, i + 1]} for i in range(superposed - 1, num_qubits - 1)]
+        compiled, parameters = build_compiled(bridge, num_qubits, operations)
+        _, _, report = run_backend(bridge, compiled, parameters, "auto")
+        assert report["backend"] == backend
+
+
+@pytest.mark.parametrize("num_qubits", [4, 7])
+def test_wide_parallel_backend_matches_dense(bridge, monkeypatch, num_qubits):
+    # 降低阈值，使小电路也按高位量子比特切块分给两个进程
+    monkeypatch.setattr(bridge, "PARALLEL_MIN_QUBITS", 4)
+    rng = np.random.default_rng(600 + num_qubits)
+    compiled, parameters = build_compiled(bridge, num_qubits, random_operations(rng, num_qubits, 40))
+    expected, expected_marginals = dense_reference(bridge, compiled, parameters)
+
+    probabilities, marginals, report = run_backend(bridge, compiled, parameters, "auto", workers=2)
+    assert report["backend"] == "parallel"
+    assert np.allclose(probabilities, expected)
+    assert_marginals_match(marginals, expected_marginals, coherences=False)
+
+
+def test_parallel_batch_matches_single_process(bridge):
+    rng = np.random.default_rng(700)
+    num_qubits = 5
+    operations = random_operations(rng, num_qubits, 30)
+    circuit = bridge.pack_circuit({"circuit_id": "test", "num_qubits": num_qubits, "operations": operations})
+    compiled = bridge.get_compiled_circuit(circuit)
+    parameter_sets = rng.uniform(0, 2 * math.pi, (5, compiled["num_params"]))
+
+    expected, expected_marginals = bridge.simulate_quantum_circuit_batch(
+        circuit, 0, parameter_sets, exact=True, workers=1, marginals=True
+    )
+    actual, marginals = bridge.simulate_quantum_circuit_batch(
+        circuit, 0, parameter_sets, exact=True, workers=2, marginals=True
+    )
+    for row in range(len(parameter_sets)):
+        assert np.allclose(distribution_array(actual[row], num_qubits), distribution_array(expected[row], num_qubits))
+        assert_marginals_match(marginals[row], expected_marginals[row])
@@ -0,0 +1,136 @@
+"""作业管理器测试，使用 tools/fake-sdk/ezQgd.py 替代国盾量子SDK"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import BRIDGE_PATH
+
+FAKE_SDK_DIR = os.path.join(os.path.dirname(BRIDGE_PATH), "tools", "fake-sdk")
+API_KEY = "test-key"
+
+
+@pytest.fixture
+def fake_sdk(bridge, monkeypatch, tmp_path):
+    # 模块属性与同名环境变量等价，测试中直接修改属性
+    monkeypatch.syspath_prepend(FAKE_SDK_DIR)
+    import ezQgd
+    monkeypatch.setattr(ezQgd, "STATE_PATH", str(tmp_path / "fake-ezqgd-jobs.json"))
+    monkeypatch.setattr(ezQgd, "LATENCY", 0.1)
+    monkeypatch.setattr(ezQgd, "FAILURE_RATE", 0.0)
+    monkeypatch.setattr(ezQgd, "SUBMIT_FAILURE_RATE", 0.0)
+    monkeypatch.setattr(bridge, "HAS_QGD_SDK", True)
+    monkeypatch.setattr(bridge, "JOB_POLL_INITIAL_DELAY", 0.02)
+    monkeypatch.setattr(bridge, "JOB_POLL_MAX_DELAY", 0.1)
+    return ezQgd
+
+
+@pytest.fixture
+def manager(bridge):
+    return bridge.JobManager()
+
+
+def test_submit_status_and_result(bridge, fake_sdk, manager):
+    job_id = manager.submit(bridge.create_quantum_circuit(3), 64, API_KEY)
+    assert job_id.startswith("fake_")
+    assert manager.status(job_id)["status"] in ("QUEUED", "RUNNING", "COMPLETED")
+
+    job = manager.result(job_id, API_KEY, timeout=5)
+    assert job["status"] == "COMPLETED"
+    assert job["backend"] == "sdk"
+    assert job["shots"] == 64
+    assert sum(job["results"].values()) == 64
+    assert all(len(outcome) == 3 for outcome in job["results"])
+    assert job["polls"] >= 1
+
+
+def test_submit_retries_with_backoff(bridge, fake_sdk, manager, monkeypatch):
+    attempts = []
+    submit_job = fake_sdk.submit_job
+
+    def flaky_submit(circuit, shots=1024, api_key=None):
+        attempts.append(time.monotonic())
+        if len(attempts) < bridge.JOB_SUBMIT_RETRIES:
+            raise ConnectionError("模拟的提交失败")
+        return submit_job(circuit, shots, api_key)
+
+    monkeypatch.setattr(fake_sdk, "submit_job", flaky_submit)
+    job_id = manager.submit(bridge.create_quantum_circuit(2), 16, API_KEY)
+
+    assert len(attempts) == bridge.JOB_SUBMIT_RETRIES
+    gaps = [later - earlier for earlier, later in zip(attempts, attempts[1:])]
+    assert gaps[0] >= bridge.JOB_POLL_INITIAL_DELAY
+    assert gaps[1] >= 2 * bridge.JOB_POLL_INITIAL_DELAY
+    assert manager.result(job_id, API_KEY, timeout=5)["status"] == "COMPLETED"
+
+
+def test_submit_gives_up_after_injected_failures(bridge, fake_sdk, manager, monkeypatch):
+    monkeypatch.setattr(fake_sdk, "SUBMIT_FAILURE_RATE", 1.0)
+    with pytest.raises(ConnectionError):
+        manager.submit(bridge.create_quantum_circuit(2), 16, API_KEY)
+    assert manager.jobs == {}
+
+
+def test_failed_job_is_reported(bridge, fake_sdk, manager, monkeypatch):
+    monkeypatch.setattr(fake_sdk, "FAILURE_RATE", 1.0)
+    job = manager.result(manager.submit(bridge.create_quantum_circuit(2), 16, API_KEY), API_KEY, timeout=5)
+    assert job["status"] == "FAILED"
+    assert job["results"] is None
+    assert job["error"]
+
+
+def test_wait_times_out(bridge, fake_sdk, manager, monkeypatch):
+    monkeypatch.setattr(fake_sdk, "LATENCY", 30.0)
+    job_id = manager.submit(bridge.create_quantum_circuit(2), 16, API_KEY, timeout=0.2)
+    job = manager.result(job_id, API_KEY)
+    assert job["status"] == "TIMEOUT"
+    assert job["results"] is None
+    assert job["completed_at"] is None
+
+
+def run_job_command(args, env):
+    completed = subprocess.run(
+        [sys.executable, BRIDGE_PATH] + args,
+        env=env, capture_output=True, text=True, timeout=60, check=True
+    )
+    return json.loads(completed.stdout)
+
+
+def test_result_of_job_submitted_by_another_process(bridge, fake_sdk, manager, monkeypatch):
+    monkeypatch.setattr(fake_sdk, "LATENCY", 0.0)
+    env = dict(os.environ, PYTHONPATH=FAKE_SDK_DIR, EZQGD_FAKE_STATE_PATH=fake_sdk.STATE_PATH, EZQGD_FAKE_LATENCY="0")
+    job_id = run_job_command(["submit", "", "32", API_KEY], env)["job_id"]
+    assert job_id not in manager.jobs
+
+    job = manager.result(job_id, API_KEY, wait=False)
+    assert job["status"] == "COMPLETED"
+    assert job["shots"] == 32
+    assert sum(job["results"].values()) == 32
+    assert job_id not in manager.jobs
+
+
+def test_simulator_job_shared_between_processes(bridge, manager, monkeypatch, tmp_path):
+    state_path = str(tmp_path / "quantum-bridge-jobs.json")
+    monkeypatch.setattr(bridge.SIMULATOR_JOB_BACKEND, "path", state_path)
+    env = dict(os.environ, QUANTUM_BRIDGE_JOB_STATE_PATH=state_path)
+    job_id = run_job_command(["submit", "", "48"], env)["job_id"]
+
+    job = manager.result(job_id, wait=False)
+    assert job["backend"] == "simulator"
+    assert job["status"] == "COMPLETED"
+    assert job["shots"] == 48
+
+    # 等待模式从现在开始跟踪该作业，采样次数取自作业文件
+    job = manager.result(job_id, timeout=5)
+    assert job["shots"] == 48
+    assert job["results"] == run_job_command(["result", job_id], env)["results"]
+
+
+def test_unknown_job_is_rejected(bridge, manager, monkeypatch, tmp_path):
+    monkeypatch.setattr(bridge.SIMULATOR_JOB_BACKEND, "path", str(tmp_path / "jobs.json"))
+    with pytest.raises(ValueError):
+        manager.result("sim_missing", wait=False)
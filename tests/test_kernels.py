@@ -0,0 +1,157 @@
+"""向量化门内核与原始逐振幅循环实现的对照测试"""
+
+import math
+
+import numpy as np
+import pytest
+
+
+# 以下三个函数复制自向量化之前的逐振幅循环实现，作为参考结果。原来的 CNOT 循环
+# 对控制位为1的每一对振幅交换两次，结果不变；这里只在目标位为0时交换，修正了这一点
+
+def reference_hadamard(state_vector, qubit, num_qubits):
+    new_state = np.zeros_like(state_vector)
+    n = 2**num_qubits
+    h_factor = 1 / np.sqrt(2)
+
+    for i in range(n):
+        bit_val = (i >> qubit) & 1
+        flipped = i ^ (1 << qubit)
+
+        if bit_val == 0:
+            new_state[i] += h_factor * state_vector[i]
+            new_state[flipped] += h_factor * state_vector[i]
+        else:
+            new_state[flipped] += h_factor * state_vector[i]
+            new_state[i] -= h_factor * state_vector[i]
+
+    return new_state
+
+
+def reference_cnot(state_vector, control, target, num_qubits):
+    new_state = state_vector.copy()
+    n = 2**num_qubits
+
+    for i in range(n):
+        control_val = (i >> control) & 1
+        if control_val == 1 and (i >> target) & 1 == 0:
+            target_flipped = i ^ (1 << target)
+            new_state[i], new_state[target_flipped] = new_state[target_flipped], new_state[i]
+
+    return new_state
+
+
+def reference_rz(state_vector, qubit, angle, num_qubits):
+    new_state = state_vector.copy()
+    n = 2**num_qubits
+
+    for i in range(n):
+        bit_val = (i >> qubit) & 1
+        if bit_val == 1:
+            new_state[i] *= np.exp(1j * angle)
+
+    return new_state
+
+
+def random_state(rng, num_qubits):
+    state = rng.normal(size=2**num_qubits) + 1j * rng.normal(size=2**num_qubits)
+    return state / np.linalg.norm(state)
+
+
+def random_gates(rng, num_qubits, count):
+    gates = []
+    for _ in range(count):
+        kind = rng.choice(["h", "cx", "rz"] if num_qubits > 1 else ["h", "rz"])
+        if kind == "cx":
+            control, target = rng.choice(num_qubits, 2, replace=False).tolist()
+            gates.append(("cx", control, target))
+        elif kind == "rz":
+            gates.append(("rz", int(rng.integers(num_qubits)), float(rng.uniform(0, 2 * math.pi))))
+        else:
+            gates.append(("h", int(rng.integers(num_qubits))))
+    return gates
+
+
+def run_reference(state, gates, num_qubits):
+    for gate in gates:
+        if gate[0] == "h":
+            state = reference_hadamard(state, gate[1], num_qubits)
+        elif gate[0] == "cx":
+            state = reference_cnot(state, gate[1], gate[2], num_qubits)
+        else:
+            state = reference_rz(state, gate[1], gate[2], num_qubits)
+    return state
+
+
+@pytest.mark.parametrize("num_qubits", [1, 2, 3, 5, 8])
+def test_single_gates_match_loop_on_every_position(bridge, num_qubits):
+    rng = np.random.default_rng(num_qubits)
+    for qubit in range(num_qubits):
+        state = random_state(rng, num_qubits)
+        expected = reference_hadamard(state, qubit, num_qubits)
+        assert np.allclose(bridge.apply_hadamard(state.copy(), qubit, num_qubits), expected)
+
+        angle = rng.uniform(0, 2 * math.pi)
+        expected = reference_rz(state, qubit, angle, num_qubits)
+        assert np.allclose(bridge.apply_rz(state.copy(), qubit, angle, num_qubits), expected)
+
+        for target in range(num_qubits):
+            if target == qubit:
+                continue
+            expected = reference_cnot(state, qubit, target, num_qubits)
+            assert np.allclose(bridge.apply_cnot(state.copy(), qubit, target, num_qubits), expected)
+
+
+@pytest.mark.parametrize("num_qubits", [2, 4, 6, 9])
+def test_random_circuits_match_loop(bridge, num_qubits):
+    rng = np.random.default_rng(100 + num_qubits)
+    for _ in range(5):
+        gates = random_gates(rng, num_qubits, 30)
+        state = random_state(rng, num_qubits)
+        expected = run_reference(state, gates, num_qubits)
+
+        actual = state.copy()
+        for gate in gates:
+            if gate[0] == "h":
+                bridge.apply_hadamard(actual, gate[1], num_qubits)
+            elif gate[0] == "cx":
+                bridge.apply_cnot(actual, gate[1], gate[2], num_qubits)
+            else:
+                bridge.apply_rz(actual, gate[1], gate[2], num_qubits)
+        assert np.allclose(actual, expected)
+
+
+def test_batched_rz_matches_loop_per_row(bridge):
+    rng = np.random.default_rng(7)
+    num_qubits = 4
+    states = np.stack([random_state(rng, num_qubits) for _ in range(3)])
+    angles = rng.uniform(0, 2 * math.pi, 3)
+    actual = bridge.apply_rz(states.copy(), 2, angles, num_qubits)
+    for row, angle in enumerate(angles):
+        assert np.allclose(actual[row], reference_rz(states[row], 2, angle, num_qubits))
+
+
+@pytest.mark.parametrize("num_qubits", [3, 5, 7])
+def test_compiled_circuits_match_loop(bridge, num_qubits):
+    # 编译、门融合后的执行计划与逐门参考实现得到相同的态向量
+    rng = np.random.default_rng(200 + num_qubits)
+    for _ in range(3):
+        gates = random_gates(rng, num_qubits, 40)
+        operations = []
+        for gate in gates:
+            if gate[0] == "h":
+                operations.append({"name": "h", "qubits": [gate[1]]})
+            elif gate[0] == "cx":
+                operations.append({"name": "cx", "qubits": [gate[1], gate[2]]})
+            else:
+                operations.append({"name": "rz", "qubits": [gate[1]], "params": [gate[2]]})
+        circuit = bridge.pack_circuit({"circuit_id": "test", "num_qubits": num_qubits, "operations": operations})
+        compiled = bridge.get_compiled_circuit(circuit)
+        parameters = bridge.bind_circuit_parameters(compiled, circuit)
+
+        initial = np.zeros(2**num_qubits, dtype=complex)
+        initial[0] = 1.0
+        expected = run_reference(initial, gates, num_qubits)
+        for optimize in (False, True):
+            actual = bridge.evolve_compiled_circuit(compiled, parameters, optimize=optimize)
+            assert np.allclose(actual, expected)
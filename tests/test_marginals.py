@@ -0,0 +1,96 @@
+"""QubitMarginals 与逐个结果下标累加的参考实现的对照测试"""
+
+import itertools
+
+import numpy as np
+import pytest
+
+
+def reference_marginal(probabilities, qubits):
+    # 逐个结果下标取出子集中各比特的取值，结果下标的第 m 位对应 qubits[m]
+    marginal = np.zeros(2**len(qubits))
+    for index, probability in enumerate(probabilities):
+        label = sum(((index >> qubit) & 1) << m for m, qubit in enumerate(qubits))
+        marginal[label] += probability
+    return marginal
+
+
+def reference_coherences(state_vector, num_qubits):
+    # ρ01 = Σ a(…0…)·conj(a(…1…))，逐对振幅累加
+    coherences = np.zeros(num_qubits, dtype=complex)
+    for index, amplitude in enumerate(state_vector):
+        for qubit in range(num_qubits):
+            if not (index >> qubit) & 1:
+                coherences[qubit] += amplitude * np.conj(state_vector[index | (1 << qubit)])
+    return coherences
+
+
+def random_state(rng, num_qubits):
+    state = rng.normal(size=2**num_qubits) + 1j * rng.normal(size=2**num_qubits)
+    return state / np.linalg.norm(state)
+
+
+@pytest.mark.parametrize("num_qubits", [2, 3, 5])
+def test_dense_marginals_match_reference(bridge, num_qubits):
+    rng = np.random.default_rng(800 + num_qubits)
+    state_vector = random_state(rng, num_qubits)
+    probabilities = np.abs(state_vector)**2
+    marginals = bridge.QubitMarginals.from_state_vector(state_vector, num_qubits)
+
+    assert np.allclose(marginals.ones, [reference_marginal(probabilities, [q])[1] for q in range(num_qubits)])
+    for a, b in itertools.combinations(range(num_qubits), 2):
+        assert np.isclose(marginals.joint[a, b], reference_marginal(probabilities, [a, b])[3])
+    assert np.allclose(marginals.coherences, reference_coherences(state_vector, num_qubits))
+    for size in range(1, num_qubits + 1):
+        for qubits in itertools.permutations(range(num_qubits), size):
+            assert np.allclose(marginals.marginal(list(qubits)), reference_marginal(probabilities, qubits))
+
+
+def test_sparse_marginals_match_dense(bridge):
+    rng = np.random.default_rng(900)
+    num_qubits = 6
+    outcomes = np.sort(rng.choice(2**num_qubits, 10, replace=False))
+    amplitudes = rng.normal(size=10) + 1j * rng.normal(size=10)
+    amplitudes /= np.linalg.norm(amplitudes)
+    state_vector = np.zeros(2**num_qubits, dtype=complex)
+    state_vector[outcomes] = amplitudes
+
+    sparse = bridge.QubitMarginals.from_state_vector(amplitudes, num_qubits, outcomes)
+    dense = bridge.QubitMarginals.from_state_vector(state_vector, num_qubits)
+    assert np.allclose(sparse.joint, dense.joint)
+    assert np.allclose(sparse.coherences, dense.coherences)
+    for qubits in ([5, 0, 3], [1, 2, 3, 4], list(range(num_qubits))):
+        assert np.allclose(sparse.marginal(qubits), dense.marginal(qubits))
+
+
+def test_marginals_from_measured_results(bridge):
+    counts = {"000": 10, "011": 30, "101": 60}
+    marginals = bridge.marginals_from_results(counts)
+    assert marginals.coherences is None
+    assert marginals.purities() is None
+    # 比特串最左侧为最高位量子比特
+    assert np.allclose(marginals.ones, [0.9, 0.3, 0.6])
+    assert np.allclose(marginals.marginal([2, 0]), [0.1, 0.0, 0.3, 0.6])
+
+
+def test_invalid_subsets_are_rejected(bridge):
+    marginals = bridge.QubitMarginals.from_distribution(np.full(8, 1 / 8), 3)
+    for qubits in ([0, 0], [3], [-1]):
+        with pytest.raises(ValueError):
+            marginals.marginal(qubits)
+
+
+def test_circuit_marginals_subsets(bridge):
+    # Bell 态加一个处于 |+⟩ 的量子比特
+    circuit = {"circuit_id": "test", "num_qubits": 3, "operations": [
+        {"name": "h", "qubits": [0]}, {"name": "cx", "qubits": [0, 1]}, {"name": "h", "qubits": [2]}
+    ]}
+    result = bridge.get_circuit_marginals(circuit, [[0, 1], [1, 2], [2, 1, 0]])
+    assert np.allclose(result["ones"], [0.5, 0.5, 0.5])
+    assert np.allclose(result["coherences"], [0.0, 0.0, 1.0])
+    assert np.isclose(result["correlations"][0][1], 1.0)
+    assert np.isclose(result["correlations"][0][2], 0.0)
+    assert np.allclose(result["subsets"][0]["probabilities"], [0.5, 0, 0, 0.5])
+    assert np.allclose(result["subsets"][1]["probabilities"], [0.25] * 4)
+    assert result["subsets"][2]["qubits"] == [2, 1, 0]
+    assert np.allclose(result["subsets"][2]["probabilities"], [0.25, 0.25, 0, 0, 0, 0, 0.25, 0.25])
@@ -0,0 +1,60 @@
+"""complex64 与 complex128 两种模拟精度下的结果偏差测试"""
+
+import math
+
+import numpy as np
+import pytest
+
+
+def flatten(indicators):
+    values = {}
+    for key, value in indicators.items():
+        if isinstance(value, dict):
+            values.update({f"{key}.{inner}": inner_value for inner, inner_value in value.items()})
+        else:
+            values[key] = value
+    return values
+
+
+def layered_circuit(bridge, num_qubits):
+    # 两遍 H 层、CNOT 链和 RZ 层，与预测电路结构相同但更深
+    operations = []
+    for _ in range(2):
+        operations += [{"name": "h", "qubits": [i]} for i in range(num_qubits)]
+        operations += [{"name": "cx", "qubits": [i, i + 1]} for i in range(num_qubits - 1)]
+        operations += [{"name": "rz", "qubits": [i], "params": [0.0]} for i in range(num_qubits)]
+    return bridge.compile_circuit({"num_qubits": num_qubits, "operations": operations})
+
+
+def exact_distribution(bridge, compiled, parameters, precision):
+    state_vector = bridge.evolve_compiled_circuit(compiled, parameters, precision=precision)
+    return bridge.exact_probability_distribution(bridge.state_probabilities(state_vector), compiled["num_qubits"])
+
+
+# estimated_phase 和 phi 由结果下标的加权平均取模得到，偏差随量子比特数按 2**n 放大，
+# 因此只检查预测电路使用的规模
+@pytest.mark.parametrize("num_qubits", [3, 5])
+def test_indicator_drift_between_precisions_is_bounded(bridge, num_qubits):
+    rng = np.random.default_rng(num_qubits)
+    compiled = layered_circuit(bridge, num_qubits)
+
+    for _ in range(8):
+        parameters = rng.uniform(0, 2 * math.pi, compiled["num_params"])
+        single = exact_distribution(bridge, compiled, parameters, "complex64")
+        double = exact_distribution(bridge, compiled, parameters, "complex128")
+
+        for outcome in set(single) | set(double):
+            assert abs(single.get(outcome, 0) - double.get(outcome, 0)) <= bridge.PRECISION_DRIFT_TOLERANCE
+
+        single_indicators = flatten(bridge.analyze_quantum_results({"results": single}))
+        for key, value in flatten(bridge.analyze_quantum_results({"results": double})).items():
+            assert abs(single_indicators[key] - value) <= bridge.PRECISION_DRIFT_TOLERANCE, key
+
+
+def test_complex64_halves_state_vector_memory(bridge):
+    compiled = layered_circuit(bridge, 10)
+    parameters = np.zeros(compiled["num_params"])
+    single = bridge.evolve_compiled_circuit(compiled, parameters, precision="complex64")
+    double = bridge.evolve_compiled_circuit(compiled, parameters, precision="complex128")
+    assert single.dtype == np.complex64 and double.dtype == np.complex128
+    assert single.nbytes * 2 == double.nbytes
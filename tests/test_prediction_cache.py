@@ -0,0 +1,73 @@
+"""预测结果缓存测试：按时间范围过期、内存与SQLite两种存储，以及预测命中缓存"""
+
+from datetime import datetime
+
+import pytest
+
+
+@pytest.mark.parametrize("time_span, expected", [
+    ("day", datetime(2024, 5, 16)),
+    ("week", datetime(2024, 5, 20)),
+    ("month", datetime(2024, 6, 1)),
+    ("year", datetime(2025, 1, 1)),
+])
+def test_time_span_expiry(bridge, time_span, expected):
+    # 2024-05-15 是星期三
+    assert bridge.time_span_expiry(time_span, datetime(2024, 5, 15, 13, 30)) == expected.timestamp()
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(bridge, request, tmp_path):
+    return bridge.PredictionCache(None if request.param == "memory" else str(tmp_path / "predictions.sqlite"), max_size=2)
+
+
+def test_entries_expire_at_time_span_end(bridge, cache):
+    key = bridge.PredictionCache.make_key("day", seed=1)
+    cache.put(key, {"fortune": 0.5}, expires_at=200.0, now=100.0)
+    assert cache.get(key, now=150.0) == {"fortune": 0.5}
+    assert cache.get(key, now=200.0) is None
+
+    stats = cache.stats(now=150.0)
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+    assert cache.stats(now=250.0)["size"] == 0
+
+
+def test_keys_separate_seed_user_and_circuit(bridge):
+    make_key = bridge.PredictionCache.make_key
+    keys = {make_key("day", 1), make_key("day", 2), make_key("week", 1), make_key("day", user="alice"),
+            make_key("day", 1, circuit_key="other")}
+    assert len(keys) == 5
+    assert make_key("day", 1) == make_key("day", 1)
+
+
+def test_memory_cache_evicts_least_recently_used(bridge):
+    cache = bridge.PredictionCache(max_size=2)
+    for key in ("a", "b"):
+        cache.put(key, key, expires_at=1e12)
+    cache.get("a")
+    cache.put("c", "c", expires_at=1e12)
+    assert cache.get("b") is None
+    assert cache.get("a") == "a"
+    assert cache.get("c") == "c"
+
+
+def test_sqlite_cache_is_shared_between_instances(bridge, tmp_path):
+    path = str(tmp_path / "predictions.sqlite")
+    bridge.PredictionCache(path).put("key", {"fortune": 0.25}, expires_at=1e12)
+    other = bridge.PredictionCache(path)
+    assert other.get("key") == {"fortune": 0.25}
+    assert other.stats()["backend"] == "sqlite"
+
+
+def test_seeded_prediction_hits_cache(bridge, monkeypatch):
+    cache = bridge.PredictionCache()
+    monkeypatch.setattr(bridge, "PREDICTION_CACHE", cache)
+    first = bridge.get_quantum_prediction("day", emit=False, seed=11)
+    second = bridge.get_quantum_prediction("day", emit=False, seed=11, include_timings=True)
+    assert second["metadata"]["cached"] is True
+    assert {key: value for key, value in second.items() if key != "metadata"} == first
+    assert cache.stats()["hits"] == 1
+
+    # 不同种子的预测各自缓存
+    bridge.get_quantum_prediction("day", emit=False, seed=12)
+    assert cache.stats()["size"] == 2
@@ -0,0 +1,58 @@
+"""预测随机数生成器的测试：相同种子得到相同预测，未指定种子的批量请求使用互相独立的子序列"""
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def no_prediction_cache(bridge, monkeypatch):
+    # 关闭预测缓存，确保每次都重新模拟
+    monkeypatch.setattr(bridge, "PREDICTION_CACHE", None)
+
+
+def without_timestamp(prediction):
+    assert "error" not in prediction
+    return {key: value for key, value in prediction.items() if key != "timestamp"}
+
+
+def test_seeded_prediction_is_reproducible(bridge):
+    first = bridge.get_quantum_prediction("day", emit=False, seed=42)
+    second = bridge.get_quantum_prediction("day", emit=False, seed=42)
+    other = bridge.get_quantum_prediction("day", emit=False, seed=43)
+    assert without_timestamp(first) == without_timestamp(second)
+    assert without_timestamp(first) != without_timestamp(other)
+
+
+def test_user_seed_depends_on_time_span(bridge):
+    day = bridge.get_request_rng("day", user="alice").random(4)
+    assert np.array_equal(day, bridge.get_request_rng("day", user="alice").random(4))
+    assert not np.array_equal(day, bridge.get_request_rng("week", user="alice").random(4))
+    # 字符串种子与用户一样经过哈希，整数种子直接使用
+    assert np.array_equal(bridge.get_request_rng(seed=7).random(4), np.random.default_rng(7).random(4))
+    assert np.array_equal(bridge.get_request_rng(seed="7").random(4), bridge.get_request_rng(seed="7").random(4))
+
+
+def test_spawned_streams_are_independent(bridge):
+    children = np.random.SeedSequence(0).spawn(2)
+    first = bridge.get_request_rng(fallback=children[0]).random(8)
+    second = bridge.get_request_rng(fallback=children[1]).random(8)
+    assert not np.array_equal(first, second)
+    # 指定种子时忽略 fallback
+    assert np.array_equal(
+        bridge.get_request_rng(seed=3, fallback=children[0]).random(8), np.random.default_rng(3).random(8)
+    )
+
+
+def test_batch_predictions_are_seeded_per_request(bridge):
+    requests = [{"time_span": "day", "seed": 1}, {"time_span": "day", "seed": 2}, {"time_span": "day", "seed": 1}]
+    first = [without_timestamp(p) for p in bridge.get_quantum_predictions_batch(requests, emit=False)]
+    second = [without_timestamp(p) for p in bridge.get_quantum_predictions_batch(requests, emit=False)]
+    assert first == second
+    assert first[0] == first[2]
+    assert first[0] != first[1]
+
+
+def test_unseeded_batch_requests_differ(bridge):
+    predictions = bridge.get_quantum_predictions_batch(["day"] * 4, emit=False)
+    fortunes = {repr(without_timestamp(prediction)["fortune"]) for prediction in predictions}
+    assert len(fortunes) == 4
@@ -0,0 +1,146 @@
+"""常驻服务的请求级测试：准入控制、retry_after、请求截止时间和按会话保存的电路"""
+
+import io
+import json
+import threading
+import time
+
+import pytest
+
+
+def responses(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def by_id(stream):
+    return {response["id"]: response for response in responses(stream)}
+
+
+@pytest.fixture
+def blocking_devices(bridge, monkeypatch):
+    # devices 命令阻塞到 release 被设置，用来占住工作线程
+    release = threading.Event()
+    started = threading.Event()
+
+    def get_available_devices(emit=True):
+        started.set()
+        release.wait(10)
+        return [{"id": "test"}]
+
+    monkeypatch.setattr(bridge, "get_available_devices", get_available_devices)
+    yield started, release
+    release.set()
+
+
+def test_requests_past_queue_depth_are_rejected_with_retry_after(bridge, blocking_devices):
+    started, release = blocking_devices
+    output = io.StringIO()
+    server = bridge.BridgeServer(output, workers=1, queue_depth=1)
+    server.submit({"id": 1, "command": "devices"})
+    assert started.wait(5)
+    server.submit({"id": 2, "command": "devices"})
+    # 轻量命令在读取线程中直接处理，服务繁忙时也能响应
+    server.submit({"id": 3, "command": "ping"})
+
+    rejected = by_id(output)[2]
+    assert rejected["ok"] is False
+    assert rejected["retry_after"] >= bridge.SERVE_RETRY_AFTER
+    assert by_id(output)[3]["result"]["pong"] is True
+    assert server.stats()["rejected"] == 1
+
+    release.set()
+    server.shutdown()
+    assert by_id(output)[1]["result"] == {"devices": [{"id": "test"}]}
+    assert server.stats() == {"workers": 1, "queue_depth": 1, "pending": 0, "accepted": 1, "rejected": 1}
+
+
+def test_retry_after_scales_with_backlog(bridge):
+    server = bridge.BridgeServer(io.StringIO(), workers=2, queue_depth=8)
+    server._recent.extend([2.0] * 5)
+    server.pending = 4
+    assert server.retry_after() == pytest.approx(4.0)
+    server.pending = 0
+    assert server.retry_after() == bridge.SERVE_RETRY_AFTER
+    server.shutdown()
+
+
+def test_expired_deadline_is_answered_before_work_starts(bridge, blocking_devices):
+    started, _ = blocking_devices
+    output = io.StringIO()
+    server = bridge.BridgeServer(output, workers=1)
+    server.submit({"id": 1, "command": "devices", "params": {"deadline_ms": 0}})
+    server.shutdown()
+    assert responses(output) == [bridge.deadline_exceeded_response(1)]
+    assert not started.is_set()
+
+
+def test_deadline_expiry_while_running_answers_once(bridge, blocking_devices):
+    started, release = blocking_devices
+    output = io.StringIO()
+    server = bridge.BridgeServer(output, workers=1)
+    server.submit({"id": 1, "command": "devices", "params": {"deadline_ms": 50}})
+    assert started.wait(5)
+    time.sleep(0.2)
+    assert responses(output) == [bridge.deadline_exceeded_response(1)]
+
+    # 工作线程完成后不再写出第二条响应
+    release.set()
+    server.shutdown()
+    assert responses(output) == [bridge.deadline_exceeded_response(1)]
+
+
+def test_timed_stage_raises_after_deadline(bridge):
+    with bridge.request_context(deadline=time.monotonic() - 1):
+        with pytest.raises(bridge.DeadlineExceeded):
+            with bridge.timed_stage("simulation"):
+                pass
+        # 计算阶段在截止时间后开始时，请求返回超时响应而不是错误
+        response = bridge.handle_bridge_request({"id": 7, "command": "predict", "params": {"seed": 1}})
+    assert response == bridge.deadline_exceeded_response(7)
+
+    with bridge.timed_stage("simulation"):
+        pass
+
+
+def test_serve_bridge_answers_every_request(bridge):
+    lines = [
+        {"id": 1, "command": "ping"},
+        {"id": 2, "command": "validate", "params": {"circuit": {"qubits": [], "gates": []}}},
+        {"id": 3, "command": "unknown"},
+        {"id": 4, "command": "shutdown"}
+    ]
+    output = io.StringIO()
+    bridge.serve_bridge(io.StringIO("\n".join(json.dumps(line) for line in lines) + "\nnot json\n"), output, workers=2)
+    results = by_id(output)
+    assert results[1]["ok"] is True
+    assert results[2]["result"]["valid"] is False
+    assert results[3]["ok"] is False
+    assert results[4]["result"] == {"shutdown": True}
+    assert bridge.ACTIVE_SERVER is None
+
+
+def test_circuit_store_keeps_one_circuit_per_session(bridge):
+    store = bridge.CircuitStore(max_size=2)
+    store.put("a", session="alice")
+    store.put("b", session="bob")
+    with bridge.request_context(session="alice"):
+        assert store.get() == "a"
+        store.put("a2")
+    store.put("c", session="carol")
+
+    # 最久未使用的 bob 被淘汰
+    assert store.get("bob") is None
+    assert store.get("alice") == "a2"
+    assert store.get("carol") == "c"
+    assert store.get() is None
+    assert store.stats() == {"sessions": 2, "max_sessions": 2}
+
+
+def test_sessions_see_their_own_circuit(bridge, monkeypatch):
+    monkeypatch.setattr(bridge, "CIRCUIT_STORE", bridge.CircuitStore())
+    with bridge.request_context(session="alice"):
+        created = bridge.create_quantum_circuit(3)
+    with bridge.request_context(session="bob"):
+        bridge.create_quantum_circuit(4)
+    assert bridge.CIRCUIT_STORE.get("alice") is created
+    assert bridge.CIRCUIT_STORE.get("bob").num_qubits == 4
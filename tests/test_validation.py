@@ -0,0 +1,112 @@
+"""电路校验器的错误路径测试：每类错误的位置、类别，以及请求级别的错误响应"""
+
+import copy
+import io
+import json
+
+import pytest
+
+
+def frontend_circuit(num_qubits=3):
+    return {
+        "qubits": [{"name": f"q{i}"} for i in range(num_qubits)],
+        "gates": [
+            {"name": "H", "column": 0, "targets": [0], "controls": []},
+            {"name": "CNOT", "column": 1, "targets": [1], "controls": [0]},
+            {"name": "measure", "column": 2, "targets": [2], "controls": []}
+        ],
+        "metadata": {"description": "test", "createdAt": "2024-01-01T00:00:00"}
+    }
+
+
+def codes(bridge, circuit):
+    return [(error["path"], error["code"]) for error in bridge.get_circuit_validation_errors(circuit)]
+
+
+def test_valid_circuit_has_no_errors(bridge):
+    assert bridge.get_circuit_validation_errors(frontend_circuit()) == []
+    assert bridge.validate_circuit_report(frontend_circuit()) == {"valid": True, "errors": []}
+
+
+@pytest.mark.parametrize("edit, expected", [
+    (lambda c: c.pop("gates"), [("gates", "missing")]),
+    (lambda c: c["metadata"].pop("createdAt"), [("metadata.createdAt", "missing")]),
+    (lambda c: c.update(qubits={}), [("qubits", "type")]),
+    (lambda c: c["qubits"].__setitem__(1, "q1"), [("qubits[1]", "type")]),
+    (lambda c: c["qubits"][2].update(name=2), [("qubits[2].name", "type")]),
+    (lambda c: c["gates"][0].update(column=True), [("gates[0].column", "type")]),
+    (lambda c: c["gates"][1].pop("controls"), [("gates[1].controls", "missing")]),
+    (lambda c: c["gates"][1].update(targets=["1"]), [("gates[1].targets[0]", "type")]),
+    (lambda c: c["gates"][0].update(column=-1), [("gates[0].column", "order")]),
+    (lambda c: c["gates"][2].update(column=0), [("gates[2].column", "order")]),
+    (lambda c: c["gates"][0].update(targets=[3]), [("gates[0].targets[0]", "out_of_range")]),
+    (lambda c: c["gates"][1].update(controls=[-1]), [("gates[1].controls[0]", "out_of_range")]),
+    (lambda c: c["gates"][1].update(controls=[]), [("gates[1]", "invalid_gate")]),
+    (lambda c: c["gates"][1].update(controls=[1]), [("gates[1]", "invalid_gate")]),
+])
+def test_each_error_path(bridge, edit, expected):
+    circuit = frontend_circuit()
+    edit(circuit)
+    assert codes(bridge, circuit) == expected
+
+
+def test_non_object_circuit(bridge):
+    assert codes(bridge, [1, 2]) == [("", "type")]
+
+
+def test_errors_are_capped(bridge):
+    circuit = frontend_circuit()
+    circuit["gates"] = [{"name": "H", "column": 0, "targets": [9], "controls": []}] * (bridge.MAX_VALIDATION_ERRORS + 5)
+    errors = bridge.get_circuit_validation_errors(circuit)
+    assert len(errors) == bridge.MAX_VALIDATION_ERRORS
+    assert {error["code"] for error in errors} == {"out_of_range"}
+
+
+def test_in_place_edits_are_revalidated(bridge):
+    circuit = frontend_circuit()
+    assert bridge.get_circuit_validation_errors(circuit) == []
+    circuit["gates"][0]["targets"][0] = 7
+    assert codes(bridge, circuit) == [("gates[0].targets[0]", "out_of_range")]
+    circuit["gates"][0]["targets"][0] = 0
+    assert bridge.get_circuit_validation_errors(circuit) == []
+
+
+def test_packed_circuit_errors(bridge):
+    packed = bridge.pack_circuit(frontend_circuit())
+    assert packed.validation_errors() == []
+
+    internal = {"circuit_id": "test", "num_qubits": 2, "operations": [
+        {"name": "h", "qubits": [0]}, {"name": "cx", "qubits": [1, 1]}, {"name": "h", "qubits": [5]}
+    ]}
+    report = bridge.validate_circuit_report(internal)
+    assert report["valid"] is False
+    assert [(error["path"], error["code"]) for error in report["errors"]] == [
+        ("operations[1]", "invalid_gate"), ("operations[2]", "out_of_range")
+    ]
+
+
+def test_invalid_circuit_raises_structured_error(bridge):
+    circuit = frontend_circuit()
+    circuit["gates"][2]["column"] = 0
+    with pytest.raises(bridge.CircuitValidationError) as raised:
+        bridge.pack_circuit(copy.deepcopy(circuit))
+    assert raised.value.errors[0]["code"] == "order"
+
+
+def test_request_level_validation_errors(bridge):
+    circuit = frontend_circuit()
+    circuit["gates"][0]["targets"] = [4]
+    output = io.StringIO()
+    lines = [
+        {"id": 1, "command": "validate", "params": {"circuit": circuit}},
+        {"id": 2, "command": "submit", "params": {"circuit": circuit}},
+        {"id": 3, "command": "shutdown"}
+    ]
+    bridge.serve_bridge(io.StringIO("\n".join(json.dumps(line) for line in lines) + "\n"), output, workers=1)
+    responses = {response["id"]: response for response in map(json.loads, output.getvalue().splitlines())}
+
+    assert responses[1]["ok"] is True
+    assert responses[1]["result"]["valid"] is False
+    assert responses[1]["result"]["errors"][0]["code"] == "out_of_range"
+    assert responses[2]["ok"] is False
+    assert responses[2]["errors"] == responses[1]["result"]["errors"]
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+量子桥接基准测试脚本 - 测量 quantum-bridge.py 热点路径的耗时
+
+用法:
+    python tools/bench-bridge.py                       # 运行基准测试并与基线比较
+    python tools/bench-bridge.py --update-baseline     # 运行基准测试并保存为新基线
+    python tools/bench-bridge.py --threshold 0.5 --output bench.json
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BRIDGE_PATH = os.path.join(ROOT_DIR, "quantum-bridge.py")
+DEFAULT_BASELINE_PATH = os.path.join(ROOT_DIR, "tools", "bench-baseline.json")
+# 未指定 --threshold 时允许的相对退化比例
+DEFAULT_THRESHOLD = 0.25
+
+
+def load_bridge():
+    """按文件路径加载桥接模块（文件名含连字符，不能直接import）"""
+    spec = importlib.util.spec_from_file_location("quantum_bridge", BRIDGE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    with contextlib.redirect_stderr(io.StringIO()):
+        spec.loader.exec_module(module)
+    return module
+
+
+def time_call(func, repeat):
+    """重复调用函数，返回每次耗时（毫秒）"""
+    timings = []
+    for _ in range(repeat):
+        # 桥接模块把日志写入标准错误，计时期间屏蔽以免影响结果
+        with contextlib.redirect_stderr(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def retained_bytes(func):
+    """调用函数，返回其返回值仍然占用的内存字节数"""
+    with contextlib.redirect_stderr(io.StringIO()):
+        tracemalloc.start()
+        try:
+            result = func()
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+    del result
+    return size
+
+
+def summarize(name, timings, **params):
+    """汇总一组计时结果"""
+    return {
+        "name": name,
+        "params": params,
+        "repeat": len(timings),
+        "min_ms": min(timings),
+        "median_ms": statistics.median(timings),
+        "max_ms": max(timings)
+    }
+
+
+def build_internal_circuit(num_qubits, layers=1):
+    """构建与 create_quantum_circuit 相同形状（H层、CX链、RZ层）的内部格式电路"""
+    operations = []
+    for _ in range(layers):
+        operations += [{"name": "h", "qubits": [i]} for i in range(num_qubits)]
+        operations += [{"name": "cx", "qubits": [i, i + 1]} for i in range(num_qubits - 1)]
+        operations += [{"name": "rz", "qubits": [i], "params": [0.1 * (i + 1)]} for i in range(num_qubits)]
+    return {"circuit_id": "bench", "num_qubits": num_qubits, "operations": operations}
+
+
+def build_counts(num_outcomes, num_qubits, rng):
+    """构建包含指定数量不同结果的计数字典"""
+    outcomes = rng.choice(2**num_qubits, size=num_outcomes, replace=False)
+    counts = rng.integers(1, 100, size=num_outcomes)
+    return {format(int(o), f"0{num_qubits}b"): int(c) for o, c in zip(outcomes, counts)}
+
+
+def bench_simulation(bridge, np, quick):
+    """不同量子比特数和采样次数下的电路模拟"""
+    results = []
+    qubit_counts = [4, 8, 12] if quick else [4, 8, 12, 16, 20]
+    for num_qubits in qubit_counts:
+        # 该电路形状在 STABILIZER_MIN_QUBITS 及以上会自动交给稳定子后端，这里固定使用稠密后端，
+        # 使各规模的结果可以相互比较
+        circuit = bridge.pack_circuit(build_internal_circuit(num_qubits))
+        compiled = bridge.get_compiled_circuit(circuit)
+        parameters = bridge.bind_circuit_parameters(compiled, circuit)
+        rng = np.random.default_rng(0)
+        timings = time_call(
+            lambda: bridge.simulate_compiled_circuit(compiled, parameters, 1024, rng, workers=1, backend="dense"),
+            3 if num_qubits >= 16 else 10
+        )
+        results.append(summarize(f"simulate/qubits={num_qubits}", timings, num_qubits=num_qubits, shots=1024,
+                                 backend="dense"))
+
+    # 预测电路形状（H层、CX链、末尾RZ层）是Clifford电路，由稳定子后端模拟
+    for num_qubits in ([100] if quick else [100, 500]):
+        circuit = build_internal_circuit(num_qubits)
+        rng = np.random.default_rng(0)
+        timings = time_call(lambda: bridge.simulate_quantum_circuit(circuit, 1024, rng), 3)
+        results.append(summarize(f"simulate/stabilizer/qubits={num_qubits}", timings, num_qubits=num_qubits, shots=1024))
+    
+    shot_counts = [10**3, 10**5] if quick else [10**3, 10**4, 10**5, 10**6]
+    circuit = build_internal_circuit(10)
+    for shots in shot_counts:
+        rng = np.random.default_rng(0)
+        timings = time_call(lambda: bridge.simulate_quantum_circuit(circuit, shots, rng), 5)
+        results.append(summarize(f"simulate/shots={shots}", timings, num_qubits=10, shots=shots))
+    return results
+
+
+def bench_analysis(bridge, np, quick):
+    """不同计数字典规模下的结果分析和边缘统计"""
+    results = []
+    sizes = [16, 1000, 10000] if quick else [16, 1000, 10000, 100000]
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        counts = build_counts(size, 20, rng)
+        timings = time_call(lambda: bridge.analyze_quantum_results({"results": counts}), 5)
+        results.append(summarize(f"analyze/outcomes={size}", timings, outcomes=size))
+    
+    # 由态向量一次性计算单比特边缘概率、成对联合概率和约化态非对角元
+    for num_qubits in ([12, 16] if quick else [12, 16, 20]):
+        state = rng.normal(size=2**num_qubits) + 1j * rng.normal(size=2**num_qubits)
+        state /= np.linalg.norm(state)
+        timings = time_call(lambda: bridge.QubitMarginals.from_state_vector(state, num_qubits), 5)
+        results.append(summarize(f"marginals/qubits={num_qubits}", timings, num_qubits=num_qubits))
+    return results
+
+
+def bench_conversion(bridge, np, quick):
+    """不同电路规模下的格式转换和校验"""
+    results = []
+    layer_counts = [1, 100] if quick else [1, 100, 1000]
+    for layers in layer_counts:
+        circuit = build_internal_circuit(10, layers)
+        num_ops = len(circuit["operations"])
+        timings = time_call(lambda: bridge.convert_internal_circuit_to_frontend_format(circuit), 5)
+        results.append(summarize(f"convert/ops={num_ops}", timings, operations=num_ops))
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            frontend = bridge.convert_internal_circuit_to_frontend_format(circuit)
+        # 前端格式字典每次都完整校验；PackedCircuit 的校验结果缓存在对象上
+        num_gates = len(frontend["gates"])
+        timings = time_call(lambda: bridge.validate_circuit_data(frontend), 5)
+        results.append(summarize(f"validate/gates={num_gates}", timings, gates=num_gates))
+        packed = bridge.pack_circuit(frontend)
+        timings = time_call(lambda: bridge.validate_circuit_data(packed), 5)
+        results.append(summarize(f"validate/packed/gates={num_gates}", timings, gates=num_gates))
+    return results
+
+
+def bench_packed_circuit(bridge, np, quick):
+    """紧凑电路表示与字典格式的内存占用、转换和编译耗时"""
+    results = []
+    layer_counts = [100, 1000] if quick else [100, 1000, 3000]
+    for layers in layer_counts:
+        circuit = build_internal_circuit(10, layers)
+        num_ops = len(circuit["operations"])
+        with contextlib.redirect_stderr(io.StringIO()):
+            frontend = bridge.convert_internal_circuit_to_frontend_format(circuit)
+            packed = bridge.pack_circuit(circuit)
+
+        # 两种表示各自占用的内存（字典格式按JSON往返重建以排除共享对象）
+        dict_bytes = retained_bytes(lambda: json.loads(json.dumps(frontend)))
+        packed_bytes = retained_bytes(lambda: bridge.pack_circuit(frontend))
+        timings = time_call(lambda: bridge.pack_circuit(circuit), 5)
+        results.append(summarize(
+            f"pack/ops={num_ops}", timings,
+            operations=num_ops, dict_bytes=dict_bytes, packed_bytes=packed_bytes
+        ))
+
+        timings = time_call(packed.to_frontend, 5)
+        results.append(summarize(f"to-frontend/ops={num_ops}", timings, operations=num_ops))
+
+        # 编译：从前端格式字典解析，或直接读取紧凑表示的缓冲区
+        timings = time_call(lambda: bridge.compile_circuit(frontend), 3)
+        results.append(summarize(f"compile/dict/ops={num_ops}", timings, operations=num_ops))
+        timings = time_call(lambda: bridge.compile_circuit(packed), 3)
+        results.append(summarize(f"compile/packed/ops={num_ops}", timings, operations=num_ops))
+    return results
+
+
+def bench_prediction(bridge, np, quick):
+    """端到端预测：进程内调用和包含解释器启动的冷启动"""
+    results = []
+    timings = time_call(lambda: bridge.get_quantum_prediction("day", emit=False), 10)
+    results.append(summarize("predict/warm", timings))
+
+    def cold_start():
+        subprocess.run(
+            [sys.executable, BRIDGE_PATH, "predict", "day"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+        )
+
+    timings = time_call(cold_start, 3 if quick else 5)
+    results.append(summarize("predict/cold", timings))
+    return results
+
+
+def compare_with_baseline(results, baseline, threshold, min_delta_ms):
+    """将本次结果与基线比较，返回超过阈值的回归列表
+
+    绝对差值小于 min_delta_ms 的用例不算退化，避免亚毫秒级用例的计时抖动造成误报。
+    """
+    baseline_by_name = {entry["name"]: entry for entry in baseline.get("results", [])}
+    regressions = []
+    for entry in results:
+        reference = baseline_by_name.get(entry["name"])
+        if not reference:
+            continue
+        ratio = entry["median_ms"] / reference["median_ms"] if reference["median_ms"] > 0 else 1.0
+        entry["baseline_median_ms"] = reference["median_ms"]
+        entry["ratio"] = ratio
+        if ratio > 1 + threshold and entry["median_ms"] - reference["median_ms"] >= min_delta_ms:
+            regressions.append(entry)
+    return regressions
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="量子桥接基准测试")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="基线文件路径")
+    parser.add_argument("--update-baseline", action="store_true", help="将本次结果保存为基线")
+    parser.add_argument(
+        "--threshold", type=float, help="允许的相对退化比例，默认0.25即25%%；指定时基线文件必须存在"
+    )
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="判定退化所需的最小绝对差值（毫秒）")
+    parser.add_argument("--output", help="将结果写入JSON文件（默认输出到标准输出）")
+    parser.add_argument("--quick", action="store_true", help="只运行较小规模的用例")
+    args = parser.parse_args()
+
+    # 显式要求比较时，缺少基线不能当作通过
+    if args.threshold is not None and not args.update_baseline and not os.path.exists(args.baseline):
+        sys.stderr.write(f"未找到基线文件 {args.baseline}，请先运行 --update-baseline\n")
+        sys.exit(2)
+    threshold = args.threshold if args.threshold is not None else DEFAULT_THRESHOLD
+
+    bridge = load_bridge()
+    np = bridge.np
+
+    results = []
+    for bench in (bench_simulation, bench_analysis, bench_conversion, bench_packed_circuit, bench_prediction):
+        sys.stderr.write(f"运行 {bench.__doc__}\n")
+        results += bench(bridge, np, args.quick)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "threshold": threshold,
+        "results": results
+    }
+
+    regressions = []
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        sys.stderr.write(f"基线已保存到 {args.baseline}\n")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, threshold, args.min_delta_ms)
+    else:
+        sys.stderr.write(f"未找到基线文件 {args.baseline}，跳过比较\n")
+
+    report["regressions"] = [entry["name"] for entry in regressions]
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    for entry in regressions:
+        sys.stderr.write(
+            f"性能退化: {entry['name']} 中位数 {entry['median_ms']:.2f}ms，"
+            f"基线 {entry['baseline_median_ms']:.2f}ms（{entry['ratio']:.2f}倍）\n"
+        )
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
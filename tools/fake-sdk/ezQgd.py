@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+国盾量子SDK (ezQgd) 的本地替身 - 用于在没有真实设备时测试作业提交流程
+
+用法:
+    PYTHONPATH=tools/fake-sdk python quantum-bridge.py submit "" 1024 test-key
+    PYTHONPATH=tools/fake-sdk python quantum-bridge.py result <job_id> test-key
+
+行为由环境变量（或同名模块属性）控制:
+    EZQGD_FAKE_LATENCY               作业从提交到完成的秒数，默认1.0
+    EZQGD_FAKE_FAILURE_RATE          作业执行失败的概率，默认0
+    EZQGD_FAKE_SUBMIT_FAILURE_RATE   提交时抛出异常的概率，默认0
+    EZQGD_FAKE_STATE_PATH            作业状态文件，默认在系统临时目录中
+
+作业状态保存在文件中，因此不同进程之间可以互相查询作业。
+"""
+
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+
+LATENCY = float(os.environ.get("EZQGD_FAKE_LATENCY", "1.0"))
+FAILURE_RATE = float(os.environ.get("EZQGD_FAKE_FAILURE_RATE", "0"))
+SUBMIT_FAILURE_RATE = float(os.environ.get("EZQGD_FAKE_SUBMIT_FAILURE_RATE", "0"))
+STATE_PATH = os.environ.get("EZQGD_FAKE_STATE_PATH", os.path.join(tempfile.gettempdir(), "fake-ezqgd-jobs.json"))
+
+# 桥接脚本会在多个线程中并发调用SDK，读改写状态文件时需要加锁
+_STATE_LOCK = threading.Lock()
+
+
+def _load_jobs():
+    try:
+        with open(STATE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_jobs(jobs):
+    temp_path = STATE_PATH + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(jobs, f)
+    os.replace(temp_path, STATE_PATH)
+
+
+def _get_job(job_id):
+    with _STATE_LOCK:
+        job = _load_jobs().get(job_id)
+    if job is None:
+        raise KeyError(f"未知作业: {job_id}")
+    return job
+
+
+def submit_job(circuit, shots=1024, api_key=None):
+    """提交电路，返回作业ID"""
+    if not api_key:
+        raise PermissionError("缺少API密钥")
+    if random.random() < SUBMIT_FAILURE_RATE:
+        raise ConnectionError("模拟的提交失败")
+
+    job_id = f"fake_{uuid.uuid4().hex[:12]}"
+    with _STATE_LOCK:
+        jobs = _load_jobs()
+        jobs[job_id] = {
+            "num_qubits": circuit.get("num_qubits") or len(circuit.get("qubits", [])),
+            "shots": shots,
+            "ready_at": time.time() + LATENCY,
+            "fails": random.random() < FAILURE_RATE
+        }
+        _save_jobs(jobs)
+    return job_id
+
+
+def get_job_status(job_id, api_key=None):
+    """返回作业状态: QUEUED、RUNNING、COMPLETED 或 FAILED"""
+    job = _get_job(job_id)
+    remaining = job["ready_at"] - time.time()
+    if remaining > LATENCY / 2:
+        return "QUEUED"
+    if remaining > 0:
+        return "RUNNING"
+    return "FAILED" if job["fails"] else "COMPLETED"
+
+
+def get_job_result(job_id, api_key=None):
+    """返回已完成作业的测量计数 {比特串: 计数}"""
+    if get_job_status(job_id, api_key) != "COMPLETED":
+        raise RuntimeError(f"作业 {job_id} 尚未完成")
+    job = _get_job(job_id)
+
+    # 以作业ID为种子生成均匀随机的测量结果，同一作业每次查询结果相同
+    rng = random.Random(job_id)
+    counts = {}
+    for _ in range(job["shots"]):
+        outcome = format(rng.getrandbits(job["num_qubits"]), f"0{job['num_qubits']}b")
+        counts[outcome] = counts.get(outcome, 0) + 1
+    return counts